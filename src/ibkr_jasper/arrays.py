@@ -0,0 +1,17 @@
+import numpy as np
+import polars as pl
+
+
+def to_numpy(series: pl.Series) -> np.ndarray:
+    """
+    Copy of numeric or temporal series as numpy array read straight from its buffer.
+    Series.to_numpy converts through pyarrow, which imports pandas, and that import takes longer than a whole load from saved stages.
+    Nulls of floats become NaN, series of other types should not have nulls.
+    """
+    if series.dtype == pl.Date:
+        return np.array(series.cast(pl.Int32).view(ignore_nulls=True)).astype('datetime64[D]')
+    if series.dtype == pl.Datetime:
+        return np.array(series.cast(pl.Int64).view(ignore_nulls=True)).astype(f'datetime64[{series.time_unit}]')
+    if series.dtype in (pl.Float32, pl.Float64):
+        series = series.fill_null(np.nan)
+    return np.array(series.view(ignore_nulls=True))
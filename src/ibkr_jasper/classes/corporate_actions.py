@@ -0,0 +1,68 @@
+from __future__ import annotations
+import polars as pl
+from datetime import timedelta
+from pathlib import Path
+
+from src.ibkr_jasper.classes.ipc_cache import IpcCache
+
+
+class CorporateActions:
+    """
+    Splits, reverse splits and renames of tickers applied to frames of all tickers at once.
+    Factor of a split is the product of it and all later splits of the ticker, so a deal made before the split
+    is brought to today's shares by the factor of the first split after the deal.
+    """
+    VERSION = 1
+    SCHEMA = {'ticker': pl.Utf8, 'datetime': pl.Datetime, 'splits': pl.Float64, 'factor': pl.Float64}
+
+    def __init__(self, path: Path) -> None:
+        self.cache = IpcCache(path, 'split_factors', self.VERSION, self.SCHEMA)
+        self.factors = pl.DataFrame({x: [] for x in self.SCHEMA}, columns=self.SCHEMA)
+        self.aliases = {}  # other names of tickers in statements, e.g. SXR8 for SXR8.DE
+
+    @staticmethod
+    def get_factors(splits: pl.DataFrame) -> pl.DataFrame:
+        return (splits.sort(['ticker', 'datetime']).with_columns(pl.col('splits').cumprod(reverse=True).over('ticker').alias('factor')))
+
+    def load(self, splits: pl.DataFrame, tickers: set[str], aliases: dict[str, str]) -> None:
+        """Takes saved factors and recalculates them only for tickers with new or changed splits"""
+        self.aliases = aliases
+        splits = (splits.select(['ticker', 'datetime', 'splits']).with_columns(pl.col('ticker').cast(pl.Utf8)).filter(pl.col('ticker').is_in(list(tickers))))
+        saved_factors = self.cache.load()
+        if saved_factors is None:
+            saved_factors = self.factors
+
+        keys = ['ticker', 'datetime', 'splits']
+        saved_splits = saved_factors.select(keys).filter(pl.col('ticker').is_in(list(tickers)))
+        changed_tickers = set(splits.join(saved_splits, on=keys, how='anti')['ticker'].to_list())
+        changed_tickers |= set(saved_splits.join(splits, on=keys, how='anti')['ticker'].to_list())
+        if changed_tickers:
+            new_factors = self.get_factors(splits.filter(pl.col('ticker').is_in(list(changed_tickers))))
+            saved_factors = (pl.concat([saved_factors.filter(~pl.col('ticker').is_in(list(changed_tickers))), new_factors]).sort(['ticker', 'datetime']))
+            self.cache.save(saved_factors)
+
+        self.factors = saved_factors.filter(pl.col('ticker').is_in(list(tickers)))
+
+    def get_ticker(self) -> pl.Expr:
+        ticker = pl.col('ticker').cast(pl.Utf8)
+        for alias, name in self.aliases.items():
+            ticker = pl.when(pl.col('ticker').cast(pl.Utf8) == alias).then(pl.lit(name)).otherwise(ticker)
+        return ticker
+
+    def adjust(self, frame: pl.LazyFrame, time_column: str, quantity_columns: list[str], price_columns: list[str]) -> pl.LazyFrame:
+        """
+        Renames tickers and brings quantities and prices of all rows to today's shares in one as-of join grouped by ticker.
+        Row on a date, not a time, takes splits made after that date, because its quantity is known at the end of the day.
+        """
+        time = pl.col(time_column).cast(pl.Datetime)
+        if frame.schema[time_column] == pl.Date:
+            time = time + timedelta(days=1)
+
+        factors = self.factors.select([pl.col('ticker').alias('__ticker'), pl.col('datetime').alias('__datetime'), 'factor']).sort('__datetime').lazy()
+        adjusted_columns = ([pl.col(x) * pl.col('factor') for x in quantity_columns] + [pl.col(x) / pl.col('factor') for x in price_columns] +
+                            [pl.col('__ticker').cast(frame.schema['ticker']).alias('ticker')])
+        return (frame.with_row_count('__row').with_columns([
+            self.get_ticker().alias('__ticker'),
+            time.alias('__datetime'),
+        ]).sort('__datetime').join_asof(factors, on='__datetime', by='__ticker', strategy='forward').with_columns(
+            pl.col('factor').fill_null(1.0)).with_columns(adjusted_columns).sort('__row').select(frame.columns))
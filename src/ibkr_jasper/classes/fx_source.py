@@ -0,0 +1,60 @@
+from __future__ import annotations
+import polars as pl
+from datetime import date
+from pathlib import Path
+
+
+class FxSource:
+    """Provider of official exchange rates of currencies to rubles"""
+    # ids of currencies in Central Bank of Russia API
+    CBR_CURRENCY_IDS = {
+        'USD': 'R01235',
+        'EUR': 'R01239',
+        'GBP': 'R01035',
+        'CHF': 'R01775',
+        'CNY': 'R01375',
+        'HKD': 'R01200',
+        'JPY': 'R01820',
+        'CAD': 'R01350',
+    }
+
+    def download(self, curr: str, start: date, end: date) -> pl.DataFrame:
+        """
+        Gives rates published for dates from start to end inclusive
+        :return: frame with columns date, rate
+        """
+        raise NotImplementedError
+
+    @staticmethod
+    def parse_cbr_xml(xml: str) -> pl.DataFrame:
+        import pandas as pd
+        try:
+            records = pd.read_xml(xml)
+        except ValueError:
+            # there are no records for this range of dates
+            return pl.DataFrame({'date': [], 'rate': []}, columns={'date': pl.Date, 'rate': pl.Float64})
+
+        return (pl.DataFrame(records[['Date', 'Nominal', 'Value']].astype(str)).with_columns([
+            pl.col('Date').str.strptime(pl.Date, fmt='%d.%m.%Y').alias('date'),
+            (pl.col('Value').str.replace(',', '.').cast(pl.Float64) / pl.col('Nominal').cast(pl.Float64)).alias('rate'),
+        ]).select(['date', 'rate']))
+
+
+class CbrFxSource(FxSource):
+
+    def download(self, curr: str, start: date, end: date) -> pl.DataFrame:
+        s = start.strftime('%d/%m/%Y')
+        e = end.strftime('%d/%m/%Y')
+        url = f'https://www.cbr.ru/scripts/XML_dynamic.asp?date_req1={s}&date_req2={e}&VAL_NM_RQ={self.CBR_CURRENCY_IDS[curr]}'
+        return self.parse_cbr_xml(url)
+
+
+class FileFxSource(FxSource):
+    """Stand-in for tests and offline runs, reads responses of Central Bank API saved as <currency>.xml files in a folder"""
+
+    def __init__(self, path: Path) -> None:
+        self.path = path
+
+    def download(self, curr: str, start: date, end: date) -> pl.DataFrame:
+        rates = self.parse_cbr_xml(str(self.path / f'{curr}.xml'))
+        return rates.filter((pl.col('date') >= start) & (pl.col('date') <= end))
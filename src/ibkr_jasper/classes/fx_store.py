@@ -0,0 +1,111 @@
+from __future__ import annotations
+import json
+import polars as pl
+from datetime import date, timedelta
+from pathlib import Path
+
+from src.ibkr_jasper.classes.fx_source import FxSource
+from src.ibkr_jasper.classes.ipc_cache import IpcCache
+from src.ibkr_jasper.profiler import Profiler
+
+
+class FxStore:
+    """
+    Exchange rates of currencies to rubles, saved as one memory-mapped Arrow IPC file per currency.
+    Only ranges of dates that were never loaded for a currency are requested from the source.
+    """
+    VERSION = 1
+    SCHEMA = {'date': pl.Date, 'rate': pl.Float64}
+    BASE_CURRENCY = 'RUB'
+    COVERAGE_FILE_NAME = 'coverage.json'
+
+    def __init__(self, path: Path, source: FxSource) -> None:
+        self.path = path
+        self.source = source
+        self.coverage = {}  # range of loaded dates for each currency
+        self.rates = {}  # published rates for each currency
+        try:
+            with open(self.path / self.COVERAGE_FILE_NAME) as file:
+                self.coverage = {k: (date.fromisoformat(v[0]), date.fromisoformat(v[1])) for k, v in json.load(file).items()}
+        except (FileNotFoundError, json.JSONDecodeError):
+            pass
+
+    def get_partition(self, curr: str) -> IpcCache:
+        return IpcCache(self.path, curr, self.VERSION, self.SCHEMA)
+
+    def get_gaps(self, curr: str, first_date: date, last_date: date) -> list[tuple[date, date]]:
+        if curr not in self.coverage:
+            return [(first_date, last_date)]
+        saved_start, saved_end = self.coverage[curr]
+        gaps = []
+        if first_date < saved_start:
+            gaps.append((first_date, saved_start - timedelta(days=1)))
+        if saved_end < last_date:
+            gaps.append((saved_end + timedelta(days=1), last_date))
+        return gaps
+
+    def load(self, currencies: set[str], first_date: date, last_date: date) -> None:
+        """Loads saved rates of currencies and downloads missing dates"""
+        for curr in sorted(currencies - {self.BASE_CURRENCY}):
+            if curr not in FxSource.CBR_CURRENCY_IDS:
+                print(f'Exchange rates for {curr} are not supported')
+                continue
+
+            saved_rates = self.get_partition(curr).load() if curr in self.coverage else None
+            if saved_rates is None:
+                self.coverage.pop(curr, None)
+            saved_rates = [] if saved_rates is None else [saved_rates]
+
+            gaps = self.get_gaps(curr, first_date, last_date)
+            Profiler.count('fx cache miss' if gaps else 'fx cache hit')
+            if not gaps:
+                self.rates[curr] = saved_rates[0]
+                continue
+
+            # downloaded rates go first to replace saved ones
+            new_rates = [self.source.download(curr, gap_start, gap_end) for gap_start, gap_end in gaps]
+            self.rates[curr] = pl.concat(new_rates + saved_rates).unique(subset='date', keep='first').sort('date')
+            saved_start, saved_end = self.coverage.get(curr, (first_date, last_date))
+            self.coverage[curr] = (min(first_date, saved_start), max(last_date, saved_end))
+            self.save(curr)
+
+    def save(self, curr: str) -> None:
+        self.get_partition(curr).save(self.rates[curr])
+        with open(self.path / self.COVERAGE_FILE_NAME, 'w') as file:
+            json.dump({k: (v[0].isoformat(), v[1].isoformat()) for k, v in self.coverage.items()}, file)
+
+    def get_all_rates(self) -> pl.DataFrame:
+        """All published rates in one frame sorted by date, base currency has no rows"""
+        rates = [v.with_columns(pl.lit(k).alias('curr')) for k, v in self.rates.items()]
+        if not rates:
+            return pl.DataFrame({'date': [], 'curr': [], 'rate': []}, columns={'date': pl.Date, 'curr': pl.Utf8, 'rate': pl.Float64})
+        return pl.concat(rates).select(['date', 'curr', 'rate']).sort('date')
+
+    def add_rates(self,
+                  frame: pl.DataFrame,
+                  rates: pl.DataFrame = None,
+                  date_column: str = 'date',
+                  curr_column: str = 'curr',
+                  rate_column: str = 'rate') -> pl.DataFrame:
+        """
+        Adds rate of currency in curr_column on date in date_column for all rows at once, rates are all loaded rates by default.
+        Central bank publishes exchange rates for Tuesdays to Saturdays, so dates without rate take the next published one,
+        and the latest dates, which do not have the next rate yet, take the last one.
+        """
+        if rates is None:
+            rates = self.get_all_rates()
+        rates = rates.with_columns(pl.col('curr').cast(pl.Utf8)).rename({'date': '__rate_date', 'curr': '__rate_curr'})
+        last_rates = rates.groupby('__rate_curr').agg(pl.col('rate').last().alias('__last_rate'))
+        keys_rates = (frame.select([
+            pl.col(date_column).cast(pl.Date).alias('__rate_date'),
+            pl.col(curr_column).cast(pl.Utf8).alias('__rate_curr'),
+        ]).with_row_count('__row').sort('__rate_date').join_asof(rates, on='__rate_date', by='__rate_curr', strategy='forward').join(
+            last_rates, on='__rate_curr', how='left').with_columns(
+                pl.when(pl.col('__rate_curr') == self.BASE_CURRENCY).then(pl.lit(1.0)).otherwise(pl.col('rate').fill_null(pl.col('__last_rate'))).alias(
+                    rate_column)).sort('__row').get_column(rate_column))
+        return frame.with_columns(keys_rates)
+
+    def add_base_currency_columns(self, frame: pl.DataFrame, rates: pl.DataFrame, date_column: str, columns: list[str]) -> pl.DataFrame:
+        """Adds rate to base currency on date of each row and columns converted with it, e.g. price_rub for price"""
+        suffix = self.BASE_CURRENCY.lower()
+        return self.add_rates(frame, rates, date_column).with_columns([(pl.col(x) * pl.col('rate')).alias(f'{x}_{suffix}') for x in columns])
@@ -0,0 +1,49 @@
+from __future__ import annotations
+import os
+import polars as pl
+from pathlib import Path
+from typing import Union
+
+
+class IpcCache:
+    """
+    Frame saved on disk as Arrow IPC file, which is opened memory-mapped without copying.
+    File name carries version of the cache format and columns are checked against expected schema,
+    so caches written by older versions are detected and rebuilt instead of being misread.
+    """
+
+    def __init__(self, path: Path, name: str, version: int, schema: dict = None) -> None:
+        self.file_path = path / f'{name}.v{version}.ipc'
+        self.schema = schema
+
+    def exists(self) -> bool:
+        return self.file_path.is_file()
+
+    def is_stale(self, schema: dict) -> bool:
+        return self.schema is not None and dict(schema) != self.schema
+
+    def load(self) -> Union[pl.DataFrame, None]:
+        if not self.exists():
+            return None
+        frame = pl.read_ipc(self.file_path, memory_map=True)
+        if self.is_stale(frame.schema):
+            print(f'Cache file {self.file_path.name} has wrong format and will be rebuilt')
+            return None
+        return frame
+
+    def scan(self) -> Union[pl.LazyFrame, None]:
+        """Gives lazy frame, so only filtered rows and selected columns are read from memory-mapped file"""
+        if not self.exists():
+            return None
+        frame = pl.scan_ipc(self.file_path, memory_map=True)
+        if self.is_stale(frame.schema):
+            print(f'Cache file {self.file_path.name} has wrong format and will be rebuilt')
+            return None
+        return frame
+
+    def save(self, frame: pl.DataFrame) -> None:
+        # file is replaced, not rewritten in place, so frames still mapped to the old file stay valid
+        self.file_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_file_path = self.file_path.with_suffix('.tmp')
+        frame.write_ipc(tmp_file_path)
+        os.replace(tmp_file_path, self.file_path)
@@ -0,0 +1,104 @@
+from __future__ import annotations
+import contextlib
+import io
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+from src.ibkr_jasper.classes.portfolio import Portfolio
+from src.ibkr_jasper.classes.total_portfolio import TotalPortfolio
+from src.ibkr_jasper.frame_writer import FrameWriter
+
+
+class JasperDaemon:
+    """
+    Keeps loaded total portfolio and portfolios in memory and answers commands over local HTTP,
+    e.g. GET /status/main, GET /status for all portfolios and GET /tlh.
+    Before each request stages needed for the command are loaded, so only stages affected by changed files are run again.
+    """
+    HOST = '127.0.0.1'
+    PORT = 8765
+
+    def __init__(self, port: int = PORT) -> None:
+        self.port = port
+        self.total_portfolio = TotalPortfolio()
+        self.portfolios = {}  # loaded portfolios by name
+        self.portfolios_keys = None  # keys of outputs of total portfolio that loaded portfolios are built from
+        self.commands = {
+            'status': (self.status, TotalPortfolio.PORTFOLIO_OUTPUTS),
+            'tlh': (self.tlh, ['tlh_trades']),
+        }
+
+    def refresh(self, outputs: list[str]) -> None:
+        """Loads outputs of total portfolio for a command and forgets loaded portfolios if their inputs changed"""
+        self.total_portfolio.load(outputs)
+        portfolios_keys = self.total_portfolio.graph.get_keys(TotalPortfolio.PORTFOLIO_OUTPUTS)
+        if portfolios_keys != self.portfolios_keys:
+            self.portfolios = {}
+            self.portfolios_keys = portfolios_keys
+
+    def get_portfolio(self, portfolio_name: str) -> Portfolio:
+        if portfolio_name not in self.portfolios:
+            self.portfolios[portfolio_name] = Portfolio(portfolio_name, self.total_portfolio).load()
+        return self.portfolios[portfolio_name]
+
+    def status(self, portfolio_name: str = None) -> None:
+        portfolio_names = sorted(self.total_portfolio.all_portfolios) if portfolio_name is None else [portfolio_name]
+        if not FrameWriter.is_table():
+            with FrameWriter() as writer:
+                for cur_portfolio_name in portfolio_names:
+                    for table, frame in self.get_portfolio(cur_portfolio_name).get_status_frames():
+                        writer.write(table, frame)
+            return
+
+        for cur_portfolio_name in portfolio_names:
+            port = self.get_portfolio(cur_portfolio_name)
+            if portfolio_name is None:
+                print(cur_portfolio_name)
+            port.print_report()
+            port.print_weights()
+
+    def tlh(self) -> None:
+        if not FrameWriter.is_table():
+            with FrameWriter() as writer:
+                writer.write('tlh', self.total_portfolio.tlh_trades)
+            return
+        self.total_portfolio.print_df(self.total_portfolio.tlh_trades)
+
+    def run(self, command: str, args: list[str]) -> str:
+        function, outputs = self.commands[command]
+        self.refresh(outputs)
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            function(*args)
+        return output.getvalue()
+
+    def get_handler(self) -> type[BaseHTTPRequestHandler]:
+        daemon = self
+
+        class Handler(BaseHTTPRequestHandler):
+
+            def do_GET(self) -> None:
+                command, *args = [x for x in self.path.split('/') if x] or ['']
+                if command not in daemon.commands:
+                    self.send_text(404, f'command "{command}" not found\n')
+                    return
+                try:
+                    self.send_text(200, daemon.run(command, args))
+                except Exception as e:
+                    self.send_text(500, f'{type(e).__name__}: {e}\n')
+
+            def send_text(self, code: int, text: str) -> None:
+                body = text.encode()
+                self.send_response(code)
+                self.send_header('Content-Type', 'text/plain; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        return Handler
+
+    def serve(self) -> None:
+        self.refresh(TotalPortfolio.PORTFOLIO_OUTPUTS)
+        # one thread, so requests never see total portfolio in the middle of reload
+        with HTTPServer((self.HOST, self.port), self.get_handler()) as server:
+            print(f'Serving on http://{self.HOST}:{self.port}')
+            server.serve_forever()
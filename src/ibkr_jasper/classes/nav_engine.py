@@ -0,0 +1,80 @@
+from __future__ import annotations
+import numpy as np
+import polars as pl
+from datetime import date, datetime
+from typing import Iterable, Union
+
+from src.ibkr_jasper.arrays import to_numpy
+
+
+class NavEngine:
+    """
+    Daily NAV and external cash flows of a portfolio, chain-linked into one cumulative time-weighted return series.
+    nav[i] is the value on the close before days[i], flows[i] is the money put into the portfolio during days[i].
+    Return of any period [start, end) is a ratio of two points of the cumulative series.
+    """
+
+    def __init__(self, days: np.ndarray, nav: np.ndarray, flows: np.ndarray) -> None:
+        self.days = days
+        self.nav = nav
+        self.flows = flows
+
+        nav_morning = nav[:-1]
+        nav_evening = nav[1:]
+        safe_morning = np.where(nav_morning > 0, nav_morning, 1.0)
+        self.daily_factors = np.where(nav_morning > 0, (nav_evening - flows[:-1]) / safe_morning, 1.0)
+        self.cumulative = np.concatenate([[1.0], np.cumprod(self.daily_factors)])
+
+    @classmethod
+    def from_flows(cls, first_day: date, last_day: date, values_at, flows: pl.DataFrame) -> NavEngine:
+        """
+        :param values_at: function giving portfolio values on previous close for an array of days
+        :param flows: frame with 'date' and 'flow' columns
+        """
+        days = np.arange(np.datetime64(first_day, 'D'), np.datetime64(last_day, 'D') + 1)
+        nav = values_at(days)
+
+        flow_days = to_numpy(flows['date']).astype('datetime64[D]')
+        flow_amounts = to_numpy(flows['flow'])
+        in_range = (flow_days >= days[0]) & (flow_days <= days[-1])
+        daily_flows = np.zeros(len(days))
+        np.add.at(daily_flows, (flow_days[in_range] - days[0]).astype(np.int64), flow_amounts[in_range])
+
+        return cls(days, nav, daily_flows)
+
+    def day_index(self, dates: Iterable[Union[date, datetime]]) -> np.ndarray:
+        """Index of the morning of each date in the cumulative series, dates outside of the series are clipped"""
+        dates = np.array(list(dates), dtype='datetime64[D]')
+        return np.clip((dates - self.days[0]).astype(np.int64), 0, len(self.days) - 1)
+
+    def period_returns(self, start_dates: Iterable[Union[date, datetime]], end_dates: Iterable[Union[date, datetime]]) -> np.ndarray:
+        """Time-weighted returns of periods [start, end) for many periods at once"""
+        starts = self.day_index(start_dates)
+        ends = self.day_index(end_dates)
+        returns = np.empty(len(starts))
+        for i in np.flatnonzero(self.cumulative[starts] == 0):
+            # whole money was lost in some day before the period, so the ratio is undefined
+            returns[i] = np.prod(self.daily_factors[starts[i]:ends[i]])
+        regular = self.cumulative[starts] != 0
+        returns[regular] = self.cumulative[ends[regular]] / self.cumulative[starts[regular]]
+        return returns - 1
+
+    def period_return(self, start_date: Union[date, datetime], end_date: Union[date, datetime]) -> float:
+        return float(self.period_returns([start_date], [end_date])[0])
+
+    def get_returns(self, every: str) -> pl.DataFrame:
+        """Returns for each calendar period, every is polars duration string like '1mo' or '1y'"""
+        days = pl.Series('date', self.days.astype('datetime64[us]')).cast(pl.Date)
+        starts = days.dt.truncate(every).unique(maintain_order=True)
+        ends = starts.shift(-1).fill_null(days[-1])
+        return pl.DataFrame({'date': starts, 'return': self.period_returns(starts.to_list(), ends.to_list())})
+
+    def get_monthly_returns(self) -> pl.DataFrame:
+        return self.get_returns('1mo')
+
+    def get_yearly_returns(self) -> pl.DataFrame:
+        return self.get_returns('1y')
+
+    def get_inception_return(self) -> float:
+        first_day = self.days[np.argmax(self.nav > 0)] if np.any(self.nav > 0) else self.days[0]
+        return self.period_return(first_day.astype(datetime), self.days[-1].astype(datetime))
@@ -1,9 +1,10 @@
 from __future__ import annotations
 import polars as pl
 from datetime import datetime
-from prettytable import PrettyTable
+from typing import Callable, Iterator
 
 from src.ibkr_jasper.classes.portfolio_base import PortfolioBase
+from src.ibkr_jasper.classes.price_matrix import PriceMatrix
 from src.ibkr_jasper.timer import Timer
 
 
@@ -16,23 +17,24 @@ class Portfolio(PortfolioBase):
         self.total_portfolio = total_portfolio
         self.name = name
 
+    def get_stages(self) -> list[tuple[str, Callable[[], None]]]:
+        return [
+            (f'Load target weights for {self.name}', self.load_target_weights),
+            (f'Load tickers for {self.name}', self.load_tickers),
+            (f'Load trades for {self.name}', self.load_trades),
+            ('Split trades on buys & sells', self.get_buys_sells),
+            (f'Build position ledger for {self.name}', self.build_position_ledger),
+            (f'Load divs for {self.name}', self.load_divs),
+            ('Get portfolio start date', self.get_inception_date),
+            (f'Load prices for {self.name}', self.load_prices),
+            (f'Build daily NAV for {self.name}', self.build_nav_engine),
+            (f'Calculate current weights for {self.name}', self.calc_current_weights),
+        ]
+
     def load(self) -> Portfolio:
-        with Timer(f'Load target weights for {self.name}', self.debug):
-            self.load_target_weights()
-        with Timer(f'Load tickers for {self.name}', self.debug):
-            self.load_tickers()
-        with Timer(f'Load trades for {self.name}', self.debug):
-            self.load_trades()
-        with Timer('Split trades on buys & sells', self.debug):
-            self.get_buys_sells()
-        with Timer(f'Load divs for {self.name}', self.debug):
-            self.load_divs()
-        with Timer('Get portfolio start date', self.debug):
-            self.get_inception_date()
-        with Timer(f'Load prices for {self.name}', self.debug):
-            self.load_prices()
-        with Timer(f'Calculate current weights for {self.name}', self.debug):
-            self.calc_current_weights()
+        for message, stage in self.get_stages():
+            with Timer(message, self.debug):
+                stage()
 
         return self
 
@@ -45,15 +47,36 @@ class Portfolio(PortfolioBase):
         self.tickers_shared = list(set(self.total_portfolio.tickers_shared).intersection(self.tickers))
         self.tickers_unique = list(set(self.tickers).difference(self.tickers_shared))
 
+    def get_trades_plan(self, trades: pl.LazyFrame) -> pl.LazyFrame:
+        return trades.filter(pl.col('portfolio') == self.name).drop('portfolio')
+
+    def get_divs_plan(self, divs: pl.LazyFrame) -> pl.LazyFrame:
+        # TODO this is wrong, need to load divs afterwards from yahoo
+        return divs.filter(pl.col('ticker').cast(pl.Utf8).is_in(self.tickers))
+
+    def get_prices_plan(self, prices: pl.LazyFrame) -> pl.LazyFrame:
+        return prices.filter((pl.col('ticker').cast(pl.Utf8).is_in(self.tickers)) & (pl.col('date') >= self.inception_date))
+
+    def get_plans(self) -> dict[str, pl.LazyFrame]:
+        """Plans of frames of this portfolio from statements and caches, as they run without materialized frames of total portfolio"""
+        return {
+            'trades': self.get_trades_plan(self.total_portfolio.plans['trades']),
+            'divs': self.get_divs_plan(self.total_portfolio.plans['divs']),
+            'prices': self.get_prices_plan(self.total_portfolio.plans['prices']),
+        }
+
+    def describe_plans(self) -> str:
+        return '\n'.join(f'{k}:\n{v.describe_optimized_plan()}\n' for k, v in self.get_plans().items())
+
     def load_trades(self) -> None:
-        self.trades = (self.total_portfolio.trades.filter(pl.col('portfolio') == self.name).drop('portfolio'))
+        self.trades = self.get_trades_plan(self.total_portfolio.get_plan('trades')).collect()
 
     def load_divs(self) -> None:
-        # TODO this is wrong, need to load divs afterwards from yahoo
-        self.divs = (self.total_portfolio.divs.filter(pl.col('ticker').cast(pl.Utf8).is_in(self.tickers)))
+        self.divs = self.get_divs_plan(self.total_portfolio.get_plan('divs')).collect()
 
     def load_prices(self) -> None:
-        self.prices = (self.total_portfolio.prices.filter((pl.col('ticker').is_in(self.tickers)) & (pl.col('date') >= self.inception_date)))
+        self.prices = self.get_prices_plan(self.total_portfolio.get_plan('prices')).collect()
+        self.price_matrix = PriceMatrix.from_prices(self.prices).select(self.tickers)
 
     def calc_current_weights(self) -> None:
         dt = datetime.today()
@@ -63,7 +86,33 @@ class Portfolio(PortfolioBase):
             value = self.get_ticker_value(ticker, pos, dt)
             self.current_weights[ticker] = value / self.target_value * 100
 
+    def get_weights(self) -> pl.DataFrame:
+        """Target and current weights in percent, prices, values and lots to buy of tickers that are in target or in portfolio"""
+        tickers = [x for x in self.tickers if self.target_weights[x] or self.current_weights[x]]
+        target_weights = [self.target_weights[x] for x in tickers]
+        current_weights = [self.current_weights[x] for x in tickers]
+        prices = [self.get_ticker_price_last(x) for x in tickers]
+        return pl.DataFrame({
+            'ticker': tickers,
+            'target': target_weights,
+            'fact': current_weights,
+            'price': prices,
+        }, columns={'ticker': pl.Utf8, 'target': pl.Float64, 'fact': pl.Float64, 'price': pl.Float64}).with_columns([
+            (pl.col('target') - pl.col('fact')).alias('diff'),
+            (pl.col('target') * self.target_value / 100).alias('tgt value'),
+            (pl.col('fact') * self.target_value / 100).alias('cur value'),
+        ]).with_columns([
+            ((pl.col('tgt value') - pl.col('cur value')) / pl.col('price')).alias('lots to buy'),
+        ]).select(['ticker', 'target', 'fact', 'diff', 'price', 'tgt value', 'cur value', 'lots to buy'])
+
+    def get_status_frames(self) -> Iterator[tuple[str, pl.DataFrame]]:
+        """Tables of status command with name of portfolio in each row, each frame is given as soon as it is calculated"""
+        portfolio_column = pl.lit(self.name).alias('portfolio')
+        yield 'report', self.get_report().select([portfolio_column, pl.all()])
+        yield 'weights', self.get_weights().select([portfolio_column, pl.all()])
+
     def print_weights(self) -> None:
+        from prettytable import PrettyTable
         port_latest = self.get_port_for_date(datetime.today())
         total_value = self.get_portfolio_value(port_latest, datetime.today())
         print(f'${total_value:,.0f} --- current portfolio value')
@@ -72,17 +121,7 @@ class Portfolio(PortfolioBase):
         weights_table = PrettyTable()
         weights_table.align = 'r'
         weights_table.field_names = ['ticker', 'target', 'fact', 'diff', '', 'price', 'tgt value', 'cur value', 'lots to buy']
-        for ticker in self.tickers:
-            target_weight = self.target_weights[ticker]
-            current_weight = self.current_weights[ticker]
-            if not target_weight and not current_weight:
-                continue
-
-            diff_weight = target_weight - current_weight
-            cur_price = self.get_ticker_price_last(ticker)
-            tgt_value = self.target_weights[ticker] * self.target_value / 100
-            cur_value = self.current_weights[ticker] * self.target_value / 100
-            lots_to_buy = (tgt_value - cur_value) / cur_price
+        for ticker, target_weight, current_weight, diff_weight, cur_price, tgt_value, cur_value, lots_to_buy in self.get_weights().rows():
             weights_table.add_row([
                 ticker,
                 f'{target_weight:.0f}%',
@@ -1,14 +1,22 @@
-import dateutil.rrule as rrule
-import pandas as pd
+import hashlib
+import numpy as np
 import polars as pl
 from datetime import date, timedelta, datetime, time
-from pandas._libs.tslibs.offsets import BDay
 from pathlib import Path
-from prettytable import PrettyTable
+
+from src.ibkr_jasper.arrays import to_numpy
+from src.ibkr_jasper.classes.nav_engine import NavEngine
+from src.ibkr_jasper.classes.position_ledger import PositionLedger
+from src.ibkr_jasper.classes.price_matrix import PriceMatrix
+from src.ibkr_jasper.classes.results_store import ResultsStore
+from src.ibkr_jasper.profiler import Profiler
+from src.ibkr_jasper.timer import Timer
 
 
 class PortfolioBase:
     PORTFOLIOS_PATH = Path('../../portfolios')
+    RESULTS_PATH = Path('../../data/results')
+    DEBUG = False  # print time of every stage, set from command line
 
     def __init__(self) -> None:
         self.trades = None
@@ -18,10 +26,14 @@ class PortfolioBase:
         self.tickers_shared = None
         self.tickers_unique = None
         self.prices = None
+        self.price_matrix = None
         self.divs = None
         self.inception_date = None
         self.current_weights = None
-        self.debug = False
+        self.ledger = None
+        self.nav = None
+        self.results_store = ResultsStore(self.RESULTS_PATH)
+        self.debug = self.DEBUG
 
     @staticmethod
     def get_etf_buys(trades: pl.DataFrame) -> pl.DataFrame:
@@ -33,14 +45,23 @@ class PortfolioBase:
         etf_sells = (trades.filter((pl.col('asset_type') == 'Stocks') & (pl.col('quantity') < 0)))
         return etf_sells
 
+    @staticmethod
+    def get_previous_business_day(day: date) -> date:
+        """Last weekday before the day"""
+        day -= timedelta(days=1)
+        while day.weekday() >= 5:
+            day -= timedelta(days=1)
+        return day
+
     @staticmethod
     def get_date_range_for_load(start_date: date) -> tuple[date, date]:
-        first_business_day = (start_date - BDay(1)).to_pydatetime().date()
-        last_business_day = (date.today() - BDay(1)).to_pydatetime().date()
+        first_business_day = PortfolioBase.get_previous_business_day(start_date)
+        last_business_day = PortfolioBase.get_previous_business_day(date.today())
         return first_business_day, last_business_day
 
     @staticmethod
     def print_df(df_pl: pl.DataFrame) -> None:
+        import pandas as pd
         with pd.option_context(
                 'display.max_rows',
                 None,
@@ -59,17 +80,19 @@ class PortfolioBase:
         self.buys = self.get_etf_buys(self.trades)
         self.sells = self.get_etf_sells(self.trades)
 
+    def build_position_ledger(self) -> None:
+        self.ledger = PositionLedger(pl.concat([self.buys, self.sells]), self.tickers)
+        if self.price_matrix is not None:
+            # keep price columns in the same order as positions, so valuation is a plain dot product
+            self.price_matrix = self.price_matrix.select(self.ledger.tickers)
+
     def get_port_for_date(self, date_asof: datetime) -> dict:
         """Gives portfolio value on previous day close"""
-        buys_asof = self.buys.filter(pl.col('datetime') < date_asof)
-        sells_asof = self.sells.filter(pl.col('datetime') < date_asof)
-        port_asof = {n: [0] for n in self.tickers}
-        for etf in self.tickers:
-            long = (buys_asof.filter(pl.col('ticker') == etf)['quantity'].append(pl.Series([0.0])).sum())
-            short = (sells_asof.filter(pl.col('ticker') == etf)['quantity'].append(pl.Series([0.0])).sum())
-            port_asof[etf] = long + short
+        return self.ledger.position_at(date_asof)
 
-        return port_asof
+    def get_ports_for_dates(self, dates: list[datetime]) -> list[dict]:
+        """Same as get_port_for_date, but for many dates in one binary search"""
+        return [dict(zip(self.ledger.tickers, x)) for x in self.ledger.positions_at(dates).tolist()]
 
     def get_portfolio_value(self, port_asof: dict, date_asof: datetime) -> float:
         """Gives portfolio value on previous day close prices"""
@@ -78,90 +101,128 @@ class PortfolioBase:
             total_value += self.get_ticker_value(ticker, pos, date_asof)
         return total_value
 
+    def values_at(self, dates: list[datetime]) -> np.ndarray:
+        """Gives portfolio values on previous day close prices for many dates at once"""
+        return self.price_matrix.values_at(dates, self.ledger.positions_at(dates))
+
     def get_ticker_value(self, ticker: str, pos: int, date_asof: datetime) -> float:
         return 0 if not pos else pos * self.get_ticker_price(ticker, date_asof)
 
     def get_ticker_price(self, ticker: str, date_asof: datetime) -> float:
-        return (pl.last(self.prices.filter((pl.col('ticker') == ticker) & (pl.col('date') < date_asof)).drop_nulls().tail(1)['price']))
+        return self.price_matrix.price_at(ticker, date_asof)
 
     def get_ticker_price_last(self, ticker: str) -> float:
         return self.get_ticker_price(ticker, datetime.today())
 
-    def get_cur_month_deals_value(self, start_date: datetime) -> float:
-        end_date = (start_date + timedelta(days=32)).replace(day=1)
-        deals_cur_month = (self.buys.select(['datetime', 'quantity', 'price', 'fee']).extend(self.sells.select(
-            ['datetime', 'quantity', 'price', 'fee'])).filter(pl.col('datetime').is_between(start_date, end_date, include_bounds=(True, False))).with_columns(
-                (pl.col('quantity') * pl.col('price') - pl.col('fee')).alias('value'))['value'].append(pl.Series([0.0])).sum())
-
-        return deals_cur_month
+    def build_nav_engine(self) -> None:
+        first_day = self.inception_date.replace(day=1)
+        last_day = (date.today() + timedelta(days=32)).replace(day=1)
+        deals_flows = self.trades.select([
+            pl.col('datetime').cast(pl.Date).alias('date'),
+            (pl.col('quantity') * pl.col('price') - pl.col('fee')).alias('flow'),
+        ])
+        divs_flows = self.divs.select([pl.col('ex-date').alias('date'), (-pl.col('div total')).alias('flow')])
+        self.nav = NavEngine.from_flows(first_day, last_day, self.values_at, pl.concat([deals_flows, divs_flows]))
 
-    def get_cur_month_divs(self, start_date: datetime) -> float:
-        end_date = (start_date + timedelta(days=32)).replace(day=1)
-        divs_cur_month = (self.divs.filter(pl.col('ex-date').is_between(start_date, end_date,
-                                                                        include_bounds=(True, False)))['div total'].append(pl.Series([0.0])).sum())
+    def get_period_return(self, start_date: datetime, end_date: datetime) -> float:
+        """Time-weighted return for period [start_date, end_date)"""
+        return self.nav.period_return(start_date, end_date)
 
-        return divs_cur_month
+    @staticmethod
+    def get_window_sums(times: np.ndarray, amounts: np.ndarray, starts: list[datetime], ends: list[datetime]) -> np.ndarray:
+        """Sums of amounts with time in [start, end) for every window, all windows through one cumulative sum"""
+        order = np.argsort(times, kind='stable')
+        times = times[order]
+        cumsum = np.concatenate([[0.0], np.cumsum(amounts[order])])
+        first = np.searchsorted(times, np.array(starts, dtype='datetime64[us]'))
+        last = np.searchsorted(times, np.array(ends, dtype='datetime64[us]'))
+        return np.where(first == last, 0.0, cumsum[last] - cumsum[first])
 
-    def get_period_return(self, start_date: datetime, end_date: datetime) -> float:
-        trade_dates = (
-            self.buys.select('datetime').extend(self.sells.select('datetime')).with_columns(pl.col('datetime').cast(pl.Date)).rename({
-                'datetime': 'date'
-            }).extend(self.divs.select('ex-date').rename({'ex-date': 'date'})).filter(
-                (start_date <= pl.col('date')) & (pl.col('date') < end_date))  # TODO use between function here
-            .unique().get_column('date').to_numpy().tolist())
-        trade_dates = sorted(trade_dates + [start_date.date(), end_date.date()])
-
-        return_total = 1
-        value_prev = None
-        for dt in trade_dates:
-            trades_today = (self.trades.filter(pl.col('datetime').cast(pl.Date) == dt).with_columns(
-                (pl.col('quantity') * pl.col('price') - pl.col('fee')).alias('sum'))['sum'].append(pl.Series([0.0])).sum())
-            divs_today = (self.divs.filter(pl.col('ex-date') == dt)['div total'].append(pl.Series([0.0])).sum())
-            delta_today = trades_today - divs_today
-
-            port_morning = self.get_port_for_date(dt)
-            value_morning = self.get_portfolio_value(port_morning, dt)
-            port_evening = self.get_port_for_date(dt + timedelta(days=1))
-            value_evening = self.get_portfolio_value(port_evening, dt + timedelta(days=1))
-
-            if value_prev is None:
-                value_prev = value_morning
-
-            return_prev = value_morning / value_prev if value_prev > 0 else 1
-            return_today = (value_evening - delta_today) / value_morning if value_morning > 0 else 1
-            return_total *= return_prev * return_today
-
-            value_prev = value_evening
-
-        return return_total - 1
+    @staticmethod
+    def get_cumulative_hashes(frame: pl.DataFrame, time_column: str, ends: np.ndarray) -> np.ndarray:
+        """Order independent hash of all rows of frame with time before each end"""
+        times = to_numpy(frame[time_column]).astype('datetime64[us]')
+        hashes = to_numpy(frame.with_columns(pl.col(pl.Categorical).cast(pl.Utf8)).hash_rows())
+        order = np.argsort(times, kind='stable')
+        cumulative = np.concatenate([np.zeros(1, dtype=np.uint64), np.cumsum(hashes[order], dtype=np.uint64)])
+        return cumulative[np.searchsorted(times[order], np.array(ends, dtype='datetime64[us]'))]
+
+    def get_report_fingerprints(self, end_dates: np.ndarray) -> list[str]:
+        """Fingerprint of all inputs of each report row, any change before the end of row changes it"""
+        trades_hashes = self.get_cumulative_hashes(self.trades, 'datetime', end_dates)
+        divs_hashes = self.get_cumulative_hashes(self.divs, 'ex-date', end_dates)
+        prices_hashes = self.get_cumulative_hashes(self.prices, 'date', end_dates)
+        tickers_hash = hashlib.md5(' '.join(self.tickers).encode()).hexdigest()
+        return [f'{t:016x}{d:016x}{p:016x}{tickers_hash}' for t, d, p in zip(trades_hashes, divs_hashes, prices_hashes)]
+
+    def calc_report_rows(self, periods: pl.DataFrame) -> pl.DataFrame:
+        report_dates = periods['date'].to_list()
+        end_dates = periods['end date'].to_list()
+        deals = pl.concat([self.buys, self.sells])
+        deals_values = to_numpy(deals['quantity'] * deals['price'] - deals['fee'])
+        positions = self.ledger.positions_at(report_dates)
+
+        return periods.with_columns([pl.Series(x, positions[:, self.ledger.ticker_index[x]]) for x in self.tickers] + [
+            pl.Series('start', self.values_at(report_dates)),
+            pl.Series('deals', self.get_window_sums(to_numpy(deals['datetime']), deals_values, report_dates, end_dates)),
+            pl.Series('divs', self.get_window_sums(to_numpy(self.divs['ex-date']), to_numpy(self.divs['div total']), report_dates, end_dates)),
+            pl.Series('end', self.values_at(end_dates)),
+            pl.Series('return', self.nav.period_returns(report_dates, end_dates)),
+        ])
+
+    def get_monthly_report(self) -> pl.DataFrame:
+        """
+        Report rows for each month since inception and for the rest of current month.
+        Closed months are taken from the results store if their inputs did not change.
+        """
+        # dates are numpy arrays, polars builds frames from lists of datetimes through pyarrow, which imports pandas
+        cur_datetime = datetime.combine(date.today(), time())
+        months = np.arange(np.datetime64(self.inception_date, 'M'), np.datetime64(date.today(), 'M') + 1)
+        all_report_dates = np.append(months, np.datetime64(cur_datetime, 'us')).astype('datetime64[us]')
+        all_end_dates = np.append(months + 1, months[-1] + 1).astype('datetime64[us]')
+        periods = pl.DataFrame([
+            pl.Series('date', all_report_dates),
+            pl.Series('end date', all_end_dates),
+            pl.Series('fingerprint', self.get_report_fingerprints(all_end_dates)),
+        ])
+        report_columns = periods.columns + self.tickers + ['start', 'deals', 'divs', 'end', 'return']
+
+        saved_report = self.results_store.load(self.name)
+        if saved_report is not None and saved_report.columns == report_columns:
+            saved_report = saved_report.join(periods, on=periods.columns, how='semi')
+        else:
+            saved_report = None
+        new_periods = periods if saved_report is None else periods.join(saved_report, on=periods.columns, how='anti')
+        Profiler.count('report rows saved', len(periods) - len(new_periods))
+        Profiler.count('report rows calculated', len(new_periods))
+
+        with Timer(f'Calculate report rows for {self.name}', self.debug) as span:
+            report = self.calc_report_rows(new_periods)
+            span.rows = len(report)
+        if saved_report is not None:
+            report = pl.concat([saved_report, report]).sort('date')
+
+        self.results_store.save(self.name, report.filter(pl.col('end date') <= cur_datetime))
+        return report
+
+    def get_report(self) -> pl.DataFrame:
+        """Monthly report with positions of tickers, values at start and end of each month, deals, dividends and return"""
+        with Timer(f'Monthly report for {self.name}', self.debug) as span:
+            report = self.get_monthly_report()
+            span.rows = len(report)
+        return report.select(['date'] + self.tickers + ['start', 'deals', 'divs', 'end', 'return'])
 
     def print_report(self) -> None:
-        first_report_date = self.inception_date.replace(day=1)
+        from prettytable import PrettyTable
+        report = self.get_report()
         cur_datetime = datetime.combine(date.today(), time())
-        all_report_dates = list(rrule.rrule(rrule.MONTHLY, dtstart=first_report_date, until=date.today()))
-        all_report_dates += [cur_datetime]
 
         report_table = PrettyTable()
         report_table.align = 'r'
         report_table.field_names = [''] + self.tickers + ['start', 'deals', 'divs', 'end', 'return']
-        for cur_report_date in all_report_dates:
-            # start portfolio value
-            port_start = self.get_port_for_date(cur_report_date)
-            value_start = self.get_portfolio_value(port_start, cur_report_date)
-
-            # deals and divs
-            deals_value = self.get_cur_month_deals_value(cur_report_date)
-            divs = self.get_cur_month_divs(cur_report_date)
-
-            # end portfolio value
-            cur_end_date = (cur_report_date + timedelta(days=32)).replace(day=1)
-            port_end = self.get_port_for_date(cur_end_date)
-            end_value = self.get_portfolio_value(port_end, cur_end_date)
-
-            # return in percents
-            ret = self.get_period_return(cur_report_date, cur_end_date)
-
-            report_table.add_row([cur_report_date.date()] + [f'{port_start[x]:.0f}' for x in self.tickers] + [f'{value_start:.2f}'] + [f'{deals_value:.2f}'] +
+        for row in report.rows():
+            cur_report_date, port_start, (value_start, deals_value, divs, end_value, ret) = row[0], row[1:-5], row[-5:]
+            report_table.add_row([cur_report_date.date()] + [f'{x:.0f}' for x in port_start] + [f'{value_start:.2f}'] + [f'{deals_value:.2f}'] +
                                  [f'{divs:.2f}'] + [f'{end_value:.2f}'] + [f'{100 * ret:.2f}%'])
             if cur_report_date.month == 12 and (cur_datetime.month != 12 or cur_datetime.year != cur_report_date.year):
                 report_table.add_row([''] * len(report_table.field_names))
@@ -0,0 +1,44 @@
+from __future__ import annotations
+import multiprocessing
+import os
+import polars as pl
+import tempfile
+from functools import partial
+from pathlib import Path
+from typing import Callable, Iterator
+
+from src.ibkr_jasper.classes.portfolio_base import PortfolioBase
+from src.ibkr_jasper.classes.total_portfolio import TotalPortfolio
+
+
+class PortfolioPool:
+    """
+    Process pool that computes every portfolio of one loaded total portfolio.
+    Frames of total portfolio are written once to Arrow IPC files and each worker maps them into memory,
+    so all workers read the same pages instead of receiving pickled copies.
+    """
+    total_portfolio = None  # total portfolio of worker process
+
+    def __init__(self, total_portfolio: TotalPortfolio, processes: int = None) -> None:
+        self.total_portfolio = total_portfolio
+        self.processes = os.cpu_count() if processes is None else processes
+
+    @staticmethod
+    def init_worker(state: dict) -> None:
+        pl.toggle_string_cache(True)
+        PortfolioBase.DEBUG = state['debug']
+        PortfolioPool.total_portfolio = TotalPortfolio.from_shared_state(state)
+
+    @staticmethod
+    def run(function: Callable, portfolio_name: str):
+        return function(portfolio_name, PortfolioPool.total_portfolio)
+
+    def map(self, function: Callable, portfolio_names: list[str]) -> Iterator:
+        """Gives results of function(portfolio_name, total_portfolio) in order of names, each result as soon as it and all results before it are ready"""
+        with tempfile.TemporaryDirectory() as path:
+            state = self.total_portfolio.save_shared_state(Path(path))
+            # spawn, because forked polars thread pool can deadlock
+            context = multiprocessing.get_context('spawn')
+            processes = max(1, min(self.processes, len(portfolio_names)))
+            with context.Pool(processes, initializer=self.init_worker, initargs=(state,)) as pool:
+                yield from pool.imap(partial(self.run, function), portfolio_names)
@@ -0,0 +1,39 @@
+from __future__ import annotations
+import numpy as np
+import polars as pl
+from datetime import date, datetime
+from typing import Iterable, Union
+
+from src.ibkr_jasper.arrays import to_numpy
+
+
+class PositionLedger:
+    """
+    Cumulative quantity of every ticker after every trade, built once from split-adjusted trades.
+    Row 0 is an empty portfolio, row i holds positions after the i-th distinct trade datetime.
+    """
+
+    def __init__(self, trades: pl.DataFrame, tickers: Iterable[str]) -> None:
+        self.tickers = list(tickers)
+        self.ticker_index = {ticker: i for i, ticker in enumerate(self.tickers)}
+
+        deals = (trades.select(['datetime', 'ticker', 'quantity']).with_columns(pl.col('ticker').cast(pl.Utf8)).filter(pl.col('ticker').is_in(self.tickers)))
+        deal_times = to_numpy(deals['datetime']).astype('datetime64[us]')
+        deal_columns = np.array([self.ticker_index[x] for x in deals['ticker'].to_list()], dtype=np.int64)
+        self.datetimes, deal_rows = np.unique(deal_times, return_inverse=True)
+
+        deltas = np.zeros((len(self.datetimes) + 1, len(self.tickers)))
+        np.add.at(deltas, (deal_rows.reshape(-1) + 1, deal_columns), to_numpy(deals['quantity']))
+        self.positions = deltas.cumsum(axis=0)
+
+    @staticmethod
+    def to_datetime64(dates: Iterable[Union[date, datetime]]) -> np.ndarray:
+        return np.array(list(dates), dtype='datetime64[us]')
+
+    def positions_at(self, dates: Iterable[Union[date, datetime]]) -> np.ndarray:
+        """Gives positions matrix (dates x tickers) before the start of each date, i.e. on previous day close"""
+        rows = np.searchsorted(self.datetimes, self.to_datetime64(dates), side='left')
+        return self.positions[rows]
+
+    def position_at(self, date_asof: Union[date, datetime]) -> dict:
+        return dict(zip(self.tickers, self.positions_at([date_asof])[0].tolist()))
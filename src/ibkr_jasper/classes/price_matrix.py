@@ -0,0 +1,72 @@
+from __future__ import annotations
+import numpy as np
+import polars as pl
+from datetime import date, datetime
+from typing import Iterable, Union
+
+from src.ibkr_jasper.arrays import to_numpy
+
+
+class PriceMatrix:
+    """
+    Dense matrix of close prices (business days x tickers), forward-filled over nulls and holidays.
+    As-of lookups give the last known close strictly before the requested moment, same as filtering by date < date_asof.
+    """
+
+    def __init__(self, dates: np.ndarray, tickers: list[str], prices: np.ndarray) -> None:
+        self.dates = dates
+        self.tickers = tickers
+        self.ticker_index = {ticker: i for i, ticker in enumerate(tickers)}
+        self.prices = prices
+
+    @classmethod
+    def from_prices(cls, prices: pl.DataFrame) -> PriceMatrix:
+        prices = prices.with_columns(pl.col('ticker').cast(pl.Utf8))
+        tickers = sorted(prices['ticker'].unique().to_list())
+        price_dates = to_numpy(prices['date']).astype('datetime64[D]')
+        if len(price_dates):
+            business_days = np.arange(price_dates.min(), price_dates.max() + 1, dtype='datetime64[D]')
+            business_days = business_days[np.is_busday(business_days)]
+        else:
+            business_days = price_dates
+        dates = np.union1d(business_days, price_dates)
+
+        ticker_index = {ticker: i for i, ticker in enumerate(tickers)}
+        matrix = np.full((len(dates), len(tickers)), np.nan)
+        rows = np.searchsorted(dates, price_dates)
+        columns = np.array([ticker_index[x] for x in prices['ticker'].to_list()], dtype=np.int64)
+        matrix[rows, columns] = to_numpy(prices['price'])
+
+        return cls(dates.astype('datetime64[us]'), tickers, cls.forward_fill(matrix))
+
+    @staticmethod
+    def forward_fill(matrix: np.ndarray) -> np.ndarray:
+        last_valid_row = np.where(np.isnan(matrix), 0, np.arange(len(matrix))[:, None])
+        np.maximum.accumulate(last_valid_row, axis=0, out=last_valid_row)
+        return matrix[last_valid_row, np.arange(matrix.shape[1])]
+
+    def select(self, tickers: Iterable[str]) -> PriceMatrix:
+        """Gives matrix with columns in the given order, unknown tickers have no prices"""
+        tickers = list(tickers)
+        prices = np.full((len(self.dates), len(tickers)), np.nan)
+        for i, ticker in enumerate(tickers):
+            if ticker in self.ticker_index:
+                prices[:, i] = self.prices[:, self.ticker_index[ticker]]
+        return PriceMatrix(self.dates, tickers, prices)
+
+    def prices_at(self, dates: Iterable[Union[date, datetime]]) -> np.ndarray:
+        """Gives prices matrix (dates x tickers) on previous close for each date, NaN if there is no price yet"""
+        rows = np.searchsorted(self.dates, np.array(list(dates), dtype='datetime64[us]'), side='left') - 1
+        prices = self.prices[np.maximum(rows, 0)]
+        prices[rows < 0] = np.nan
+        return prices
+
+    def price_at(self, ticker: str, date_asof: Union[date, datetime]) -> Union[float, None]:
+        if ticker not in self.ticker_index:
+            return None
+        price = self.prices_at([date_asof])[0, self.ticker_index[ticker]]
+        return None if np.isnan(price) else float(price)
+
+    def values_at(self, dates: Iterable[Union[date, datetime]], positions: np.ndarray) -> np.ndarray:
+        """Gives value of positions (dates x tickers, same column order) for each date"""
+        return np.where(positions != 0, positions * self.prices_at(dates), 0.0).sum(axis=1)
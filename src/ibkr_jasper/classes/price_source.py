@@ -0,0 +1,75 @@
+from __future__ import annotations
+import polars as pl
+from datetime import date, timedelta
+from pathlib import Path
+
+
+class PriceSource:
+    """Provider of daily close prices and stock splits"""
+    PRICES_SCHEMA = {'date': pl.Date, 'ticker': pl.Categorical, 'price': pl.Float64}
+    SPLITS_SCHEMA = {'datetime': pl.Datetime, 'ticker': pl.Categorical, 'splits': pl.Float64}
+
+    def download(self, tickers: list[str], start: date, end: date) -> tuple[pl.DataFrame, pl.DataFrame]:
+        """
+        Gives prices and splits for dates from start to end inclusive
+        :return: prices frame with columns date, ticker, price and splits frame with columns datetime, ticker, splits
+        """
+        raise NotImplementedError
+
+    @classmethod
+    def get_empty_frames(cls) -> tuple[pl.DataFrame, pl.DataFrame]:
+        prices = pl.DataFrame({x: [] for x in cls.PRICES_SCHEMA}, columns=cls.PRICES_SCHEMA)
+        splits = pl.DataFrame({x: [] for x in cls.SPLITS_SCHEMA}, columns=cls.SPLITS_SCHEMA)
+        return prices, splits
+
+    @staticmethod
+    def cast_prices(prices: pl.DataFrame) -> pl.DataFrame:
+        return prices.select(['date', 'ticker', 'price']).with_columns([
+            pl.col('date').cast(pl.Date),
+            pl.col('ticker').cast(pl.Utf8).cast(pl.Categorical),
+            pl.col('price').cast(pl.Float64),
+        ])
+
+    @staticmethod
+    def cast_splits(splits: pl.DataFrame) -> pl.DataFrame:
+        return splits.select(['datetime', 'ticker', 'splits']).with_columns([
+            pl.col('datetime').cast(pl.Datetime),
+            pl.col('ticker').cast(pl.Utf8).cast(pl.Categorical),
+            pl.col('splits').cast(pl.Float64),
+        ])
+
+
+class YahooPriceSource(PriceSource):
+
+    def download(self, tickers: list[str], start: date, end: date) -> tuple[pl.DataFrame, pl.DataFrame]:
+        # imported only when prices are missing in cache, it takes longer than the rest of the program to import
+        import yfinance as yf
+        data = yf.download(tickers, start=start, end=end + timedelta(days=1), actions=True)
+        if data.empty or 'Close' not in data:
+            # no trading days in the range or unknown tickers, they stay missing in cache and are asked again next time
+            print(f'No prices of {", ".join(tickers)} from {start} to {end}')
+            return self.get_empty_frames()
+        close = data['Close'] if len(tickers) > 1 else data[['Close']].set_axis(tickers, axis=1)
+        splits = data['Stock Splits'] if len(tickers) > 1 else data[['Stock Splits']].set_axis(tickers, axis=1)
+
+        prices = (pl.from_pandas(close.reset_index()).rename({'Date': 'date'}).melt(id_vars='date', variable_name='ticker', value_name='price'))
+        splits = (pl.from_pandas(splits.reset_index()).rename({
+            'Date': 'datetime'
+        }).melt(id_vars='datetime', variable_name='ticker', value_name='splits').filter(pl.col('splits') > 0))
+        return self.cast_prices(prices), self.cast_splits(splits)
+
+
+class FilePriceSource(PriceSource):
+    """
+    Stand-in for tests and offline runs, reads prices.csv (date, ticker, price) and splits.csv (date, ticker, splits) from a folder
+    """
+
+    def __init__(self, path: Path) -> None:
+        self.path = path
+
+    def download(self, tickers: list[str], start: date, end: date) -> tuple[pl.DataFrame, pl.DataFrame]:
+        prices = (pl.read_csv(self.path / 'prices.csv').with_columns(pl.col('date').str.strptime(pl.Date, fmt='%Y-%m-%d')).filter(
+            pl.col('ticker').is_in(tickers) & (pl.col('date') >= start) & (pl.col('date') <= end)))
+        splits = (pl.read_csv(self.path / 'splits.csv').with_columns(pl.col('date').str.strptime(pl.Date, fmt='%Y-%m-%d')).filter(
+            pl.col('ticker').is_in(tickers) & (pl.col('date') >= start) & (pl.col('date') <= end)).rename({'date': 'datetime'}))
+        return self.cast_prices(prices), self.cast_splits(splits)
@@ -0,0 +1,24 @@
+from __future__ import annotations
+import polars as pl
+from pathlib import Path
+from typing import Union
+
+from src.ibkr_jasper.classes.ipc_cache import IpcCache
+
+
+class ResultsStore:
+    """Local store of already computed report rows, one file per portfolio"""
+    VERSION = 1
+
+    def __init__(self, path: Path) -> None:
+        self.path = path
+
+    def get_cache(self, key: str) -> IpcCache:
+        # columns of report depend on tickers of portfolio, so they are checked by the report itself
+        return IpcCache(self.path, f'{key}.report', self.VERSION)
+
+    def load(self, key: str) -> Union[pl.DataFrame, None]:
+        return self.get_cache(key).load()
+
+    def save(self, key: str, results: pl.DataFrame) -> None:
+        self.get_cache(key).save(results)
@@ -0,0 +1,92 @@
+from __future__ import annotations
+import numpy as np
+import polars as pl
+from datetime import date
+
+
+class RiskMetrics:
+    """
+    Rolling volatility, max drawdown, Sharpe ratio and tracking error of daily time-weighted returns of a portfolio.
+    Benchmark is the portfolio rebalanced to its target weights every day. Only business days are counted, metrics are annualized.
+    Every metric of every window comes from cumulative sums or one strided view of the return series, without loops over dates.
+    """
+    DAYS_IN_YEAR = 252
+
+    def __init__(self, days: np.ndarray, returns: np.ndarray, benchmark_returns: np.ndarray) -> None:
+        self.days = days
+        self.returns = returns
+        self.benchmark_returns = benchmark_returns
+
+    @classmethod
+    def from_portfolio(cls, portfolio, last_day: date = None) -> RiskMetrics:
+        """Returns of loaded portfolio from its daily NAV, days from the first day with value till the last day"""
+        nav = portfolio.nav
+        last_day = np.datetime64(date.today() if last_day is None else last_day, 'D')
+        first_index = int(np.argmax(nav.nav > 0)) if np.any(nav.nav > 0) else len(nav.days) - 1
+        # factor i is the change from morning of days[i] to the next morning, so it holds the close of days[i]
+        index = np.arange(first_index, len(nav.days) - 1)
+        index = index[(nav.days[index] < last_day) & np.is_busday(nav.days[index])]
+
+        prices = portfolio.price_matrix.prices_at(nav.days.astype('datetime64[us]'))
+        with np.errstate(divide='ignore', invalid='ignore'):
+            ticker_returns = prices[index + 1] / prices[index] - 1
+        weights = np.array([portfolio.target_weights.get(x, 0.0) for x in portfolio.price_matrix.tickers]) / 100
+        # tickers without prices yet are left out and the rest of targets is scaled to the whole portfolio
+        priced_weights = np.where(np.isfinite(ticker_returns), weights, 0.0)
+        priced_total = priced_weights.sum(axis=1)
+        benchmark_returns = (priced_weights * np.nan_to_num(ticker_returns)).sum(axis=1) / np.where(priced_total > 0, priced_total, 1.0)
+
+        return cls(nav.days[index], nav.daily_factors[index] - 1, benchmark_returns)
+
+    @staticmethod
+    def get_rolling_sums(values: np.ndarray, window: int) -> np.ndarray:
+        """Sums of every window of values that ends at each of them, NaN where the window is not full"""
+        cumsum = np.concatenate([[0.0], np.cumsum(values)])
+        sums = np.full(len(values), np.nan)
+        if window <= len(values):
+            sums[window - 1:] = cumsum[window:] - cumsum[:-window]
+        return sums
+
+    @classmethod
+    def get_rolling_std(cls, values: np.ndarray, window: int) -> np.ndarray:
+        # sums of squares are taken around the mean of the whole series, so they do not lose precision on small daily returns
+        centered = values - values.mean() if len(values) else values
+        sums = cls.get_rolling_sums(centered, window)
+        squares = cls.get_rolling_sums(centered**2, window)
+        return np.sqrt(np.maximum(squares - sums**2 / window, 0.0) / max(window - 1, 1))
+
+    def get_volatility(self, window: int) -> np.ndarray:
+        return self.get_rolling_std(self.returns, window) * np.sqrt(self.DAYS_IN_YEAR)
+
+    def get_sharpe(self, window: int, risk_free_rate: float = 0.0) -> np.ndarray:
+        """Annual excess return over risk free rate per unit of annual volatility"""
+        excess = self.get_rolling_sums(self.returns, window) / window - risk_free_rate / self.DAYS_IN_YEAR
+        std = self.get_rolling_std(self.returns, window)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return np.where(std > 0, excess / std * np.sqrt(self.DAYS_IN_YEAR), np.nan)
+
+    def get_tracking_error(self, window: int) -> np.ndarray:
+        return self.get_rolling_std(self.returns - self.benchmark_returns, window) * np.sqrt(self.DAYS_IN_YEAR)
+
+    def get_max_drawdown(self, window: int) -> np.ndarray:
+        """Largest fall from a peak within each window, e.g. -0.25 is a fall by 25%"""
+        drawdowns = np.full(len(self.returns), np.nan)
+        if window > len(self.returns):
+            return drawdowns
+        wealth = np.concatenate([[1.0], np.cumprod(1 + self.returns)])
+        # window of returns ending at day t moves wealth from wealth[t - window + 1] to wealth[t + 1]
+        windows = np.lib.stride_tricks.sliding_window_view(wealth, window + 1)
+        peaks = np.maximum.accumulate(windows, axis=1)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            drawdowns[window - 1:] = np.nanmin(windows / peaks, axis=1) - 1
+        return drawdowns
+
+    def get_metrics(self, window: int = DAYS_IN_YEAR, risk_free_rate: float = 0.0) -> pl.DataFrame:
+        """All metrics for windows of given number of business days that end at each day"""
+        return pl.DataFrame({
+            'date': self.days.astype('datetime64[us]'),
+            'volatility': self.get_volatility(window),
+            'max drawdown': self.get_max_drawdown(window),
+            'sharpe': self.get_sharpe(window, risk_free_rate),
+            'tracking error': self.get_tracking_error(window),
+        }).with_columns([pl.col('date').cast(pl.Date), pl.col(pl.Float64).fill_nan(None)])
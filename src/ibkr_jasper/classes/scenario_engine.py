@@ -0,0 +1,120 @@
+from __future__ import annotations
+import numpy as np
+import polars as pl
+from typing import Union
+
+
+class ScenarioResults:
+    """
+    Outcome of a batch of scenarios for every portfolio, arrays are indexed as (scenarios x portfolios) or (scenarios x portfolios x tickers).
+    Weights are in percent of target value of portfolio, same as current weights of Portfolio.
+    """
+
+    def __init__(self, portfolios: list[str], tickers: list[str], values: np.ndarray, weights: np.ndarray, weights_drift: np.ndarray,
+                 lots_to_buy: np.ndarray) -> None:
+        self.portfolios = portfolios
+        self.tickers = tickers
+        self.values = values
+        self.weights = weights
+        self.weights_drift = weights_drift
+        self.lots_to_buy = lots_to_buy
+
+    def get_values(self) -> pl.DataFrame:
+        """Value of each portfolio (columns) in each scenario (rows)"""
+        return pl.DataFrame({x: self.values[:, i] for i, x in enumerate(self.portfolios)})
+
+    def get_portfolio(self, portfolio: str) -> pl.DataFrame:
+        """Rows of every ticker of portfolio in every scenario, like the table of print_weights"""
+        index = self.portfolios.index(portfolio)
+        scenarios, tickers = self.weights.shape[0], len(self.tickers)
+        return pl.DataFrame({
+            'scenario': np.repeat(np.arange(scenarios), tickers),
+            'ticker': np.tile(np.array(self.tickers), scenarios),
+            'fact': self.weights[:, index].reshape(-1),
+            'diff': self.weights_drift[:, index].reshape(-1),
+            'lots to buy': self.lots_to_buy[:, index].reshape(-1),
+        })
+
+
+class ScenarioEngine:
+    """
+    Current positions of all portfolios revalued under many shocks of prices and exchange rates in one batch.
+    Shocks are relative changes, e.g. -0.2 is a fall by 20%. Exchange rate shock of a currency changes value of every ticker traded in it.
+    Positions, prices and targets are dense (portfolios x tickers) arrays, so a batch of scenarios is a few broadcast array operations.
+    """
+
+    def __init__(self, portfolios: list[str], tickers: list[str], currencies: list[str], ticker_currencies: list[str], positions: np.ndarray,
+                 prices: np.ndarray, target_weights: np.ndarray, target_values: np.ndarray) -> None:
+        self.portfolios = portfolios
+        self.tickers = tickers
+        self.currencies = currencies
+        self.ticker_currency_index = np.array([currencies.index(x) for x in ticker_currencies], dtype=np.int64)
+        self.positions = positions
+        self.prices = prices
+        self.target_weights = target_weights
+        self.target_values = target_values
+
+    @classmethod
+    def from_total_portfolio(cls, total_portfolio) -> ScenarioEngine:
+        """Engine with positions and prices on the last close, total portfolio should have trades, price matrix and targets loaded"""
+        portfolios = sorted(total_portfolio.all_portfolios)
+        tickers = sorted({x for weights in total_portfolio.all_portfolios.values() for x in weights})
+        portfolio_index = {x: i for i, x in enumerate(portfolios)}
+        ticker_index = {x: i for i, x in enumerate(tickers)}
+
+        trades = total_portfolio.trades.filter(pl.col('asset_type').cast(pl.Utf8) == 'Stocks').with_columns([
+            pl.col('ticker').cast(pl.Utf8),
+            pl.col('curr').cast(pl.Utf8),
+        ])
+        holdings = (trades.filter(pl.col('ticker').is_in(tickers) & pl.col('portfolio').is_in(portfolios)).groupby(['portfolio', 'ticker']).agg(
+            pl.col('quantity').sum()))
+        positions = np.zeros((len(portfolios), len(tickers)))
+        rows = np.array([portfolio_index[x] for x in holdings['portfolio'].to_list()], dtype=np.int64)
+        columns = np.array([ticker_index[x] for x in holdings['ticker'].to_list()], dtype=np.int64)
+        positions[rows, columns] = holdings['quantity'].to_list()
+
+        trades_currencies = dict(trades.groupby('ticker').agg(pl.col('curr').last()).rows())
+        ticker_currencies = [trades_currencies.get(x, 'USD') for x in tickers]
+
+        target_weights = np.array([[total_portfolio.all_portfolios[x].get(y, 0.0) for y in tickers] for x in portfolios])
+        target_values = np.array([total_portfolio.all_target_values[x] for x in portfolios])
+        prices = total_portfolio.price_matrix.select(tickers).prices[-1]
+        return cls(portfolios, tickers, sorted(set(ticker_currencies)), ticker_currencies, positions, prices, target_weights, target_values)
+
+    def get_shocks(self, shocks: Union[np.ndarray, pl.DataFrame, dict, None], names: list[str]) -> np.ndarray:
+        """Matrix (scenarios x names) of shocks, frame or dict columns are named by tickers or currencies, missing ones are not shocked"""
+        if shocks is None:
+            return np.zeros((1, len(names)))
+        if isinstance(shocks, np.ndarray):
+            assert shocks.ndim == 2 and shocks.shape[1] == len(names), f'Shocks should be a matrix of scenarios x {len(names)} columns'
+            return shocks
+        columns = dict(shocks.items()) if isinstance(shocks, dict) else {x: shocks[x].to_numpy() for x in shocks.columns}
+        unknown = set(columns).difference(names)
+        assert not unknown, f'Unknown columns of shocks: {", ".join(sorted(unknown))}'
+        scenarios = len(np.atleast_1d(next(iter(columns.values())))) if columns else 1
+        matrix = np.zeros((scenarios, len(names)))
+        for i, name in enumerate(names):
+            if name in columns:
+                matrix[:, i] = columns[name]
+        return matrix
+
+    def evaluate(self, price_shocks: Union[np.ndarray, pl.DataFrame, dict] = None, fx_shocks: Union[np.ndarray, pl.DataFrame, dict] = None) -> ScenarioResults:
+        """
+        Values, weights, drift of weights from targets and lots to buy to get back to targets for every scenario and portfolio.
+        :param price_shocks: (scenarios x tickers) matrix, or frame or dict with columns named by tickers
+        :param fx_shocks: (scenarios x currencies) matrix, or frame or dict with columns named by currencies
+        """
+        price_shocks = self.get_shocks(price_shocks, self.tickers)
+        fx_shocks = self.get_shocks(fx_shocks, self.currencies)
+        assert len(price_shocks) == len(fx_shocks) or 1 in (len(price_shocks), len(fx_shocks)), 'Price and FX shocks have different number of scenarios'
+
+        # scenarios x tickers, then every portfolio is one more axis of broadcast
+        prices = self.prices * (1 + price_shocks) * (1 + fx_shocks[:, self.ticker_currency_index])
+        ticker_values = np.where(self.positions != 0, self.positions * prices[:, None, :], 0.0)
+        values = ticker_values.sum(axis=2)
+        scale = 100 / self.target_values[:, None]
+        weights = ticker_values * scale
+        with np.errstate(divide='ignore', invalid='ignore'):
+            lots_to_buy = (self.target_weights / scale - ticker_values) / prices[:, None, :]
+
+        return ScenarioResults(self.portfolios, self.tickers, values, weights, weights - self.target_weights, lots_to_buy)
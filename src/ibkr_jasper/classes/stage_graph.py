@@ -0,0 +1,107 @@
+from __future__ import annotations
+import hashlib
+import polars as pl
+from typing import Callable, Iterable, Union
+
+from src.ibkr_jasper.classes.stage_store import StageStore
+from src.ibkr_jasper.profiler import Profiler
+from src.ibkr_jasper.timer import Timer
+
+
+class Stage:
+    """Step of loading that reads input attributes of its owner and sets output attributes"""
+
+    def __init__(self, message: str, function: Callable[[], None], inputs: list[str], outputs: list[str], memoize: bool = True) -> None:
+        self.message = message
+        self.function = function
+        self.name = function.__name__
+        self.inputs = inputs
+        self.outputs = outputs
+        self.memoize = memoize  # stages with their own caches or with outputs that are not frames or plain values are not saved
+
+
+class StageGraph:
+    """
+    Stages connected by names of their inputs and outputs, run only for outputs that are asked for.
+    Key of a stage is a hash of its name and keys of its inputs, and inputs that come from outside (files, today's date) are hashed by content,
+    so keys of all stages are known before anything runs. Stage with a saved key takes its outputs from the store and its inputs are not even loaded,
+    stage with the same key as in the previous run of this graph keeps outputs it already set.
+    Memoized stage materializes its outputs once to save them, and outputs that the owner keeps as lazy plans (properties) are then
+    scans of the saved files, both after the stage runs and when it is taken from the store. So later plans, e.g. of one portfolio,
+    push their filters down to the files, and whole frames are materialized only by stages or commands that read them.
+    """
+
+    def __init__(self, owner, stages: list[Stage], sources: dict[str, Callable[[], str]], store: StageStore) -> None:
+        self.owner = owner
+        self.stages = stages
+        self.sources = sources  # key of each outside input
+        self.store = store
+        self.producers = {x: stage for stage in stages for x in stage.outputs}
+        self.loaded_keys = {}  # key of each stage whose outputs are set now
+        self.keys = {}  # keys of stages and sources in the current run
+
+    def get_value_key(self, name: str) -> str:
+        if name in self.sources:
+            if name not in self.keys:
+                self.keys[name] = self.sources[name]()
+            return self.keys[name]
+        return f'{self.get_stage_key(self.producers[name])}.{name}'
+
+    def get_stage_key(self, stage: Stage) -> str:
+        if stage.name not in self.keys:
+            key = ' '.join([stage.name] + [self.get_value_key(x) for x in stage.inputs])
+            self.keys[stage.name] = hashlib.sha256(key.encode()).hexdigest()
+        return self.keys[stage.name]
+
+    def get_keys(self, outputs: Iterable[str]) -> list[str]:
+        """Keys of outputs in the last run"""
+        return [self.get_value_key(x) for x in outputs]
+
+    def run(self, outputs: Union[Iterable[str], None] = None) -> None:
+        """Sets given outputs, all outputs if they are not given, running only stages needed for them"""
+        self.keys = {}
+        done = set()
+        for output in self.producers if outputs is None else outputs:
+            self.resolve(self.producers[output], done)
+
+    def resolve(self, stage: Stage, done: set[str]) -> None:
+        if stage.name in done:
+            return
+        done.add(stage.name)
+        key = self.get_stage_key(stage)
+        if self.loaded_keys.get(stage.name) == key:
+            return
+
+        # rebuild runs every stage and saves outputs again
+        lazy_outputs = [x for x in stage.outputs if isinstance(getattr(type(self.owner), x, None), property)]
+        saved_outputs = self.store.load(stage.name, key, lazy_outputs) if stage.memoize and not self.owner.rebuild else None
+        if stage.memoize:
+            Profiler.count('stage store hit' if saved_outputs is not None else 'stage store miss')
+        if saved_outputs is not None:
+            with Timer(f'{stage.message} (saved)', self.owner.debug) as span:
+                for output, value in saved_outputs.items():
+                    setattr(self.owner, output, value)
+                span.rows = self.get_rows(saved_outputs)
+        else:
+            for name in stage.inputs:
+                if name in self.producers:
+                    self.resolve(self.producers[name], done)
+            with Timer(stage.message, self.owner.debug) as span:
+                stage.function()
+                if stage.memoize:
+                    outputs = {x: getattr(self.owner, x) for x in stage.outputs}
+                    outputs = {k: v.collect() if isinstance(v, pl.LazyFrame) else v for k, v in outputs.items()}
+                    self.store.save(stage.name, key, outputs)
+                    for output in lazy_outputs:
+                        if isinstance(outputs[output], pl.DataFrame):
+                            setattr(self.owner, output, self.store.scan(stage.name, output))
+                else:
+                    # lazy outputs are not collected just to count their rows
+                    outputs = {x: vars(self.owner).get(x) for x in stage.outputs}
+                span.rows = self.get_rows(outputs)
+        self.loaded_keys[stage.name] = key
+
+    @staticmethod
+    def get_rows(outputs: dict) -> Union[int, None]:
+        frames = [x for x in outputs.values() if isinstance(x, pl.DataFrame)]
+        return sum(len(x) for x in frames) if frames else None
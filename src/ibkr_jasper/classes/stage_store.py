@@ -0,0 +1,79 @@
+from __future__ import annotations
+import json
+import os
+import polars as pl
+from datetime import date
+from pathlib import Path
+from typing import Iterable, Union
+
+from src.ibkr_jasper.classes.ipc_cache import IpcCache
+
+
+class StageStore:
+    """
+    Outputs of the last run of each stage, saved together with the key of its inputs.
+    Frames are saved as Arrow IPC files, other outputs (sets of tickers, dates) in one json file of the stage.
+    """
+    VERSION = 2
+
+    def __init__(self, path: Path) -> None:
+        self.path = path
+
+    def get_index_path(self, stage_name: str) -> Path:
+        return self.path / f'{stage_name}.v{self.VERSION}.json'
+
+    def get_cache(self, stage_name: str, output: str) -> IpcCache:
+        return IpcCache(self.path, f'{stage_name}.{output}', self.VERSION)
+
+    @staticmethod
+    def encode(value):
+        if isinstance(value, (set, frozenset)):
+            return {'set': sorted(value)}
+        if isinstance(value, date):
+            return {'date': value.isoformat()}
+        return {'value': value}
+
+    @staticmethod
+    def decode(value):
+        if 'set' in value:
+            return set(value['set'])
+        if 'date' in value:
+            return date.fromisoformat(value['date'])
+        return value['value']
+
+    def load(self, stage_name: str, key: str, lazy_outputs: Iterable[str] = ()) -> Union[dict, None]:
+        """Gives outputs of the stage if they were saved for the same key, frames of lazy_outputs as lazy scans of their files"""
+        try:
+            with open(self.get_index_path(stage_name)) as file:
+                index = json.load(file)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+        if index['key'] != key:
+            return None
+
+        outputs = {k: self.decode(v) for k, v in index['values'].items()}
+        for output in index['frames']:
+            cache = self.get_cache(stage_name, output)
+            outputs[output] = cache.scan() if output in lazy_outputs else cache.load()
+            if outputs[output] is None:
+                return None
+        return outputs
+
+    def scan(self, stage_name: str, output: str) -> Union[pl.LazyFrame, None]:
+        return self.get_cache(stage_name, output).scan()
+
+    def save(self, stage_name: str, key: str, outputs: dict) -> None:
+        # index is written last, so it never points to frames of another key
+        frames = {k: v for k, v in outputs.items() if isinstance(v, pl.DataFrame)}
+        for output, frame in frames.items():
+            self.get_cache(stage_name, output).save(frame)
+        self.path.mkdir(parents=True, exist_ok=True)
+        index_path = self.get_index_path(stage_name)
+        tmp_index_path = index_path.with_suffix('.tmp')
+        with open(tmp_index_path, 'w') as file:
+            json.dump({
+                'key': key,
+                'frames': list(frames),
+                'values': {k: self.encode(v) for k, v in outputs.items() if k not in frames},
+            }, file)
+        os.replace(tmp_index_path, index_path)
@@ -0,0 +1,75 @@
+from __future__ import annotations
+import hashlib
+import json
+import polars as pl
+from pathlib import Path
+from typing import Union
+
+
+class StatementCache:
+    """
+    Parsed sections of each statement file saved as Arrow IPC files, keyed by hash of the statement content.
+    Index keeps size and mtime of every statement, so unchanged files are not even read to get their hash.
+    """
+    VERSION = 2  # sections of statements with periods and dates of dividend accruals
+    INDEX_FILE_NAME = 'index.json'
+
+    def __init__(self, path: Path) -> None:
+        self.path = path
+        self.files = {}
+        self.used_files = set()
+        try:
+            with open(self.path / self.INDEX_FILE_NAME) as file:
+                index = json.load(file)
+            if index.get('version') == self.VERSION:
+                self.files = index['files']
+        except (FileNotFoundError, json.JSONDecodeError):
+            pass
+
+    @staticmethod
+    def get_file_hash(report_file: Path) -> str:
+        file_hash = hashlib.sha256()
+        with open(report_file, 'rb') as file:
+            for chunk in iter(lambda: file.read(1 << 20), b''):
+                file_hash.update(chunk)
+        return file_hash.hexdigest()
+
+    def get_section_path(self, file_hash: str, section: str) -> Path:
+        return self.path / f'{file_hash}.v{self.VERSION}.{section}.ipc'
+
+    def get_section_paths(self, report_file: Path, sections: list[str]) -> dict[str, Path]:
+        file_hash = self.get_key(report_file)
+        return {x: self.get_section_path(file_hash, x) for x in sections}
+
+    def contains(self, report_file: Path, sections: list[str]) -> bool:
+        return all(x.is_file() for x in self.get_section_paths(report_file, sections).values())
+
+    def get_key(self, report_file: Path) -> str:
+        """Gives content hash of statement, recalculated only if size or mtime of the file changed"""
+        key = str(report_file)
+        stat = report_file.stat()
+        entry = self.files.get(key)
+        if entry is None or entry['size'] != stat.st_size or entry['mtime'] != stat.st_mtime_ns:
+            entry = {'size': stat.st_size, 'mtime': stat.st_mtime_ns, 'hash': self.get_file_hash(report_file)}
+            self.files[key] = entry
+        self.used_files.add(key)
+        return entry['hash']
+
+    def load(self, report_file: Path, sections: list[str]) -> Union[dict[str, pl.LazyFrame], None]:
+        section_paths = self.get_section_paths(report_file, sections)
+        if not all(x.is_file() for x in section_paths.values()):
+            return None
+        return {k: pl.scan_ipc(v, memory_map=True) for k, v in section_paths.items()}
+
+    def save_index(self) -> None:
+        """Saves index of statements seen in this run and removes cached sections of statements that are gone"""
+        self.files = {k: v for k, v in self.files.items() if k in self.used_files}
+        used_hashes = {x['hash'] for x in self.files.values()}
+        if self.path.is_dir():
+            for section_path in self.path.glob('*.ipc'):
+                file_hash, version = section_path.name.split('.')[:2]
+                if file_hash not in used_hashes or version != f'v{self.VERSION}':
+                    section_path.unlink()
+        self.path.mkdir(parents=True, exist_ok=True)
+        with open(self.path / self.INDEX_FILE_NAME, 'w') as file:
+            json.dump({'version': self.VERSION, 'files': self.files}, file)
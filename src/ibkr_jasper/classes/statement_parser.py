@@ -0,0 +1,161 @@
+from __future__ import annotations
+import csv
+import polars as pl
+from datetime import date, datetime
+from pathlib import Path
+
+
+class StatementParser:
+    """
+    Reads IBKR activity statements once, row by row, and routes every row by its section name to the parser of that section.
+    Only parsed values of needed sections are kept in memory, raw text of statements is dropped right after a row is parsed.
+    """
+    SCHEMAS = {
+        'io': {
+            'date': pl.Date,
+            'curr': pl.Utf8,
+            'amount': pl.Float64,
+            'desc': pl.Utf8,
+        },
+        'divs': {
+            'pay date': pl.Date,
+            'ticker': pl.Utf8,
+            'div total': pl.Float64,
+            'curr': pl.Utf8,
+        },
+        'accruals': {
+            'ex-date': pl.Date,
+            'pay date': pl.Date,
+            'ticker': pl.Utf8,
+            'quantity': pl.Int64,
+            'div per share': pl.Float64,
+            'div total': pl.Float64,
+            'curr': pl.Utf8,
+            'tax': pl.Float64,
+            'date': pl.Date,
+        },
+        'trades': {
+            'datetime': pl.Datetime,
+            'ticker': pl.Utf8,
+            'quantity': pl.Float64,
+            'price': pl.Float64,
+            'curr': pl.Utf8,
+            'fee': pl.Float64,
+            'asset_type': pl.Utf8,
+            'code': pl.Utf8,
+        },
+        'period': {
+            'account': pl.Utf8,
+            'start': pl.Date,
+            'end': pl.Date,
+        },
+    }
+    IO_COLUMNS = list(SCHEMAS['io'])
+    DIVS_COLUMNS = list(SCHEMAS['divs'])
+    ACCRUALS_COLUMNS = [x for x in SCHEMAS['accruals'] if x != 'date']  # date of posting is needed only to tell which statement has the row
+    TRADES_COLUMNS = list(SCHEMAS['trades'])
+    DATE_COLUMNS = {'io': 'date', 'divs': 'pay date', 'accruals': 'date', 'trades': 'datetime'}  # dates when rows got into statements
+
+    def __init__(self) -> None:
+        self.io_data = {x: [] for x in self.SCHEMAS['io']}
+        self.divs_data = {x: [] for x in self.SCHEMAS['divs']}
+        self.accruals_data = {x: [] for x in self.SCHEMAS['accruals']}
+        self.trades_data = {x: [] for x in self.SCHEMAS['trades']}
+        self.period_data = {'account': [''], 'start': [None], 'end': [None]}  # statements without header have no period
+        self.section_parsers = {
+            'Statement': self.parse_statement_row,
+            'Account Information': self.parse_account_row,
+            'Deposits & Withdrawals': self.parse_io_row,
+            'Dividends': self.parse_divs_row,
+            'Change in Dividend Accruals': self.parse_accruals_row,
+            'Trades': self.parse_trades_row,
+        }
+
+    def read(self, report_file: Path) -> None:
+        with open(report_file) as file:
+            for row in csv.reader(file, delimiter=','):
+                if not row or row[0] not in self.section_parsers:
+                    continue
+                self.section_parsers[row[0]](row)
+
+    def get_frames(self) -> dict[str, pl.DataFrame]:
+        """Gives parsed sections as typed frames, empty sections are empty frames with the same schema"""
+        sections_data = {
+            'io': self.io_data,
+            'divs': self.divs_data,
+            'accruals': self.accruals_data,
+            'trades': self.trades_data,
+            'period': self.period_data,
+        }
+        return {k: pl.DataFrame(v, columns=self.SCHEMAS[k]) for k, v in sections_data.items()}
+
+    @classmethod
+    def get_empty_frames(cls) -> dict[str, pl.DataFrame]:
+        return cls().get_frames()
+
+    @classmethod
+    def parse_to_files(cls, report_file: Path, section_paths: dict[str, Path]) -> None:
+        """Parses statement and writes each section to its Arrow IPC file, so process that parsed it does not send frames back"""
+        statement_parser = cls()
+        statement_parser.read(report_file)
+        for section, frame in statement_parser.get_frames().items():
+            frame.write_ipc(section_paths[section])
+
+    @staticmethod
+    def parse_date(text: str) -> date:
+        return datetime.strptime(text.strip(), '%B %d, %Y').date()
+
+    def parse_statement_row(self, row: list[str]) -> None:
+        # period is a range like "January 1, 2022 - December 31, 2022", or one day
+        if row[1] != 'Data' or row[2] != 'Period':
+            return
+        dates = [self.parse_date(x) for x in row[3].split(' - ')]
+        self.period_data['start'] = [dates[0]]
+        self.period_data['end'] = [dates[-1]]
+
+    def parse_account_row(self, row: list[str]) -> None:
+        if row[1] != 'Data' or row[2] != 'Account':
+            return
+        self.period_data['account'] = [row[3]]
+
+    def parse_io_row(self, row: list[str]) -> None:
+        # header and total rows do not have currency code
+        if len(row[2]) != 3:
+            return
+        self.io_data['date'].append(date.fromisoformat(row[3]))
+        self.io_data['curr'].append(row[2])
+        self.io_data['amount'].append(float(row[5]))
+        self.io_data['desc'].append(row[4])
+
+    def parse_divs_row(self, row: list[str]) -> None:
+        if len(row[2]) != 3:
+            return
+        self.divs_data['pay date'].append(date.fromisoformat(row[3]))
+        self.divs_data['ticker'].append(row[4].split('(')[0].replace(' ', ''))
+        self.divs_data['div total'].append(float(row[5]))
+        self.divs_data['curr'].append(row[2])
+
+    def parse_accruals_row(self, row: list[str]) -> None:
+        if row[-1] != 'Re':
+            return
+        self.accruals_data['ex-date'].append(date.fromisoformat(row[6]))
+        self.accruals_data['pay date'].append(date(1900, 1, 1) if row[7] == '-' else date.fromisoformat(row[7]))
+        self.accruals_data['ticker'].append(row[4])
+        self.accruals_data['quantity'].append(int(row[8]))
+        self.accruals_data['curr'].append(row[3])
+        self.accruals_data['div per share'].append(float(row[11]))
+        self.accruals_data['div total'].append(-float(row[12]))
+        self.accruals_data['tax'].append(float(row[9]))
+        self.accruals_data['date'].append(date.fromisoformat(row[5]))
+
+    def parse_trades_row(self, row: list[str]) -> None:
+        if row[1] != 'Data' or row[2] != 'Trade':
+            return
+        self.trades_data['datetime'].append(datetime.fromisoformat(row[6].replace(',', '')))
+        self.trades_data['ticker'].append(row[5])
+        self.trades_data['quantity'].append(float(row[8].replace(',', '')))
+        self.trades_data['price'].append(float(row[9]))
+        self.trades_data['curr'].append(row[4])
+        self.trades_data['fee'].append(float(row[12]) if row[12] != '' else 0.0)
+        self.trades_data['asset_type'].append(row[3])
+        self.trades_data['code'].append(row[16])
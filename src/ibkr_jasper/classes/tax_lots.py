@@ -0,0 +1,54 @@
+from __future__ import annotations
+import polars as pl
+
+
+class TaxLots:
+    """
+    FIFO tax lots of all tickers at once.
+    Bought and sold shares of each ticker are laid on one axis of cumulative quantity, so the n-th sold share closes the n-th bought share
+    without walking trades one by one. Trades should have rate column with exchange rate to rubles on the date of trade.
+    """
+
+    def __init__(self, trades: pl.DataFrame) -> None:
+        trades = trades.with_columns(pl.col('ticker').cast(pl.Utf8)).sort(['ticker', 'datetime'])
+        buys = (trades.filter(pl.col('quantity') > 0).with_columns(pl.col('quantity').cumsum().over('ticker').alias('end')))
+        sells = (trades.filter(pl.col('quantity') < 0).with_columns([
+            (-pl.col('quantity')).alias('quantity'),
+            (-pl.col('quantity')).cumsum().over('ticker').alias('end'),
+        ]))
+        sold = sells.groupby('ticker').agg(pl.col('quantity').sum().alias('sold'))
+
+        self.lots = (buys.join(sold, on='ticker', how='left').with_columns([
+            (pl.col('end') - pl.col('quantity')).alias('start'),
+            pl.col('sold').fill_null(0.0),
+        ]).with_columns((pl.col('end') - pl.max([pl.col('start'), pl.col('sold')])).clip_min(0.0).alias('remaining')).with_columns([
+            (pl.col('remaining') * pl.col('price')).alias('cost'),
+            (pl.col('remaining') * pl.col('price') * pl.col('rate')).alias('cost_rub'),
+        ]).drop(['end', 'sold']))
+        self.realized = self.match_sells(buys, sells)
+
+    @staticmethod
+    def match_sells(buys: pl.DataFrame, sells: pl.DataFrame) -> pl.DataFrame:
+        """Every range between neighbour bounds of bought and sold shares is a part of one sell that closes a part of one lot"""
+        columns = ['datetime', 'portfolio', 'price', 'rate', 'end']
+        buys = buys.select(['ticker'] + columns).rename({x: f'buy {x}' for x in columns[:-1]})
+        sells = sells.select(['ticker'] + columns).rename({x: f'sell {x}' for x in columns[:-1]})
+        bounds = (pl.concat([buys.select(['ticker', 'end']), sells.select(['ticker', 'end'])]).unique().sort(['ticker', 'end']).with_columns(
+            pl.col('end').shift().over('ticker').fill_null(0.0).alias('start')).sort('end'))
+
+        return (bounds.join_asof(buys.sort('end'), on='end', by='ticker', strategy='forward').join_asof(sells.sort('end'), on='end', by='ticker',
+                                                                                                           strategy='forward').filter(
+                                                                                                               pl.col('buy datetime').is_not_null()
+                                                                                                               & pl.col('sell datetime').is_not_null()).
+                with_columns((pl.col('end') - pl.col('start')).alias('quantity')).with_columns([
+                    (pl.col('quantity') * (pl.col('sell price') - pl.col('buy price'))).alias('gain'),
+                    (pl.col('quantity') * (pl.col('sell price') * pl.col('sell rate') - pl.col('buy price') * pl.col('buy rate'))).alias('gain_rub'),
+                ]).drop(['start', 'end']).sort(['sell datetime', 'ticker', 'buy datetime']))
+
+    def get_open_lots(self) -> pl.DataFrame:
+        return self.lots.filter(pl.col('remaining') > 0)
+
+    def get_realized_gains(self, every: str = '1y') -> pl.DataFrame:
+        """Realized gains in dollars and rubles of each ticker for every period of sells"""
+        return (self.realized.with_columns(pl.col('sell datetime').dt.truncate(every).alias('period')).groupby(['period', 'ticker']).agg(
+            pl.col(['quantity', 'gain', 'gain_rub']).sum()).sort(['period', 'ticker']))
@@ -1,150 +1,307 @@
 from __future__ import annotations
-import csv
-from typing import Union
+from typing import Callable, Iterable, Union
 
-import numpy as np
-import pandas as pd
-import pickle
+import os
 import polars as pl
-import yfinance as yf
 from collections import Counter
 from datetime import date, datetime, timedelta
 from pathlib import Path
-from pandas._libs.tslibs.offsets import BDay
 
+from src.ibkr_jasper.classes.corporate_actions import CorporateActions
+from src.ibkr_jasper.classes.fx_source import CbrFxSource, FxSource
+from src.ibkr_jasper.classes.fx_store import FxStore
+from src.ibkr_jasper.classes.ipc_cache import IpcCache
 from src.ibkr_jasper.classes.portfolio_base import PortfolioBase
+from src.ibkr_jasper.classes.price_matrix import PriceMatrix
+from src.ibkr_jasper.classes.price_source import PriceSource, YahooPriceSource
+from src.ibkr_jasper.classes.stage_graph import Stage, StageGraph
+from src.ibkr_jasper.classes.stage_store import StageStore
+from src.ibkr_jasper.classes.statement_cache import StatementCache
+from src.ibkr_jasper.classes.statement_parser import StatementParser
+from src.ibkr_jasper.classes.tax_lots import TaxLots
+from src.ibkr_jasper.profiler import Profiler
 from src.ibkr_jasper.timer import Timer
 
 
+def lazy_frame(name: str) -> property:
+    """Attribute that keeps lazy plan of a frame and materializes it on first read"""
+    return property(lambda self: self.collect(name), lambda self, frame: self.set_plan(name, frame))
+
+
 class TotalPortfolio(PortfolioBase):
     DATA_PATH = Path('../../data')
-    PRICES_PICKLE_PATH = DATA_PATH / 'prices.pickle'
-    SPLITS_PICKLE_PATH = DATA_PATH / 'splits.pickle'
-    XRUB_PICKLE_PATH = DATA_PATH / 'xrub.pickle'
+    CACHE_VERSION = 1
+    PRICES_SCHEMA = PriceSource.PRICES_SCHEMA
+    SPLITS_SCHEMA = PriceSource.SPLITS_SCHEMA
+    PRICES_COVERAGE_SCHEMA = {'ticker': pl.Utf8, 'start': pl.Date, 'end': pl.Date}
+    FX_RATES_PATH = DATA_PATH / 'fx_rates'
+    STATEMENTS_CACHE_PATH = DATA_PATH / 'statements_cache'
+    STAGES_PATH = DATA_PATH / 'stages'
     SHARED_TICKERS_TRADES = PortfolioBase.PORTFOLIOS_PATH / 'shared_tickers.deals'
-
-    def __init__(self) -> None:
+    REBUILD = False  # ignore saved stages and parsed statements, set from command line
+    PARSE_PROCESSES = None  # all cores
+    PARSE_POOL_MIN_SIZE = 1 << 22  # statements of smaller total size are parsed without pool
+    SHARED_FRAMES = ['trades', 'divs', 'prices']  # frames read by portfolios
+    PORTFOLIO_OUTPUTS = ['all_portfolios', 'all_target_values', 'tickers_shared'] + SHARED_FRAMES  # everything read by portfolios
+    io = lazy_frame('io')
+    statement_trades = lazy_frame('statement_trades')
+    statement_divs = lazy_frame('statement_divs')
+    broker_trades = lazy_frame('broker_trades')
+    trades = lazy_frame('trades')
+    divs = lazy_frame('divs')
+    prices = lazy_frame('prices')
+    splits = lazy_frame('splits')
+    trades_rub = lazy_frame('trades_rub')
+    divs_rub = lazy_frame('divs_rub')
+    io_rub = lazy_frame('io_rub')
+
+    def __init__(self, price_source: PriceSource = None, fx_source: FxSource = None) -> None:
+        self.plans = {}  # lazy plans of frames, so filters and selects of portfolios are pushed down to statements and caches
+        self.frames = {}  # materialized plans
         super().__init__()
-        self.report_list = []
+        self.name = 'total'
+        self.rebuild = self.REBUILD
+        self.statement_cache = StatementCache(self.STATEMENTS_CACHE_PATH)
+        self.statements_frames = []  # parsed sections of each statement file
+        self.statements_dated = []  # whether each statement has a period, rows of statements without it are deduplicated by value
         self.io = None
-        self.splits = None
-        self.xrub_rates = None
+        self.statement_trades = None  # trades as they are in statements
+        self.statement_divs = None
+        self.broker_trades = None  # trades after splits and renames, before distribution between portfolios
+        self.price_source = YahooPriceSource() if price_source is None else price_source
+        self.prices_history = None  # cached prices of all tickers ever loaded
+        self.splits_history = None  # cached splits of all tickers ever loaded
+        self.prices_coverage = None  # range of dates with loaded prices and splits for each ticker
+        self.splits = None  # splits of tickers of portfolios
+        self.prices_cache = IpcCache(self.DATA_PATH, 'prices', self.CACHE_VERSION, self.PRICES_SCHEMA)
+        self.splits_cache = IpcCache(self.DATA_PATH, 'splits', self.CACHE_VERSION, self.SPLITS_SCHEMA)
+        self.prices_coverage_cache = IpcCache(self.DATA_PATH, 'prices_coverage', self.CACHE_VERSION, self.PRICES_COVERAGE_SCHEMA)
+        self.corporate_actions = CorporateActions(self.DATA_PATH)
+        self.xrub_rates = None  # published rates of all currencies to rubles
+        self.trades_rub = None  # trades, dividends and deposits with amounts in rubles on their dates
+        self.divs_rub = None
+        self.io_rub = None
+        self.fx_store = FxStore(self.FX_RATES_PATH, CbrFxSource() if fx_source is None else fx_source)
+        self.tax_lots = None
         self.tlh_trades = None
         self.shared_trades = None
         self.tickers_mapping = {}  # for each ticker shows in which portfolios it is present
         self.all_portfolios = {}  # save target weights for each portfolio
         self.all_target_values = {}  # save target dollar value of each portfolio
-
-    def load(self) -> TotalPortfolio:
-        with Timer('Load all portfolios', self.debug):
-            self.load_all_portfolios()
-        with Timer('Read reports', self.debug):
-            self.load_raw_reports()
-        with Timer('Parse deposits & withdrawals', self.debug):
-            self.fetch_io()
-        with Timer('Parse trades', self.debug):
-            self.fetch_trades()
-        with Timer('Parse dividends', self.debug):
-            self.fetch_divs()
-        with Timer('Get all tickers in total portfolio', self.debug):
-            self.get_all_tickers()
-        with Timer('Get shared tickers in total portfolio', self.debug):
-            self.get_shared_tickers()
-        with Timer('Get total portfolio start date', self.debug):
-            self.get_inception_date()
-        with Timer('Loading of ETF prices and splits', self.debug):
-            self.load_prices_and_splits()
-        with Timer('Loading of Central bank exchange rates prices', self.debug):
-            self.load_xrub_rates()
-        with Timer('Adjust trades by splits', self.debug):
-            self.adjust_trades_by_splits()
-        with Timer('Distribute trades', self.debug):
-            self.distribute_trades()
-        with Timer('Split trades on buys & sells', self.debug):
-            self.get_buys_sells()
-        with Timer('Get trades for tax loss harvesting', self.debug):
-            self.get_tlh_trades()
-
+        self.graph = StageGraph(self, self.get_stages(), self.get_sources(), StageStore(self.STAGES_PATH))
+
+    def get_stages(self) -> list[Stage]:
+        return [
+            Stage('Load all portfolios', self.load_all_portfolios, ['portfolio_files'], ['tickers_mapping', 'all_portfolios', 'all_target_values'], False),
+            Stage('Read reports', self.load_raw_reports, ['statement_files'], ['statements_frames', 'statements_dated'], False),
+            Stage('Parse deposits & withdrawals', self.fetch_io, ['statements_frames'], ['io']),
+            Stage('Parse trades', self.fetch_trades, ['statements_frames'], ['statement_trades']),
+            Stage('Parse dividends', self.fetch_divs, ['statements_frames'], ['statement_divs']),
+            Stage('Get all tickers in total portfolio', self.get_all_tickers, ['tickers_mapping', 'statement_trades'], ['tickers']),
+            Stage('Get shared tickers in total portfolio', self.get_shared_tickers, ['portfolio_files', 'tickers'], ['tickers_shared', 'tickers_unique']),
+            Stage('Get total portfolio start date', self.get_inception_date, ['statement_trades'], ['inception_date']),
+            Stage('Loading of ETF prices and splits', self.load_prices_and_splits, ['tickers', 'inception_date', 'today', 'prices_cache_files'],
+                  ['prices', 'splits']),
+            Stage('Load split factors', self.load_corporate_actions, ['splits', 'tickers'], ['corporate_actions'], False),
+            Stage('Build price matrix', self.build_price_matrix, ['prices'], ['price_matrix'], False),
+            Stage('Loading of Central bank exchange rates prices', self.load_xrub_rates,
+                  ['statement_trades', 'statement_divs', 'io', 'inception_date', 'today', 'fx_cache_files'], ['xrub_rates']),
+            Stage('Apply splits and renames to trades and dividends', self.apply_corporate_actions, ['statement_trades', 'statement_divs', 'corporate_actions'],
+                  ['broker_trades', 'divs']),
+            Stage('Distribute trades', self.distribute_trades,
+                  ['shared_trades_file', 'broker_trades', 'prices', 'corporate_actions', 'tickers_mapping', 'tickers_shared', 'tickers_unique'],
+                  ['trades', 'shared_trades']),
+            Stage('Split trades on buys & sells', self.get_buys_sells, ['trades'], ['buys', 'sells'], False),
+            Stage('Build position ledger', self.build_position_ledger, ['buys', 'sells', 'tickers', 'price_matrix'], ['ledger'], False),
+            Stage('Convert trades, dividends and deposits to rubles', self.convert_to_rub, ['trades', 'divs', 'io', 'xrub_rates'],
+                  ['trades_rub', 'divs_rub', 'io_rub']),
+            Stage('Build tax lots', self.build_tax_lots, ['trades_rub'], ['tax_lots'], False),
+            Stage('Get trades for tax loss harvesting', self.get_tlh_trades, ['tax_lots', 'price_matrix'], ['tlh_trades'], False),
+        ]
+
+    def get_sources(self) -> dict[str, Callable[[], str]]:
+        """Keys of inputs of stages that come from outside of total portfolio"""
+        return {
+            'portfolio_files': lambda: self.get_files_key(x for x in self.PORTFOLIOS_PATH.glob('**/*') if x.is_file() and x.suffix == '.portfolio'),
+            'statement_files': lambda: ' '.join(f'{x}:{self.statement_cache.get_key(x)}' for x in self.get_report_files()),
+            'shared_trades_file': lambda: self.get_files_key([self.SHARED_TICKERS_TRADES]),
+            'today': lambda: f'{date.today()} {type(self.price_source).__name__} {type(self.fx_store.source).__name__}',
+            # caches change when prices or rates are downloaded, so the run after a download loads them from caches once more
+            'prices_cache_files': lambda: self.get_files_stat_key([x.file_path for x in (self.prices_cache, self.splits_cache, self.prices_coverage_cache)]),
+            'fx_cache_files': lambda: self.get_files_stat_key(self.FX_RATES_PATH.glob('*')),
+        }
+
+    @staticmethod
+    def get_files_key(paths: Iterable[Path]) -> str:
+        return ' '.join(f'{x}:{StatementCache.get_file_hash(x)}' for x in sorted(paths))
+
+    @staticmethod
+    def get_files_stat_key(paths: Iterable[Path]) -> str:
+        """Key of files by size and time of change, for caches that are too large to hash on every run"""
+        stats = {x: x.stat() if x.is_file() else None for x in paths}
+        return ' '.join(f'{k}:{v.st_size}:{v.st_mtime_ns}' if v is not None else f'{k}:-' for k, v in sorted(stats.items()))
+
+    def load(self, outputs: Iterable[str] = None) -> TotalPortfolio:
+        """
+        Sets given outputs of stages, all of them by default. Only stages needed for the outputs are run,
+        stages with inputs unchanged since the previous load of this object or since any saved run are skipped.
+        """
+        self.graph.run(outputs)
         return self
 
+    def set_plan(self, name: str, frame: Union[pl.DataFrame, pl.LazyFrame, None]) -> None:
+        self.plans[name] = None if frame is None else frame.lazy()
+        self.frames.pop(name, None)
+
+    def get_plan(self, name: str) -> pl.LazyFrame:
+        """Gives lazy frame, based on materialized frame if it was already collected"""
+        return self.frames[name].lazy() if name in self.frames else self.plans[name]
+
+    def collect(self, name: str) -> Union[pl.DataFrame, None]:
+        if name not in self.frames and self.plans.get(name) is not None:
+            self.frames[name] = self.plans[name].collect()
+        return self.frames.get(name)
+
+    def get_plans(self) -> dict[str, pl.LazyFrame]:
+        return {k: v for k, v in self.plans.items() if v is not None}
+
+    def describe_plans(self) -> str:
+        return '\n'.join(f'{k}:\n{v.describe_optimized_plan()}\n' for k, v in self.get_plans().items())
+
+    def save_shared_state(self, path: Path) -> dict:
+        """Writes frames needed by portfolios to Arrow IPC files in path, the rest of state is small and is returned as is"""
+        for name in self.SHARED_FRAMES:
+            getattr(self, name).write_ipc(path / f'{name}.ipc')
+        return {
+            'path': path,
+            'all_portfolios': self.all_portfolios,
+            'all_target_values': self.all_target_values,
+            'tickers_shared': self.tickers_shared,
+            'debug': self.debug,
+        }
+
+    @classmethod
+    def from_shared_state(cls, state: dict) -> TotalPortfolio:
+        """Total portfolio loaded in another process, frames are memory-mapped without copying"""
+        total_portfolio = cls()
+        for name in cls.SHARED_FRAMES:
+            setattr(total_portfolio, name, pl.read_ipc(state['path'] / f'{name}.ipc', memory_map=True))
+        total_portfolio.all_portfolios = state['all_portfolios']
+        total_portfolio.all_target_values = state['all_target_values']
+        total_portfolio.tickers_shared = state['tickers_shared']
+        total_portfolio.debug = state['debug']
+        return total_portfolio
+
+    def get_report_files(self) -> list[Path]:
+        return sorted(x for x in self.DATA_PATH.glob('**/*') if x.is_file() and x.suffix == '.csv')
+
     def load_raw_reports(self) -> None:
-        report_files = [x for x in self.DATA_PATH.glob('**/*') if x.is_file() and x.suffix == '.csv']
-        for report_file in report_files:
-            report_reader = csv.reader(open(report_file), delimiter=',')
-            self.report_list += list(report_reader)
+        sections = list(StatementParser.SCHEMAS)
+        report_files = self.get_report_files()
+        missing_files = [x for x in report_files if self.rebuild or not self.statement_cache.contains(x, sections)]
+        Profiler.count('statement cache hit', len(report_files) - len(missing_files))
+        Profiler.count('statement cache miss', len(missing_files))
+        self.parse_reports(missing_files)
+
+        statements_frames = [self.statement_cache.load(x, sections) for x in report_files]
+        self.statement_cache.save_index()
+        periods = pl.concat([x['period'] for x in statements_frames]).collect().rows() if statements_frames else []
+        statements_ranges = self.get_statements_ranges(periods)
+        self.statements_frames = [self.get_statement_rows(x, y) for x, y in zip(statements_frames, statements_ranges)]
+        self.statements_dated = [x is not None for x in statements_ranges]
+
+    def parse_reports(self, report_files: list[Path]) -> None:
+        """
+        Parses statements to statement cache, several statements are parsed on a process pool.
+        Small statements are parsed in this process, because start of a worker takes longer than parsing of them.
+        """
+        jobs = [(x, self.statement_cache.get_section_paths(x, list(StatementParser.SCHEMAS))) for x in report_files]
+        self.statement_cache.path.mkdir(parents=True, exist_ok=True)
+        processes = min(os.cpu_count() if self.PARSE_PROCESSES is None else self.PARSE_PROCESSES, len(jobs))
+        if processes <= 1 or sum(x.stat().st_size for x in report_files) < self.PARSE_POOL_MIN_SIZE:
+            for job in jobs:
+                StatementParser.parse_to_files(*job)
+            return
+
+        import multiprocessing
+        # spawn, because forked polars thread pool can deadlock
+        with multiprocessing.get_context('spawn').Pool(processes) as pool:
+            pool.starmap(StatementParser.parse_to_files, jobs)
+
+    @staticmethod
+    def get_statements_ranges(periods: list[tuple[str, date, date]]) -> list[Union[tuple[date, date], None]]:
+        """
+        Range of dates taken from each statement, so statements of one account with overlapping periods give every day once.
+        Day is taken from the statement with the latest end of period, on equal ends from the longer one, then from the last file.
+        All statements that rank higher end no earlier, so together they cover every day from the earliest start of them,
+        and each statement keeps days of its period before that start. Statements without period are taken whole.
+        """
+        ranges = [None] * len(periods)
+        ranked = sorted((x for x in range(len(periods)) if periods[x][1] is not None), key=lambda x: (periods[x][2], -periods[x][1].toordinal(), x),
+                        reverse=True)
+        covered_starts = {}  # earliest start of statements of each account ranked above
+        for i in ranked:
+            account, start, end = periods[i]
+            covered_start = covered_starts.get(account)
+            if covered_start is not None:
+                end = min(end, covered_start - timedelta(days=1))
+            ranges[i] = (start, end)
+            covered_starts[account] = start if covered_start is None else min(start, covered_start)
+        return ranges
+
+    @staticmethod
+    def get_statement_rows(statement_frames: dict[str, pl.LazyFrame], statement_range: Union[tuple[date, date], None]) -> dict[str, pl.LazyFrame]:
+        """Sections of statement with rows of its range of dates only"""
+        if statement_range is None:
+            return statement_frames
+        start, end = statement_range
+        date_columns = StatementParser.DATE_COLUMNS
+        return {
+            k: v.filter(pl.col(date_columns[k]).cast(pl.Date).is_between(start, end, closed='both')) if k in date_columns else v
+            for k, v in statement_frames.items()
+        }
+
+    def get_statements_section(self, section: str, unique_undated: bool = False) -> pl.DataFrame:
+        """
+        Gives lazy section of all statements in one frame, in order of files.
+        Statements without period can not be cut to a range of dates, so with unique_undated their rows that repeat rows of other statements are dropped,
+        and they go after rows of statements with period.
+        """
+        frames = [x[section].lazy() for x in self.statements_frames] or [StatementParser.get_empty_frames()[section].lazy()]
+        if not unique_undated or all(self.statements_dated):
+            return pl.concat(frames)
+
+        dated_frames = [x for x, y in zip(frames, self.statements_dated) if y]
+        undated = pl.concat([x for x, y in zip(frames, self.statements_dated) if not y]).unique(maintain_order=True)
+        if not dated_frames:
+            return undated
+        dated = pl.concat(dated_frames)
+        return pl.concat([dated, undated.join(dated.unique(), on=undated.columns, how='anti')])
 
     def fetch_io(self) -> None:
-        io_report = [x for x in self.report_list if x[0] == 'Deposits & Withdrawals']
-        io_columns = ['date', 'curr', 'amount', 'desc']
-        io_currencies = {x[2] for x in io_report if len(x[2]) == 3}
-        io_data = {x: [] for x in io_columns}
-        for row in iter(io_report):
-            if row[2] not in io_currencies:
-                continue
-            io_data['date'].append(date.fromisoformat(row[3]))
-            io_data['curr'].append(row[2])
-            io_data['amount'].append(float(row[5]))
-            io_data['desc'].append(row[4])
-        self.io = (pl.DataFrame(io_data).with_columns(pl.col('curr').cast(pl.Categorical)).unique().sort(by=io_columns))
+        io_columns = StatementParser.IO_COLUMNS
+        self.io = (self.get_statements_section('io', True).with_columns(pl.col('curr').cast(pl.Categorical)).sort(by=io_columns))
 
     def fetch_divs(self) -> None:
         # mb simpler to load them from yahoo finance
         # parse small divs table
         # TODO remove this table, because it has much less information
-        divs_report = [x for x in self.report_list if x[0] == 'Dividends']
-        divs_currencies = {x[2] for x in divs_report if len(x[2]) == 3}
-        divs_columns = ['pay date', 'ticker', 'div total', 'curr']
-        divs_data = {x: [] for x in divs_columns}
-        for row in iter(divs_report):
-            if row[2] not in divs_currencies:
-                continue
-            divs_data['pay date'].append(date.fromisoformat(row[3]))
-            divs_data['ticker'].append(row[4].split('(')[0].replace(' ', ''))
-            divs_data['div total'].append(float(row[5]))
-            divs_data['curr'].append(row[2])
-        divs_df = (pl.DataFrame(divs_data).with_columns([
+        divs_columns = StatementParser.DIVS_COLUMNS
+        divs_df = (self.get_statements_section('divs', True).with_columns([
             pl.col('ticker').cast(pl.Categorical),
             pl.col('curr').cast(pl.Categorical),
-        ]).unique().sort(by=['pay date', 'ticker']).groupby(['pay date', 'ticker', 'curr'], maintain_order=True).sum().select(divs_columns))
+        ]).sort(by=['pay date', 'ticker']).groupby(['pay date', 'ticker', 'curr'], maintain_order=True).agg(pl.all().sum()).select(divs_columns))
 
         # parse big divs table
-        accruals_report = [x for x in self.report_list if x[0] == 'Change in Dividend Accruals']
-        accruals_columns = ['ex-date', 'pay date', 'ticker', 'quantity', 'div per share', 'div total', 'curr', 'tax']
-        accruals_data = {x: [] for x in accruals_columns}
-        for row in iter(accruals_report):
-            if row[-1] != 'Re':
-                continue
-            accruals_data['ex-date'].append(date.fromisoformat(row[6]))
-            accruals_data['pay date'].append(date(1900, 1, 1) if row[7] == '-' else date.fromisoformat(row[7]))
-            accruals_data['ticker'].append(row[4])
-            accruals_data['quantity'].append(int(row[8]))
-            accruals_data['curr'].append(row[3])
-            accruals_data['div per share'].append(float(row[11]))
-            accruals_data['div total'].append(-float(row[12]))
-            accruals_data['tax'].append(float(row[9]))
-        self.divs = (pl.DataFrame(accruals_data).with_columns([
+        accruals_columns = StatementParser.ACCRUALS_COLUMNS
+        self.statement_divs = (self.get_statements_section('accruals', True).with_columns([
             pl.col('ticker').cast(pl.Categorical),
             pl.col('curr').cast(pl.Categorical),
-        ]).unique().groupby(['ex-date', 'ticker', 'quantity', 'div per share', 'curr'],
-                            maintain_order=True).last().select(accruals_columns).sort(by=['ex-date', 'ticker']))
+        ]).groupby(['ex-date', 'ticker', 'quantity', 'div per share', 'curr'],
+                            maintain_order=True).agg(pl.all().last()).select(accruals_columns).sort(by=['ex-date', 'ticker']))
 
     def fetch_trades(self) -> None:
-        trades_report = [x for x in self.report_list if x[0] == 'Trades']
-        trades_columns = ['datetime', 'ticker', 'quantity', 'price', 'curr', 'fee', 'asset_type', 'code']
-        trades_data = {x: [] for x in trades_columns}
-        for row in iter(trades_report):
-            if row[1] != 'Data' or row[2] != 'Trade':
-                continue
-            trades_data['datetime'].append(datetime.fromisoformat(row[6].replace(',', '')))
-            trades_data['ticker'].append(row[5])
-            trades_data['quantity'].append(float(row[8].replace(',', '')))
-            trades_data['price'].append(float(row[9]))
-            trades_data['curr'].append(row[4])
-            trades_data['fee'].append(float(row[12]) if row[12] != '' else 0.0)
-            trades_data['asset_type'].append(row[3])
-            trades_data['code'].append(row[16])
-
-        self.trades = (pl.DataFrame(trades_data).with_columns([
+        self.statement_trades = (self.get_statements_section('trades').with_columns([
             pl.col('ticker').cast(pl.Categorical),
             pl.col('curr').cast(pl.Categorical),
             pl.col('asset_type').cast(pl.Categorical),
@@ -152,10 +309,14 @@ class TotalPortfolio(PortfolioBase):
 
     def get_all_tickers(self) -> None:
         self.tickers = set(self.tickers_mapping)
-        all_trades_tickers = {x for x in self.trades['ticker'].unique().to_list() if not '.' in x}
+        trades_tickers = self.get_plan('statement_trades').select(pl.col('ticker').cast(pl.Utf8).unique()).collect()
+        all_trades_tickers = {x for x in trades_tickers['ticker'].to_list() if not '.' in x}
         assert all_trades_tickers <= {x.split('.')[0] for x in self.tickers}, 'We have trades that are not in portfolios'
 
     def load_all_portfolios(self) -> None:
+        self.tickers_mapping = {}
+        self.all_portfolios = {}
+        self.all_target_values = {}
         port_paths = [x for x in self.PORTFOLIOS_PATH.glob('**/*') if x.is_file() and x.suffix == '.portfolio']
         for cur_port_path in port_paths:
             port_name = cur_port_path.stem
@@ -185,6 +346,9 @@ class TotalPortfolio(PortfolioBase):
             assert sum(target_weights.values()) == 100, f'Sum of targets weights should be 100, {port_name} portfolio'
             self.all_portfolios[port_name] = target_weights
 
+    def get_inception_date(self) -> None:
+        self.inception_date = self.get_plan('statement_trades').select(pl.col('datetime').min()).collect()[0, 0].date()
+
     def get_shared_tickers(self) -> None:
         all_portfolios = [x for x in self.PORTFOLIOS_PATH.glob('**/*') if x.is_file() and x.suffix == '.portfolio']
         all_tickers = []
@@ -211,207 +375,249 @@ class TotalPortfolio(PortfolioBase):
                     'type': data_list[4] if len(data_list) == 5 else 'REAL',
                 }
                 shared_trades_list.append(data_dict)
-        self.shared_trades = pl.from_dicts(shared_trades_list).with_columns(pl.col('ticker').cast(pl.Categorical))
+        # trades already carry tickers of portfolios and today's shares, so mapping made in shares of the trade date is adjusted the same way
+        shared_trades = pl.from_dicts(shared_trades_list).with_columns([pl.col('ticker').cast(pl.Categorical), pl.col('quantity').cast(pl.Float64)])
+        self.shared_trades = self.corporate_actions.adjust(shared_trades.lazy(), 'date', ['quantity'], []).collect()
 
         # unique trades
-        tickers_mapping_ibkr = self.ibkr_ticker_from_yahoo(self.tickers_mapping)
-        trades_unique = (self.trades.filter(pl.col('ticker').cast(pl.Utf8).is_in(list(self.ibkr_ticker_from_yahoo(self.tickers_unique)))).with_columns(
-            pl.col('ticker').cast(pl.Utf8).apply(lambda x: next(iter(tickers_mapping_ibkr[x]))).alias('portfolio')))
+        unique_portfolios = pl.DataFrame({
+            'ticker': list(self.tickers_mapping),
+            'portfolio': [next(iter(x)) for x in self.tickers_mapping.values()],
+        }).with_columns(pl.col('ticker').cast(pl.Categorical))
+        trades_unique = (self.get_plan('broker_trades').filter(pl.col('ticker').cast(pl.Utf8).is_in(list(self.tickers_unique))).join(unique_portfolios.lazy(),
+                                                                                                                              on='ticker',
+                                                                                                                              how='left'))
 
         # shared trades
-        w = (self.trades.filter(pl.col('ticker').cast(pl.Utf8).is_in(list(self.ibkr_ticker_from_yahoo(self.tickers_shared)))).with_columns([
+        fills = (self.get_plan('broker_trades').filter(pl.col('ticker').cast(pl.Utf8).is_in(list(self.tickers_shared))).with_columns([
             pl.col('datetime').cast(pl.Date).alias('date'),
-            pl.col('fee') / pl.col('quantity'),
-            pl.col('quantity').apply(lambda x: [np.sign(x)] * abs(int(x)))
-        ]).explode('quantity').sort(['date', 'ticker', 'price']))
-        q = (self.shared_trades.filter(pl.col('type') == 'REAL').drop('type').with_columns(
-            pl.col('quantity').cast(pl.Float64).apply(lambda x: [np.sign(x)] * abs(int(x)))).explode('quantity').sort(['date', 'ticker']))
-
-        # checks
-        wq_anti = w.join(q, on=['date', 'ticker', 'quantity'], how='anti')
-        qw_anti = q.join(q, on=['date', 'ticker', 'quantity'], how='anti')
-        if len(wq_anti):
-            wq_anti = (wq_anti.drop(['fee', 'asset_type', 'code', 'date']).groupby(['datetime', 'ticker', 'price',
-                                                                                    'curr']).agg(pl.col('quantity').sum()).sort('datetime'))
-            print('These trades on shared tickers that are not mapped:')
-            self.print_df(wq_anti)
-        if len(qw_anti):
-            qw_anti = (qw_anti.groupby(['date', 'portfolio', 'ticker']).agg(pl.col('quantity').sum()).sort('date'))
-            print('These are mapped trades on shared tickers that do not exist:')
-            self.print_df(qw_anti)
-        assert len(wq_anti) == 0, 'There are trades on shared tickers that are not mapped'
-        assert len(qw_anti) == 0, 'There are mapped trades on shared tickers that do not exist'
-        assert len(w) == len(q)
-
-        w_new = (w.hstack(q.rename({
-            'date': 'date_r',
-            'quantity': 'quantity_r',
-            'ticker': 'ticker_r'
-        })).with_columns(
-            (pl.when((pl.col('date') != pl.col('date_r')) & (pl.col('ticker') != pl.col('ticker_r')) & (pl.col('quantity') != pl.col('quantity_r'))).then(
-                pl.lit(1)).otherwise(pl.lit(0))).alias('errors')).drop(['date', 'date_r', 'ticker_r', 'quantity_r'
-                                                                       ]).groupby(['datetime', 'ticker', 'price', 'curr', 'asset_type', 'code',
-                                                                                   'portfolio']).agg(pl.col(['quantity', 'fee', 'errors']).sum()))
-        assert w_new['errors'].sum() == 0
-        trades_shared = w_new.drop('errors')
+            pl.col('quantity').sign().cast(pl.Float64).alias('sign'),
+        ]))
+        allocations = (self.shared_trades.lazy().filter(pl.col('type') == 'REAL').drop('type').with_columns([
+            pl.col('quantity').cast(pl.Float64),
+            pl.col('quantity').sign().cast(pl.Float64).alias('sign'),
+        ]))
+        self.check_shared_trades(fills, allocations)
+        trades_shared = self.match_allocations(fills, allocations)
 
         # virtual trades
-        trades_virtual = (self.shared_trades.filter(pl.col('type') == 'VIRTUAL').with_columns([
+        trades_virtual = (self.shared_trades.lazy().filter(pl.col('type') == 'VIRTUAL').with_columns([
             pl.col('quantity').cast(pl.Float64),
             pl.col('date').cast(pl.Datetime).alias('datetime'),
             pl.lit('USD').cast(pl.Categorical).alias('curr'),
             pl.lit(0.0).alias('fee'),
             pl.lit('Stocks').cast(pl.Categorical).alias('asset_type'),
             pl.lit('V').alias('code')
-        ]).join(self.prices, on=['date', 'ticker'], how='left').drop(['date', 'type']))
+        ]).join(self.get_plan('prices'), on=['date', 'ticker'], how='left').drop(['date', 'type']))
 
         self.trades = (pl.concat([trades_unique, trades_shared, trades_virtual], how='diagonal').sort(['datetime', 'ticker', 'portfolio']))
 
+    def check_shared_trades(self, fills: pl.LazyFrame, allocations: pl.LazyFrame) -> None:
+        keys = ['date', 'ticker', 'sign']
+        fills_anti = fills.join(allocations, on=keys, how='anti').collect()
+        allocations_anti = allocations.join(fills, on=keys, how='anti').collect()
+        if len(fills_anti):
+            fills_anti = (fills_anti.groupby(['datetime', 'ticker', 'price', 'curr']).agg(pl.col('quantity').sum()).sort('datetime'))
+            print('These trades on shared tickers that are not mapped:')
+            self.print_df(fills_anti)
+        if len(allocations_anti):
+            allocations_anti = (allocations_anti.groupby(['date', 'portfolio', 'ticker']).agg(pl.col('quantity').sum()).sort('date'))
+            print('These are mapped trades on shared tickers that do not exist:')
+            self.print_df(allocations_anti)
+        assert len(fills_anti) == 0, 'There are trades on shared tickers that are not mapped'
+        assert len(allocations_anti) == 0, 'There are mapped trades on shared tickers that do not exist'
+
+        fills_totals = fills.groupby(keys).agg(pl.col('quantity').sum().alias('fills'))
+        allocations_totals = allocations.groupby(keys).agg(pl.col('quantity').sum().alias('allocations'))
+        totals = fills_totals.join(allocations_totals, on=keys).filter(pl.col('fills') != pl.col('allocations')).collect()
+        if len(totals):
+            print('These are shared tickers with different quantity of trades and mapped trades:')
+            self.print_df(totals.sort(keys))
+        assert len(totals) == 0, 'Quantity of mapped trades on shared tickers differs from quantity of trades'
+
+    @staticmethod
+    def match_allocations(fills: pl.LazyFrame, allocations: pl.LazyFrame) -> pl.LazyFrame:
+        """
+        Distributes broker fills between portfolios without splitting them to single shares.
+        Within each date, ticker and side fills ordered by price and allocations in file order are laid on one axis of cumulative quantity.
+        Every range between neighbour bounds of both sides is a part of one fill that belongs to one portfolio.
+        """
+        keys = ['date', 'ticker', 'sign']
+        fills = (fills.with_columns(pl.col('fee') / pl.col('quantity')).sort(['date', 'ticker', 'price', 'datetime']).with_columns(
+            pl.col('quantity').abs().cumsum().over(keys).alias('end')))
+        allocations = (allocations.with_row_count('order').sort(['date', 'ticker', 'order']).with_columns(
+            pl.col('quantity').abs().cumsum().over(keys).alias('end')).select(keys + ['end', 'portfolio']))
+
+        bounds = (pl.concat([fills.select(keys + ['end']), allocations.select(keys + ['end'])]).unique().sort(keys + ['end']).with_columns(
+            pl.col('end').shift().over(keys).fill_null(0.0).alias('start')).sort('end'))
+        pieces = (bounds.join_asof(fills.drop('quantity').sort('end'), on='end', by=keys, strategy='forward').join_asof(allocations.sort('end'),
+                                                                                                                       on='end',
+                                                                                                                       by=keys,
+                                                                                                                       strategy='forward'))
+
+        return (pieces.with_columns([
+            ((pl.col('end') - pl.col('start')) * pl.col('sign')).alias('quantity'),
+            pl.col('fee') * (pl.col('end') - pl.col('start')),
+        ]).groupby(['datetime', 'ticker', 'price', 'curr', 'asset_type', 'code', 'portfolio']).agg(pl.col(['quantity', 'fee']).sum()))
+
     def load_prices_and_splits(self) -> None:
         first_business_day, last_business_day = self.get_date_range_for_load(self.inception_date)
 
-        # try to load cache data and if something is missing, then reload all prices
-        try:
-            with open(self.PRICES_PICKLE_PATH, 'rb') as handle:
-                self.prices = pickle.load(handle)
-            with open(self.SPLITS_PICKLE_PATH, 'rb') as handle:
-                self.splits = pickle.load(handle)
-
-            saved_min_date = self.prices['date'].min()
-            saved_max_date = self.prices['date'].max()
-            saved_etfs = set(self.prices['ticker'].unique().to_list())
-
-            if (saved_etfs == self.tickers and saved_min_date == first_business_day and saved_max_date == last_business_day):
-                return
-            else:
-                print('Cache file with prices misses some values')
-        except FileNotFoundError:
-            print('Cache file with prices or splits does not exist')
-
-        with Timer('Full reload of prices from yahoo', True):
-            data = yf.download(self.tickers, start=first_business_day, end=last_business_day + BDay(1), actions=True)
-            self.prices = (pl.from_pandas(data['Close'].reset_index()).rename({
-                'Date': 'date'
-            }).melt(id_vars='date', variable_name='ticker',
-                    value_name='price').with_columns([pl.col('date').cast(pl.Date), pl.col('ticker').cast(pl.Categorical)]))
-            splits_today = (pl.DataFrame({
-                'datetime': [date.today() + timedelta(days=1)] * len(self.tickers),
-                'ticker': list(self.tickers),
-                'splits': [1.0] * len(self.tickers)
-            }).with_columns([pl.col('datetime').cast(pl.Datetime), pl.col('ticker').cast(pl.Categorical)]))
-            splits_hist = (pl.from_pandas(data['Stock Splits'].reset_index()).rename({
-                'Date': 'datetime'
-            }).melt(id_vars='datetime', variable_name='ticker', value_name='splits').filter(pl.col('splits') > 0).with_columns(
-                [pl.col('datetime').cast(pl.Datetime), pl.col('ticker').cast(pl.Categorical)]).vstack(splits_today))
-
-            # do not know how to optimize it
-            # TODO use partition_by
-            splits_list = []
-            for ticker in self.tickers:
-                cur_splits = (splits_hist.filter(pl.col('ticker') == ticker).with_columns(pl.col('splits').cumprod(reverse=True).alias('coef')).drop('splits'))
-                splits_list.append(cur_splits)
-
-            self.splits = pl.concat(splits_list)
-
-        with open(self.PRICES_PICKLE_PATH, 'wb') as handle:
-            pickle.dump(self.prices, handle, protocol=pickle.HIGHEST_PROTOCOL)
-        with open(self.SPLITS_PICKLE_PATH, 'wb') as handle:
-            pickle.dump(self.splits, handle, protocol=pickle.HIGHEST_PROTOCOL)
+        # try to load cache data and then download only missing ranges of dates for each ticker,
+        # files with wrong format are found by scans, which read only schema, and are rebuilt as missing ones
+        self.prices_coverage = self.prices_coverage_cache.load()
+        prices_history, splits_history = self.prices_cache.scan(), self.splits_cache.scan()
+        if self.prices_coverage is None or prices_history is None or splits_history is None:
+            if not all(x.exists() for x in (self.prices_cache, self.splits_cache, self.prices_coverage_cache)):
+                print('Cache file with prices or splits does not exist')
+            self.prices_coverage = None
+
+        prices_gaps = self.get_prices_gaps(first_business_day, last_business_day)
+        missing_tickers = {x for gap_tickers in prices_gaps.values() for x in gap_tickers}
+        Profiler.count('prices cache hit', len(self.tickers) - len(missing_tickers))
+        Profiler.count('prices cache miss', len(missing_tickers))
+        if prices_gaps:
+            if self.prices_coverage is not None:
+                self.prices_history = self.prices_cache.load()
+                self.splits_history = self.splits_cache.load()
+            if self.prices_history is None or self.splits_history is None:
+                self.prices_history, self.splits_history, self.prices_coverage = None, None, None
+                prices_gaps = self.get_prices_gaps(first_business_day, last_business_day)
+
+            with Timer('Load of missing prices from price source', True):
+                saved_coverage = self.prices_coverage
+                resplit_tickers = set()
+                for (gap_start, gap_end), gap_tickers in prices_gaps.items():
+                    prices, splits = self.price_source.download(gap_tickers, gap_start, gap_end)
+                    resplit_tickers |= self.get_resplit_tickers(splits, saved_coverage)
+                    self.merge_prices(gap_tickers, gap_start, gap_end, prices, splits)
+                if resplit_tickers:
+                    resplit_tickers = sorted(resplit_tickers)
+                    print(f'New splits of {", ".join(resplit_tickers)}, their whole history of prices is loaded again')
+                    self.drop_prices(resplit_tickers)
+                    self.merge_prices(resplit_tickers, first_business_day, last_business_day,
+                                      *self.price_source.download(resplit_tickers, first_business_day, last_business_day))
+
+            self.prices_cache.save(self.prices_history)
+            self.splits_cache.save(self.splits_history)
+            self.prices_coverage_cache.save(self.prices_coverage)
+
+        # without new prices only rows of needed tickers and dates are read from memory-mapped cache
+        if self.prices_history is not None:
+            prices_history, splits_history = self.prices_history.lazy(), self.splits_history.lazy()
+        elif self.prices_coverage is None:
+            prices_history, splits_history = [x.lazy() for x in self.price_source.get_empty_frames()]
+        self.prices = (prices_history.filter(
+            pl.col('ticker').cast(pl.Utf8).is_in(list(self.tickers)) & (pl.col('date') >= first_business_day) & (pl.col('date') <= last_business_day)))
+        self.splits = splits_history.filter(pl.col('ticker').cast(pl.Utf8).is_in(list(self.tickers)))
+
+    def load_corporate_actions(self) -> None:
+        self.corporate_actions.load(self.splits, self.tickers, self.get_ticker_aliases())
+
+    def build_price_matrix(self) -> None:
+        self.price_matrix = PriceMatrix.from_prices(self.prices)
+
+    def get_prices_gaps(self, first_date: date, last_date: date) -> dict[tuple[date, date], list[str]]:
+        """For each missing range of dates gives tickers without prices in it, so tickers with the same gap are downloaded together"""
+        coverage = {} if self.prices_coverage is None else {x['ticker']: (x['start'], x['end']) for x in self.prices_coverage.to_dicts()}
+        gaps = {}
+        for ticker in sorted(self.tickers):
+            if ticker not in coverage:
+                gaps.setdefault((first_date, last_date), []).append(ticker)
+                continue
+            saved_start, saved_end = coverage[ticker]
+            if first_date < saved_start:
+                gaps.setdefault((first_date, saved_start - timedelta(days=1)), []).append(ticker)
+            if saved_end < last_date:
+                gaps.setdefault((saved_end + timedelta(days=1), last_date), []).append(ticker)
+        return gaps
+
+    @staticmethod
+    def get_resplit_tickers(splits: pl.DataFrame, coverage: Union[pl.DataFrame, None]) -> set[str]:
+        """
+        Tickers with splits after the end of their saved prices.
+        Closes are adjusted for splits when they are downloaded, so saved prices of these tickers are in the scale before the split.
+        """
+        if coverage is None:
+            return set()
+        resplit = (splits.select([pl.col('ticker').cast(pl.Utf8), pl.col('datetime').cast(pl.Date)]).join(coverage, on='ticker').filter(
+            pl.col('datetime') > pl.col('end')))
+        return set(resplit['ticker'].to_list())
+
+    def drop_prices(self, tickers: list[str]) -> None:
+        """Removes prices, splits and coverage of tickers from history, so they are loaded as new ones"""
+        self.prices_history = self.prices_history.filter(~pl.col('ticker').cast(pl.Utf8).is_in(tickers))
+        self.splits_history = self.splits_history.filter(~pl.col('ticker').cast(pl.Utf8).is_in(tickers))
+        self.prices_coverage = self.prices_coverage.filter(~pl.col('ticker').is_in(tickers))
+
+    def merge_prices(self, tickers: list[str], start: date, end: date, prices: pl.DataFrame, splits: pl.DataFrame) -> None:
+        """
+        Adds downloaded range of prices and splits to history, downloaded values replace saved ones.
+        Range is loaded for a ticker only up to its last returned close, so failed tickers and days without close yet are asked again next time.
+        Days before the first close are loaded, there are no prices before the ticker was listed.
+        """
+        coverage = (prices.groupby('ticker').agg(pl.col('date').max().alias('end')).select(
+            [pl.col('ticker').cast(pl.Utf8), pl.lit(start).alias('start'), pl.col('end')]).sort('ticker'))
+        if self.prices_history is None:
+            self.prices_history = prices
+            self.splits_history = splits
+            self.prices_coverage = coverage
+            return
+
+        self.prices_history = (pl.concat([prices, self.prices_history]).unique(subset=['date', 'ticker'], keep='first').sort(['ticker', 'date']))
+        self.splits_history = (pl.concat([splits, self.splits_history]).unique(subset=['datetime', 'ticker'], keep='first').sort(['ticker', 'datetime']))
+        self.prices_coverage = (pl.concat([coverage, self.prices_coverage]).groupby('ticker').agg([
+            pl.col('start').min(),
+            pl.col('end').max(),
+        ]).sort('ticker'))
+
+    def get_all_currencies(self) -> set[str]:
+        currencies = pl.concat([self.get_plan(x).select(pl.col('curr').cast(pl.Utf8)) for x in ['statement_trades', 'statement_divs', 'io']]).unique().collect()
+        return set(currencies['curr'].to_list())
 
     def load_xrub_rates(self) -> None:
         """
-        Central bank publishes exchange rates for Tuesdays to Saturdays, so some tricks should be applied
+        Loads exchange rates to rubles of every currency of trades, dividends and deposits
         """
         first_business_day, last_business_day = self.get_date_range_for_load(self.inception_date)
-        s = first_business_day.strftime('%d/%m/%Y')
-        e = last_business_day.strftime('%d/%m/%Y')
-
-        # try to load cache data and if something is missing, then reload all rates
-        try:
-            with open(self.XRUB_PICKLE_PATH, 'rb') as handle:
-                self.xrub_rates = pickle.load(handle)
-
-            saved_min_date = self.xrub_rates['date'].min()
-            saved_max_date = self.xrub_rates['date'].max()
-
-            if (saved_min_date == first_business_day and saved_max_date == last_business_day):
-                return self.xrub_rates
-            else:
-                print('Cache file with prices misses some values')
-        except FileNotFoundError:
-            print('Cache file with rates does not exist')
-
-        with Timer('Full reload of prices from Central Bank API', True):
-            url = f'https://www.cbr.ru/scripts/XML_dynamic.asp?date_req1={s}&date_req2={e}&VAL_NM_RQ=R01235'
-            xrub_rates = (pl.DataFrame(pd.read_xml(url)).drop('Nominal').rename({
-                'Date': 'date',
-                'Id': 'curr',
-                'Value': 'rate'
-            }).with_columns([
-                pl.col('date').str.strptime(pl.Date, fmt='%d.%m.%Y').cast(pl.Date),
-                pl.col('curr').str.replace('R01235', 'USD').cast(pl.Categorical),
-                pl.col('rate').str.replace(',', '.').cast(pl.Float64)
-            ]))
-            dates_list = [first_business_day + timedelta(days=x) for x in range((last_business_day - first_business_day).days + 1)]
-            self.xrub_rates = (pl.DataFrame(dates_list,
-                                            columns=['date']).with_columns(pl.col('date').cast(pl.Date)).join(xrub_rates, on='date', how='left').with_columns(
-                                                pl.col(['curr', 'rate']).backward_fill()))
-
-        with open(self.XRUB_PICKLE_PATH, 'wb') as handle:
-            pickle.dump(self.xrub_rates, handle, protocol=pickle.HIGHEST_PROTOCOL)
-
-    def adjust_trades_by_splits(self) -> None:
-        trades_total_adj = []
-        for ticker in self.tickers:
-            cur_trades_adj = (self.trades.filter(pl.col('ticker') == ticker).join_asof(self.splits.filter(pl.col('ticker') == ticker).drop('ticker'),
-                                                                                       on='datetime',
-                                                                                       strategy='forward').with_columns([
-                                                                                           (pl.col('quantity') * pl.col('coef')).alias('quantity'),
-                                                                                           (pl.col('price') / pl.col('coef')).alias('price')
-                                                                                       ]).drop('coef'))
-            trades_total_adj.append(cur_trades_adj)
-
-        self.trades = pl.concat(trades_total_adj)
+        self.fx_store.load(self.get_all_currencies(), first_business_day, last_business_day)
+        self.xrub_rates = self.fx_store.get_all_rates()
+
+    def get_ticker_aliases(self) -> dict[str, str]:
+        """IBKR names of tickers that have exchange suffix in Yahoo, e.g. SXR8 for SXR8.DE"""
+        ibkr_names = Counter(self.ibkr_ticker_from_yahoo(x) for x in self.tickers)
+        aliases = {self.ibkr_ticker_from_yahoo(x): x for x in self.tickers}
+        return {k: v for k, v in aliases.items() if k != v and ibkr_names[k] == 1 and k not in self.tickers}
+
+    def apply_corporate_actions(self) -> None:
+        self.broker_trades = self.corporate_actions.adjust(self.get_plan('statement_trades'), 'datetime', ['quantity'], ['price'])
+        self.divs = self.corporate_actions.adjust(self.get_plan('statement_divs'), 'ex-date', ['quantity'], ['div per share'])
+
+    def convert_to_rub(self) -> None:
+        """Adds rate of the date of each row and money columns in rubles, dividends are income on the date of payment"""
+        self.trades_rub = self.fx_store.add_base_currency_columns(self.trades, self.xrub_rates, 'datetime', ['price', 'fee'])
+        self.divs_rub = self.fx_store.add_base_currency_columns(self.divs, self.xrub_rates, 'pay date', ['div per share', 'div total', 'tax'])
+        self.io_rub = self.fx_store.add_base_currency_columns(self.io, self.xrub_rates, 'date', ['amount'])
+
+    def build_tax_lots(self) -> None:
+        self.tax_lots = TaxLots(self.trades_rub)
 
     def get_tlh_trades(self) -> None:
         """
         Tax Loss Harvesting
         """
-        filtered_trades = []
-        for ticker in self.tickers:
-            cur_price = pl.last(self.prices.filter(pl.col('ticker') == ticker)['price'])
-            # TODO switch after polars update
-            # cur_price = self.prices.filter(pl.col('ticker') == ticker).select('price').tail(1).item()
-            cur_trades = self.trades.filter(pl.col('ticker') == ticker)
-            cur_buys = (cur_trades.filter(pl.col('quantity') > 0).with_columns([
-                pl.col('datetime').cast(pl.Date).alias('date'),
-                pl.lit(cur_price).alias('cur_price'),
-                pl.min([0, cur_price - pl.col('price')]).alias('diff'),
-            ]).join(self.xrub_rates, on=['date', 'curr']).drop(['datetime', 'asset_type', 'code', 'curr']).with_columns([
-                (pl.col('price') * pl.col('rate')).alias('price_rub'),
-                (pl.col('cur_price') * pl.col('rate')).alias('cur_price_rub'),
-            ]).with_columns((pl.col('quantity') * pl.min([0, pl.col('cur_price_rub') - pl.col('price_rub')])).alias('diff_rub')))
-            cur_sells_sum = (cur_trades.filter(pl.col('quantity') < 0).drop(['asset_type', 'code'])['quantity'].sum())
-            cur_sells_sum = 0 if cur_sells_sum is None else cur_sells_sum
-            cur_buys_sum = cur_buys['quantity'].sum()
-            if not (cur_sells_sum is None) and (cur_buys_sum + cur_sells_sum == 0):
-                continue
-            if cur_buys['diff'].sum() == 0:
-                continue
-
-            for row in cur_buys.to_dicts():
-                if cur_sells_sum == 0:
-                    pass
-                elif cur_sells_sum + row['quantity'] < 0:
-                    cur_sells_sum += row['quantity']
-                    row['quantity'] = 0
-                else:
-                    row['quantity'] += cur_sells_sum
-                    cur_sells_sum = 0
-
-                filtered_trades.append(row)
-
-        self.tlh_trades = (pl.from_dicts(filtered_trades).select(cur_buys.columns).filter((pl.col('quantity') > 0) & (pl.col('diff') < 0)).sort('diff_rub'))
+        cur_prices = (pl.DataFrame({
+            'ticker': self.price_matrix.tickers,
+            'cur_price': self.price_matrix.prices[-1],
+        }).with_columns(pl.col('cur_price').fill_nan(None)))
+        self.tlh_trades = (self.tax_lots.get_open_lots().join(cur_prices, on='ticker').with_columns([
+            pl.col('remaining').alias('quantity'),
+            pl.min([0, pl.col('cur_price') - pl.col('price')]).alias('diff'),
+            pl.col('datetime').cast(pl.Date).alias('date'),
+            (pl.col('cur_price') * pl.col('rate')).alias('cur_price_rub'),
+        ]).with_columns((pl.col('quantity') * pl.min([0, pl.col('cur_price_rub') - pl.col('price_rub')])).alias('diff_rub')).filter(pl.col('diff') < 0).select([
+            'ticker', 'quantity', 'price', 'fee', 'portfolio', 'date', 'cur_price', 'diff', 'rate', 'price_rub', 'cur_price_rub', 'diff_rub'
+        ]).sort('diff_rub'))
 
     def ibkr_ticker_from_yahoo(self, yahoo_tickers: Union[str, set[str]]) -> Union[str, set[str]]:
         # TODO make static
@@ -1,21 +1,181 @@
+import contextlib
+import io
+
+import numpy as np
+import polars as pl
+
 from src.ibkr_jasper.classes.portfolio import Portfolio
 from src.ibkr_jasper.classes.total_portfolio import TotalPortfolio
+from src.ibkr_jasper.frame_writer import FrameWriter
+from src.ibkr_jasper.timer import Timer
+
+
+def get_status(portfolio_name, total_portfolio):
+    output = io.StringIO()
+    with contextlib.redirect_stdout(output), Timer(f'Status of {portfolio_name}', False):
+        port = Portfolio(portfolio_name, total_portfolio).load()
+        port.print_report()
+        port.print_weights()
+    return output.getvalue()
+
+
+def get_status_frames(portfolio_name, total_portfolio):
+    with Timer(f'Status of {portfolio_name}', False):
+        return list(Portfolio(portfolio_name, total_portfolio).load().get_status_frames())
 
 
-def status(portfolio_name):
-    total_portfolio = TotalPortfolio().load()
-    port = Portfolio(portfolio_name, total_portfolio).load()
-    port.print_report()
-    port.print_weights()
+def status(portfolio_name=None, all_portfolios=False):
+    total_portfolio = TotalPortfolio().load(TotalPortfolio.PORTFOLIO_OUTPUTS)
+    if not all_portfolios:
+        if FrameWriter.is_table():
+            print(get_status(portfolio_name, total_portfolio), end='')
+            return
+        with FrameWriter() as writer:
+            # report is written before weights are calculated
+            for table, frame in Portfolio(portfolio_name, total_portfolio).load().get_status_frames():
+                writer.write(table, frame)
+        return
+
+    from src.ibkr_jasper.classes.portfolio_pool import PortfolioPool
+    portfolio_names = sorted(total_portfolio.all_portfolios)
+    if FrameWriter.is_table():
+        for portfolio_name, portfolio_status in zip(portfolio_names, PortfolioPool(total_portfolio).map(get_status, portfolio_names)):
+            print(portfolio_name)
+            print(portfolio_status, end='')
+        return
+    with FrameWriter() as writer:
+        for frames in PortfolioPool(total_portfolio).map(get_status_frames, portfolio_names):
+            for table, frame in frames:
+                writer.write(table, frame)
 
 
 def tlh():
-    total_portfolio = TotalPortfolio().load()
-    total_portfolio.get_tlh_trades()
-    total_portfolio.print_df(total_portfolio.tlh_trades)
+    total_portfolio = TotalPortfolio().load(['tlh_trades'])
+    if FrameWriter.is_table():
+        total_portfolio.print_df(total_portfolio.tlh_trades)
+        return
+    with FrameWriter() as writer:
+        writer.write('tlh', total_portfolio.tlh_trades)
+
+
+def plan(portfolio_name=None):
+    total_portfolio = TotalPortfolio().load(TotalPortfolio.PORTFOLIO_OUTPUTS)
+    port = total_portfolio if portfolio_name is None else Portfolio(portfolio_name, total_portfolio).load()
+    if FrameWriter.is_table():
+        print(port.describe_plans())
+        return
+    plans = port.get_plans()
+    with FrameWriter() as writer:
+        writer.write('plan', pl.DataFrame({'frame': list(plans), 'plan': [x.describe_optimized_plan() for x in plans.values()]}))
+
+
+def stress(*shocks):
+    """Values of portfolios when prices of tickers or exchange rates of currencies change, shocks are like SPY=-20 EUR=-10 in percent"""
+    from src.ibkr_jasper.classes.scenario_engine import ScenarioEngine
+    usage = 'usage: stress TICKER_OR_CURRENCY=PERCENT ..., e.g. stress SPY=-20 EUR=-10'
+    try:
+        shocks = {name: float(percent) / 100 for name, percent in (x.split('=') for x in shocks)}
+    except ValueError:
+        print(usage)
+        return
+    if not shocks:
+        print(usage)
+        return
+
+    total_portfolio = TotalPortfolio().load(['trades', 'price_matrix', 'all_portfolios', 'all_target_values'])
+    engine = ScenarioEngine.from_total_portfolio(total_portfolio)
+    # first scenario is without shocks
+    price_shocks = {x: [0.0, shocks[x]] for x in engine.tickers if x in shocks}
+    fx_shocks = {x: [0.0, shocks[x]] for x in engine.currencies if x in shocks}
+    unknown = set(shocks).difference(price_shocks).difference(fx_shocks)
+    if unknown:
+        print(f'Unknown tickers or currencies: {", ".join(sorted(unknown))}')
+        return
+    results = engine.evaluate(price_shocks or None, fx_shocks or None)
+
+    values, shocked_values = results.values
+    drift = results.weights_drift[-1]
+    lots = results.lots_to_buy[-1]
+    portfolios_stress = pl.DataFrame({
+        'portfolio': results.portfolios,
+        'current value': values,
+        'shocked value': shocked_values,
+        'change': np.divide(shocked_values, values, out=np.ones_like(values), where=values != 0) - 1,
+        'max drift': np.take_along_axis(drift, np.argmax(np.abs(drift), axis=1)[:, None], axis=1)[:, 0],
+    })
+    # lots to buy of tickers of target weights of each portfolio to rebalance it after shocks
+    portfolio_indices, ticker_indices = np.nonzero((engine.target_weights != 0) & np.isfinite(lots))
+    lots_to_buy = pl.DataFrame({
+        'portfolio': [results.portfolios[x] for x in portfolio_indices],
+        'ticker': [results.tickers[x] for x in ticker_indices],
+        'lots to buy': lots[portfolio_indices, ticker_indices],
+    }, columns={'portfolio': pl.Utf8, 'ticker': pl.Utf8, 'lots to buy': pl.Float64})
+
+    if not FrameWriter.is_table():
+        with FrameWriter() as writer:
+            writer.write('stress', portfolios_stress)
+            writer.write('stress_lots', lots_to_buy)
+        return
+
+    from prettytable import PrettyTable
+    values_table = PrettyTable()
+    values_table.align = 'r'
+    values_table.field_names = ['portfolio', 'current value', 'shocked value', 'change', 'max drift', 'lots to buy']
+    for portfolio_name, value, shocked_value, change, max_drift in portfolios_stress.rows():
+        portfolio_lots = lots_to_buy.filter(pl.col('portfolio') == portfolio_name)
+        rebalance = ' '.join(f'{t} {x:,.0f}' for t, x in zip(portfolio_lots['ticker'], portfolio_lots['lots to buy']) if round(x))
+        values_table.add_row([
+            portfolio_name,
+            f'${value:,.0f}',
+            f'${shocked_value:,.0f}',
+            f'{100 * change:.2f}%',
+            f'{max_drift:.1f}%',
+            rebalance,
+        ])
+    print(values_table)
+
+
+def risk(portfolio_name=None, window=None):
+    """Volatility, max drawdown, Sharpe ratio and tracking error against target weights over the last window of business days"""
+    from src.ibkr_jasper.classes.risk_metrics import RiskMetrics
+    window = RiskMetrics.DAYS_IN_YEAR if window is None else int(window)
+    total_portfolio = TotalPortfolio().load(TotalPortfolio.PORTFOLIO_OUTPUTS)
+    portfolio_names = sorted(total_portfolio.all_portfolios) if portfolio_name is None else [portfolio_name]
+
+    def get_last_metrics():
+        for name in portfolio_names:
+            with Timer(f'Risk metrics for {name}', False):
+                metrics = RiskMetrics.from_portfolio(Portfolio(name, total_portfolio).load()).get_metrics(window)
+            yield metrics.tail(1).select([pl.lit(name).alias('portfolio'), pl.lit(window).alias('window'), pl.all()])
+
+    if not FrameWriter.is_table():
+        with FrameWriter() as writer:
+            for last_metrics in get_last_metrics():
+                writer.write('risk', last_metrics)
+        return
+
+    from prettytable import PrettyTable
+    risk_table = PrettyTable()
+    risk_table.align = 'r'
+    risk_table.field_names = ['portfolio', 'volatility', 'max drawdown', 'sharpe', 'tracking error']
+    for name, last_metrics in zip(portfolio_names, get_last_metrics()):
+        last = last_metrics.rows()[0][2:] if len(last_metrics) else [None] * 5
+        risk_table.add_row([name] + ['-' if x is None else f'{100 * x:.2f}%' for x in last[1:3]] + ['-' if last[3] is None else f'{last[3]:.2f}'] +
+                           ['-' if last[4] is None else f'{100 * last[4]:.2f}%'])
+    print(f'Last {window} business days')
+    print(risk_table)
+
+
+def serve(port=None):
+    from src.ibkr_jasper.classes.jasper_daemon import JasperDaemon
+    JasperDaemon(JasperDaemon.PORT if port is None else int(port)).serve()
 
 
 dispatcher = {
     'status': status,
     'tlh': tlh,
+    'plan': plan,
+    'stress': stress,
+    'risk': risk,
+    'serve': serve,
 }
@@ -0,0 +1,72 @@
+from __future__ import annotations
+import json
+import sys
+from pathlib import Path
+
+import polars as pl
+
+
+class FrameWriter:
+    """
+    Writes frames of command results straight from Polars in machine-readable formats, tables for humans are rendered by commands themselves.
+    Line formats ndjson and csv go to stdout frame by frame as soon as each frame is produced, every row is marked with the name of its table.
+    Json is one document {"table": [rows], ...} written on close, so frames of each table are gathered like for files.
+    A parquet or Arrow file holds frames of one schema, so frames of each table are gathered and saved on close to {table}.parquet or {table}.arrow
+    in output directory.
+    """
+    FORMATS = ['table', 'json', 'ndjson', 'csv', 'parquet', 'arrow']
+    FILE_FORMATS = ['parquet', 'arrow']
+    GATHERED_FORMATS = ['json'] + FILE_FORMATS
+    FORMAT = 'table'  # set from command line
+    OUTPUT_PATH = Path('.')  # directory of parquet and arrow files, set from command line
+
+    def __init__(self, output_format: str = None, output_path: Path = None) -> None:
+        self.format = self.FORMAT if output_format is None else output_format
+        self.output_path = self.OUTPUT_PATH if output_path is None else output_path
+        self.csv_columns = None  # columns of the last csv rows, header is written again when they change
+        self.tables = {}  # frames of each table of gathered formats
+
+    @classmethod
+    def is_table(cls) -> bool:
+        return cls.FORMAT == 'table'
+
+    def __enter__(self) -> FrameWriter:
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb) -> None:
+        if exc_type is None:
+            self.close()
+
+    def write(self, table: str, frame: pl.DataFrame) -> None:
+        if self.format in self.GATHERED_FORMATS:
+            self.tables.setdefault(table, []).append(frame)
+            return
+
+        if self.format == 'ndjson':
+            sys.stdout.write(frame.select([pl.lit(table).alias('table'), pl.all()]).write_ndjson())
+        elif self.format == 'csv':
+            frame = frame.select([pl.lit(table).alias('table'), pl.all()])
+            sys.stdout.write(frame.write_csv(has_header=frame.columns != self.csv_columns))
+            self.csv_columns = frame.columns
+        else:
+            raise ValueError(f'Unknown format of frames: {self.format}')
+        sys.stdout.flush()
+
+    def close(self) -> None:
+        """Writes gathered frames, frames of one table with different columns, like reports of portfolios, are aligned by names"""
+        tables = {k: pl.concat(v, how='diagonal') if len(v) > 1 else v[0] for k, v in self.tables.items()}
+        self.tables = {}
+        if self.format == 'json':
+            rows = [f'{json.dumps(k)}: {v.write_json(row_oriented=True)}' for k, v in tables.items()]
+            sys.stdout.write(f'{{{", ".join(rows)}}}\n')
+            sys.stdout.flush()
+            return
+        if not tables:
+            return
+        self.output_path.mkdir(parents=True, exist_ok=True)
+        for table, frame in tables.items():
+            if self.format == 'parquet':
+                # without pyarrow, which imports pandas
+                frame.write_parquet(self.output_path / f'{table}.parquet', use_pyarrow=False)
+            else:
+                frame.write_ipc(self.output_path / f'{table}.arrow')
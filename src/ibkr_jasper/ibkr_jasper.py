@@ -1,17 +1,47 @@
 import argparse
+import inspect
 import polars as pl
+from pathlib import Path
 
+from src.ibkr_jasper.classes.portfolio_base import PortfolioBase
+from src.ibkr_jasper.classes.total_portfolio import TotalPortfolio
 from src.ibkr_jasper.cmd_functions import dispatcher
+from src.ibkr_jasper.frame_writer import FrameWriter
+from src.ibkr_jasper.profiler import Profiler
 
 pl.toggle_string_cache(True)
 
-parser = argparse.ArgumentParser(description='Welcome to IBKR Jasper - the best program for portfolio accounting')
-parser.add_argument('command', type=str, help='type of command to execute')
-parser.add_argument('args', type=str, nargs='*', help='parameters of command')
-args = parser.parse_args()
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Welcome to IBKR Jasper - the best program for portfolio accounting')
+    parser.add_argument('command', type=str, help='type of command to execute')
+    parser.add_argument('args', type=str, nargs='*', help='parameters of command')
+    parser.add_argument('--all', action='store_true', help='run status for all portfolios, each portfolio in its own process')
+    parser.add_argument('--debug', action='store_true', help='print time of every stage')
+    parser.add_argument('--format', choices=FrameWriter.FORMATS, default='table', help='tables for humans, or frames in machine-readable format')
+    parser.add_argument('--output', type=Path, default=Path('.'), help='directory of tables in parquet and arrow formats')
+    parser.add_argument('--rebuild', action='store_true', help='load everything from statements and price caches, ignoring saved stages')
+    parser.add_argument('--profile', type=Path, help='save time, rows, peak memory and cache hits of every stage to file')
+    parser.add_argument('--profile-format', choices=Profiler.FORMATS, default='json', help='tree of stages, or trace for chrome://tracing and Perfetto')
+    args = parser.parse_args()
+    PortfolioBase.DEBUG = args.debug
+    TotalPortfolio.REBUILD = args.rebuild
+    FrameWriter.FORMAT = args.format
+    FrameWriter.OUTPUT_PATH = args.output
 
-try:
-    function = dispatcher[args.command]
-    function(*args.args)
-except KeyError:
-    print(f'command "{args.command}" not found')
+    function = dispatcher.get(args.command)
+    if function is None:
+        print(f'command "{args.command}" not found')
+    elif args.all and 'all_portfolios' not in inspect.signature(function).parameters:
+        parser.error(f'--all is not supported by command "{args.command}"')
+    else:
+        profiler = Profiler().start() if args.profile else None
+        try:
+            if args.all:
+                function(*args.args, all_portfolios=True)
+            else:
+                function(*args.args)
+        finally:
+            if profiler is not None:
+                # stages of portfolios computed in other processes with --all are not profiled
+                profiler.stop()
+                profiler.save(args.profile, args.profile_format)
@@ -0,0 +1,125 @@
+from __future__ import annotations
+import json
+import os
+import tracemalloc
+from pathlib import Path
+from time import time_ns
+
+
+class Span:
+    """Named part of a run with rows of frames it produced, peak of Python memory above its start and counters of cache hits and misses"""
+
+    def __init__(self, name: str) -> None:
+        self.name = name
+        self.start = time_ns()
+        self.end = None
+        self.rows = None
+        self.counters = {}  # counters of span include counters of its children
+        self.memory_start = 0
+        self.memory_peak = 0
+        self.children = []
+
+    def to_dict(self, origin: int) -> dict:
+        return {
+            'name': self.name,
+            'start_ms': (self.start - origin) / 1_000_000,
+            'duration_ms': (self.end - self.start) / 1_000_000,
+            'rows': self.rows,
+            'memory_mb': (self.memory_peak - self.memory_start) / 2**20,
+            'counters': self.counters,
+            'children': [x.to_dict(origin) for x in self.children],
+        }
+
+    def get_trace_events(self, origin: int) -> list[dict]:
+        """Complete events of chrome://tracing and Perfetto for the span and all its children"""
+        event = {
+            'name': self.name,
+            'ph': 'X',
+            'ts': (self.start - origin) / 1000,
+            'dur': (self.end - self.start) / 1000,
+            'pid': os.getpid(),
+            'tid': 0,
+            'args': {
+                'rows': self.rows,
+                'memory_mb': round((self.memory_peak - self.memory_start) / 2**20, 3),
+                **self.counters
+            },
+        }
+        return [event] + [x for child in self.children for x in child.get_trace_events(origin)]
+
+
+class Profiler:
+    """
+    Tree of spans of one run, spans are opened and closed by Timer, so every timed stage is profiled without changes of its code.
+    Peak memory is traced by tracemalloc, which has one peak for the whole process, so the peak of each span is taken
+    before its children reset it and children pass their peaks to parents.
+    """
+    FORMATS = ['json', 'chrome']
+    active = None  # profiler of the current run, spans are not recorded without it
+
+    def __init__(self, trace_memory: bool = True) -> None:
+        self.trace_memory = trace_memory
+        self.root = Span('run')
+        self.stack = [self.root]
+
+    def start(self) -> Profiler:
+        if self.trace_memory:
+            tracemalloc.start()
+        self.root = Span('run')
+        self.stack = [self.root]
+        Profiler.active = self
+        return self
+
+    def stop(self) -> None:
+        self.pop(self.root)
+        if self.trace_memory:
+            tracemalloc.stop()
+        Profiler.active = None
+
+    def push(self, span: Span) -> None:
+        if self.trace_memory:
+            parent = self.stack[-1]
+            current, peak = tracemalloc.get_traced_memory()
+            parent.memory_peak = max(parent.memory_peak, peak)
+            tracemalloc.reset_peak()
+            span.memory_start = span.memory_peak = current
+        self.stack[-1].children.append(span)
+        self.stack.append(span)
+
+    def pop(self, span: Span) -> None:
+        span.end = time_ns()
+        if self.trace_memory:
+            span.memory_peak = max(span.memory_peak, tracemalloc.get_traced_memory()[1])
+        while self.stack and self.stack.pop() is not span:
+            pass
+        if self.stack:
+            self.stack[-1].memory_peak = max(self.stack[-1].memory_peak, span.memory_peak)
+
+    @staticmethod
+    def open(name: str) -> Span:
+        span = Span(name)
+        if Profiler.active is not None:
+            Profiler.active.push(span)
+        return span
+
+    @staticmethod
+    def close(span: Span) -> None:
+        if Profiler.active is not None and span in Profiler.active.stack:
+            Profiler.active.pop(span)
+
+    @staticmethod
+    def count(counter: str, value: int = 1) -> None:
+        """Adds value to counter of all open spans"""
+        if Profiler.active is None or not value:
+            return
+        for span in Profiler.active.stack:
+            span.counters[counter] = span.counters.get(counter, 0) + value
+
+    def save(self, path: Path, profile_format: str = 'json') -> None:
+        """Saves tree of spans as json, or flat list of events for chrome://tracing and Perfetto"""
+        if profile_format == 'chrome':
+            profile = {'traceEvents': self.root.get_trace_events(self.root.start), 'displayTimeUnit': 'ms'}
+        else:
+            profile = self.root.to_dict(self.root.start)
+        with open(path, 'w') as file:
+            json.dump(profile, file, indent=1)
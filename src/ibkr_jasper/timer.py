@@ -1,5 +1,7 @@
 from time import time_ns
 
+from src.ibkr_jasper.profiler import Profiler, Span
+
 
 class Timer:
 
@@ -7,12 +9,14 @@ class Timer:
         self.message = message
         self.do_print_log = do_print_log
 
-    def __enter__(self) -> None:
-        if self.do_print_log:
-            self.start = time_ns()
-        return  # could return anything, to be used like this: with Timer("Message") as value:
+    def __enter__(self) -> Span:
+        self.start = time_ns()
+        # span is recorded only when profiler is active, rows of the timed part can be set like this: with Timer("Message") as span:
+        self.span = Profiler.open(self.message)
+        return self.span
 
     def __exit__(self, type, value, traceback) -> None:
+        Profiler.close(self.span)
         if not self.do_print_log:
             return
 
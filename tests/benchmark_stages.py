@@ -0,0 +1,156 @@
+"""
+Time and memory of every stage of TotalPortfolio and Portfolio on generated workspaces of several sizes,
+run as: python -m tests.benchmark_stages [--update] [size ...]
+Each run starts from empty caches, time is the best of several runs, memory is the peak of Python allocations of the stage (tracemalloc) in a separate run.
+Results are compared with baselines in benchmark_baselines.json, which are written by --update, and the program fails if a stage got slower
+or takes more memory than allowed, or if the list of stages does not match baselines.
+Baselines depend on the machine, so they should be updated on the machine where benchmark runs.
+"""
+import contextlib
+import io
+import json
+import os
+import shutil
+import sys
+import tempfile
+import tracemalloc
+from pathlib import Path
+from time import perf_counter_ns
+from typing import Callable
+
+import polars as pl
+
+from src.ibkr_jasper.classes.fx_source import FileFxSource
+from src.ibkr_jasper.classes.portfolio import Portfolio
+from src.ibkr_jasper.classes.price_source import FilePriceSource
+from src.ibkr_jasper.classes.total_portfolio import TotalPortfolio
+from tests.statement_generator import StatementGenerator
+
+BASELINES_PATH = Path(__file__).parent / 'benchmark_baselines.json'
+SIZES = {
+    'small': {'tickers': 6, 'portfolios': 2, 'years': 2, 'trades': 500},
+    'medium': {'tickers': 20, 'portfolios': 4, 'years': 5, 'trades': 5_000},
+    'large': {'tickers': 60, 'portfolios': 8, 'years': 10, 'trades': 50_000},
+}
+RUNS = 3
+TIME_TOLERANCE = 1.5  # stage is slower if it takes 1.5 times longer than baseline
+MIN_TIME_DIFF_MS = 5.0  # and at least this longer, so noise of short stages is not a regression
+MEMORY_TOLERANCE = 1.25
+MIN_MEMORY_DIFF_MB = 1.0
+
+
+def clear_caches(path: Path) -> None:
+    """Removes everything that program saved in data folder, statements stay"""
+    for cache_path in (path / 'data').iterdir():
+        if cache_path.is_dir():
+            shutil.rmtree(cache_path)
+        elif cache_path.suffix != '.csv':
+            cache_path.unlink()
+
+
+def run_stages(path: Path, trace_memory: bool) -> dict[str, float]:
+    """Runs all stages from empty caches and gives time in ms, or peak memory in MB, of each of them"""
+    results = {}
+
+    def measure(name: str, function: Callable[[], object]) -> None:
+        if trace_memory:
+            # peak above memory that was taken before the stage
+            tracemalloc.reset_peak()
+            before = tracemalloc.get_traced_memory()[0]
+            function()
+            results[name] = (tracemalloc.get_traced_memory()[1] - before) / 2**20
+        else:
+            start = perf_counter_ns()
+            function()
+            results[name] = (perf_counter_ns() - start) / 1_000_000
+
+    clear_caches(path)
+    fixtures_path = path / 'fixtures'
+    get_total_portfolio = lambda: TotalPortfolio(FilePriceSource(fixtures_path), FileFxSource(fixtures_path))
+    total_portfolio = get_total_portfolio()
+    for stage in total_portfolio.graph.stages:
+        measure(f'TotalPortfolio.{stage.name}', stage.function)
+
+    portfolio = Portfolio(sorted(total_portfolio.all_portfolios)[0], total_portfolio)
+    for _, stage in portfolio.get_stages():
+        measure(f'Portfolio.{stage.__name__}', stage)
+    measure('Portfolio.print_report', portfolio.print_report)
+    measure('Portfolio.print_weights', portfolio.print_weights)
+
+    # whole load runs with statements, prices and rates already cached, then status load takes saved stages
+    measure('TotalPortfolio.load', lambda: get_total_portfolio().load())
+    measure('TotalPortfolio.load status from saved stages', lambda: get_total_portfolio().load(TotalPortfolio.PORTFOLIO_OUTPUTS))
+    return results
+
+
+def benchmark(size: str) -> dict[str, dict[str, float]]:
+    with tempfile.TemporaryDirectory() as path:
+        path = Path(path)
+        StatementGenerator(seed=0, **SIZES[size]).write(path)
+        # paths of program are relative to its folder in repository
+        run_path = path / 'src' / 'ibkr_jasper'
+        run_path.mkdir(parents=True)
+        cwd = os.getcwd()
+        os.chdir(run_path)
+        try:
+            with contextlib.redirect_stdout(io.StringIO()):
+                times = [run_stages(path, False) for _ in range(RUNS)]
+                tracemalloc.start()
+                memory = run_stages(path, True)
+                tracemalloc.stop()
+        finally:
+            os.chdir(cwd)
+
+    return {x: {'ms': min(y[x] for y in times), 'mb': memory[x]} for x in memory}
+
+
+def get_regressions(results: dict[str, dict[str, float]], baselines: dict[str, dict[str, float]]) -> list[str]:
+    # new, renamed and removed stages fail until baselines are updated, so no stage is left without a check
+    regressions = [f'{x} has no baseline' for x in results if x not in baselines]
+    regressions += [f'{x} has baseline but is not run' for x in baselines if x not in results]
+    for stage, result in results.items():
+        baseline = baselines.get(stage)
+        if baseline is None:
+            continue
+        if result['ms'] > baseline['ms'] * TIME_TOLERANCE and result['ms'] - baseline['ms'] > MIN_TIME_DIFF_MS:
+            regressions.append(f'{stage} takes {result["ms"]:.1f}ms instead of {baseline["ms"]:.1f}ms')
+        if result['mb'] > baseline['mb'] * MEMORY_TOLERANCE and result['mb'] - baseline['mb'] > MIN_MEMORY_DIFF_MB:
+            regressions.append(f'{stage} takes {result["mb"]:.1f}MB instead of {baseline["mb"]:.1f}MB')
+    return regressions
+
+
+def print_results(size: str, results: dict[str, dict[str, float]], baselines: dict[str, dict[str, float]]) -> None:
+    print(f'\n{size}: {", ".join(f"{k} {v}" for k, v in SIZES[size].items())}')
+    print(f'{"stage":<60}{"ms":>10}{"baseline":>10}{"MB":>10}{"baseline":>10}')
+    for stage, result in results.items():
+        baseline = baselines.get(stage, {})
+        baseline_ms = f'{baseline["ms"]:.1f}' if baseline else '-'
+        baseline_mb = f'{baseline["mb"]:.1f}' if baseline else '-'
+        print(f'{stage:<60}{result["ms"]:>10.1f}{baseline_ms:>10}{result["mb"]:>10.1f}{baseline_mb:>10}')
+
+
+def main(args: list[str]) -> None:
+    update = '--update' in args
+    sizes = [x for x in args if x != '--update'] or list(SIZES)
+    baselines = json.loads(BASELINES_PATH.read_text()) if BASELINES_PATH.is_file() else {}
+    pl.toggle_string_cache(True)
+
+    regressions = []
+    for size in sizes:
+        results = benchmark(size)
+        print_results(size, results, baselines.get(size, {}))
+        regressions += [f'{size}: {x}' for x in get_regressions(results, baselines.get(size, {}))]
+        if update:
+            baselines[size] = {k: {x: round(y, 3) for x, y in v.items()} for k, v in results.items()}
+
+    if update:
+        BASELINES_PATH.write_text(json.dumps(baselines, indent=2) + '\n')
+        print(f'\nBaselines are saved to {BASELINES_PATH}')
+    elif regressions:
+        print('\nRegressions:')
+        print('\n'.join(regressions))
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
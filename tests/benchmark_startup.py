@@ -0,0 +1,108 @@
+"""
+Import time of the command line program and time of warm status, run as: python -m tests.benchmark_startup [runs]
+Each run is a fresh interpreter with -X importtime, the best time of each module over all runs is reported,
+and the program fails if import of the command functions takes longer than the budget.
+Status runs in a fresh interpreter on a generated workspace with saved stages, so it fails too if something on its path,
+not only on import, takes longer than the budget or imports modules that are deferred.
+"""
+import contextlib
+import io
+import os
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+from time import perf_counter_ns
+
+import polars as pl
+
+from src.ibkr_jasper.classes.fx_source import FileFxSource
+from src.ibkr_jasper.classes.price_source import FilePriceSource
+from src.ibkr_jasper.classes.total_portfolio import TotalPortfolio
+from tests.statement_generator import StatementGenerator
+
+ROOT_PATH = Path(__file__).parents[1]
+MODULE = 'src.ibkr_jasper.cmd_functions'
+BUDGET_MS = 300  # without pandas and yfinance, which are imported only to download prices and rates or to print frames
+DEFERRED_MODULES = ['pandas', 'yfinance', 'prettytable', 'dateutil.rrule', 'http.server']
+STATUS_SIZE = {'tickers': 20, 'portfolios': 4, 'years': 5, 'trades': 5_000}
+STATUS_BUDGET_MS = 700  # whole process, with interpreter start and printing of tables
+STATUS_DEFERRED_MODULES = ['pandas', 'pyarrow', 'yfinance', 'http.server']
+
+
+def get_import_times() -> tuple[dict[str, tuple[int, int]], set[str]]:
+    """Self and cumulative import time in microseconds of each module, and names of all imported modules"""
+    code = f'import sys, {MODULE}; print(" ".join(sys.modules))'
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', code], cwd=ROOT_PATH, capture_output=True, text=True, check=True)
+    times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_time, cumulative_time, name = line[len('import time:'):].split('|')
+        times[name.strip()] = (int(self_time), int(cumulative_time))
+    return times, set(result.stdout.split())
+
+
+def get_status_times(runs: int) -> tuple[list[float], set[str]]:
+    """Time in ms of each warm status run of the first portfolio of a generated workspace, and names of modules imported by status"""
+    with tempfile.TemporaryDirectory() as path:
+        path = Path(path)
+        StatementGenerator(seed=0, **STATUS_SIZE).write(path)
+        # paths of program are relative to its folder in repository
+        run_path = path / 'src' / 'ibkr_jasper'
+        run_path.mkdir(parents=True)
+        cwd = os.getcwd()
+        os.chdir(run_path)
+        try:
+            # sources read fixtures, so caches of prices and rates are filled without network, and the second load saves stages
+            # with keys of caches written by the first one
+            with contextlib.redirect_stdout(io.StringIO()):
+                for _ in range(2):
+                    TotalPortfolio(FilePriceSource(path / 'fixtures'), FileFxSource(path / 'fixtures')).load()
+        finally:
+            os.chdir(cwd)
+
+        program_path = ROOT_PATH / 'src' / 'ibkr_jasper' / 'ibkr_jasper.py'
+        code = (f'import runpy, sys; sys.argv = ["ibkr_jasper.py", "status", "p1"]; runpy.run_path({str(program_path)!r}, run_name="__main__"); '
+                'sys.stderr.write(" ".join(sys.modules))')
+        env = dict(os.environ, PYTHONPATH=str(ROOT_PATH))
+        times = []
+        for _ in range(runs + 1):
+            start = perf_counter_ns()
+            result = subprocess.run([sys.executable, '-c', code], cwd=run_path, env=env, capture_output=True, text=True, check=True)
+            times.append((perf_counter_ns() - start) / 1_000_000)
+        # the first run saves results of closed months
+        return times[1:], set(result.stderr.split())
+
+
+def main(runs: int = 5, top: int = 20) -> None:
+    best_times = {}
+    for _ in range(runs):
+        times, modules = get_import_times()
+        for name, (self_time, cumulative_time) in times.items():
+            saved_self_time, saved_cumulative_time = best_times.get(name, (self_time, cumulative_time))
+            best_times[name] = (min(self_time, saved_self_time), min(cumulative_time, saved_cumulative_time))
+
+    print(f'{"module":<60}{"self, ms":>12}{"cumulative, ms":>16}')
+    for name, (self_time, cumulative_time) in sorted(best_times.items(), key=lambda x: -x[1][1])[:top]:
+        print(f'{name:<60}{self_time / 1000:>12.1f}{cumulative_time / 1000:>16.1f}')
+
+    total_ms = best_times[MODULE][1] / 1000
+    print(f'\nimport of {MODULE}: {total_ms:.1f}ms, budget {BUDGET_MS}ms')
+    loaded_deferred = [x for x in DEFERRED_MODULES if x in modules]
+    if loaded_deferred:
+        print(f'modules that should be imported only when needed: {", ".join(loaded_deferred)}')
+
+    status_times, status_modules = get_status_times(runs)
+    status_ms = min(status_times)
+    print(f'warm status of {", ".join(f"{k} {v}" for k, v in STATUS_SIZE.items())}: {status_ms:.1f}ms, budget {STATUS_BUDGET_MS}ms')
+    status_deferred = [x for x in STATUS_DEFERRED_MODULES if x in status_modules]
+    if status_deferred:
+        print(f'modules that warm status should not import: {", ".join(status_deferred)}')
+    if total_ms > BUDGET_MS or loaded_deferred or status_ms > STATUS_BUDGET_MS or status_deferred:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    pl.toggle_string_cache(True)
+    main(*[int(x) for x in sys.argv[1:2]])
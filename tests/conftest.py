@@ -0,0 +1,27 @@
+from datetime import date
+
+import polars as pl
+import pytest
+
+from tests.statement_generator import StatementGenerator
+
+# categoricals of different frames are concatenated and joined, as in the app
+pl.toggle_string_cache(True)
+
+
+@pytest.fixture
+def generator() -> StatementGenerator:
+    generator = StatementGenerator(tickers=8, portfolios=2, years=2, trades=300, seed=1, end_date=date(2024, 6, 28))
+    generator.generate_trades()
+    return generator
+
+
+@pytest.fixture
+def unsplit_tickers(generator: StatementGenerator) -> list[str]:
+    """Tickers without splits, their quantities in generated trades are the same as after adjustment"""
+    return [x for x in generator.ibkr_tickers if x not in generator.splits]
+
+
+@pytest.fixture
+def generated_trades(generator: StatementGenerator) -> pl.DataFrame:
+    return pl.DataFrame(generator.trades).with_columns(pl.col('quantity').cast(pl.Float64))
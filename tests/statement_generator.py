@@ -0,0 +1,220 @@
+"""
+Synthetic workspace for tests and benchmarks, run as: python -m tests.statement_generator <path> [tickers portfolios years trades]
+Writes IBKR activity statements for each year to data/, portfolio files and mapping of shared tickers to portfolios/,
+and prices, splits and Central Bank exchange rates for FilePriceSource and FileFxSource to fixtures/.
+"""
+from __future__ import annotations
+import csv
+import random
+import sys
+from datetime import date, datetime, time, timedelta
+from pathlib import Path
+
+import polars as pl
+
+
+class StatementGenerator:
+    """
+    Trades are random buys and sells of tickers of random portfolios, a sell never takes more shares than the portfolio holds.
+    Every fifth ticker is traded in EUR and has exchange suffix in portfolios (e.g. TAE.DE), a quarter of tickers has a 2:1 split.
+    Shared tickers are in two portfolios and each their trade has a line in shared_tickers.deals.
+    """
+    DEPOSIT = 10_000.0
+    DIV_PER_SHARE = 0.5
+    FEE = -1.0
+    CBR_CURRENCY_IDS = {'USD': 'R01235', 'EUR': 'R01239'}
+
+    def __init__(self, tickers: int = 10, portfolios: int = 3, years: int = 3, trades: int = 1000, seed: int = 0, end_date: date = None) -> None:
+        assert 1 <= portfolios <= tickers, 'Each portfolio needs at least one ticker'
+        self.random = random.Random(seed)
+        self.end_date = date.today() if end_date is None else end_date
+        self.start_date = date(self.end_date.year - years + 1, 1, 1)
+        self.trades_count = trades
+        self.ibkr_tickers = [self.get_ticker_name(i) for i in range(tickers)]
+        self.currencies = {x: 'EUR' if i % 5 == 4 else 'USD' for i, x in enumerate(self.ibkr_tickers)}
+        self.yahoo_tickers = {x: f'{x}.DE' if self.currencies[x] == 'EUR' else x for x in self.ibkr_tickers}
+        self.portfolios = self.get_portfolios(portfolios)
+        self.days = self.get_business_days(self.start_date - timedelta(days=14), self.end_date)
+        self.prices = {x: self.get_prices_path(len(self.days)) for x in self.ibkr_tickers}
+        self.splits = {x: self.random.choice(self.days[len(self.days) // 4:]) for x in self.ibkr_tickers[3::4]}
+        self.trades = []
+        self.deals = []
+
+    @staticmethod
+    def get_ticker_name(index: int) -> str:
+        letters = 'ABCDEFGHIJKLMNOPQRSTUVWXYZ'
+        return 'T' + letters[index // 26 % 26] + letters[index % 26]
+
+    @staticmethod
+    def get_business_days(start: date, end: date) -> list[date]:
+        return [start + timedelta(days=x) for x in range((end - start).days + 1) if (start + timedelta(days=x)).weekday() < 5]
+
+    def get_portfolios(self, count: int) -> dict[str, dict[str, int]]:
+        """Tickers are dealt to portfolios in turn, then some of them are added to the next portfolio as shared"""
+        names = [f'p{i + 1}' for i in range(count)]
+        tickers = {x: [] for x in names}
+        for i, ticker in enumerate(self.ibkr_tickers):
+            tickers[names[i % count]].append(ticker)
+        if count > 1:
+            for i, ticker in enumerate(self.ibkr_tickers[:max(1, len(self.ibkr_tickers) // 5)]):
+                next_name = names[(i + 1) % count]
+                if ticker not in tickers[next_name]:
+                    tickers[next_name].append(ticker)
+
+        portfolios = {}
+        for name, port_tickers in tickers.items():
+            weights = [100 // len(port_tickers)] * len(port_tickers)
+            weights[0] += 100 - sum(weights)
+            portfolios[name] = dict(zip(port_tickers, weights))
+        return portfolios
+
+    def get_prices_path(self, length: int) -> list[float]:
+        price = self.random.uniform(20, 300)
+        path = []
+        for _ in range(length):
+            price *= 1 + self.random.gauss(0.0002, 0.012)
+            path.append(round(price, 4))
+        return path
+
+    def get_factor(self, ticker: str, moment: datetime) -> int:
+        """Shares on the moment that make one share of today, same as factor of corporate actions"""
+        return 2 if ticker in self.splits and datetime.combine(self.splits[ticker], time()) >= moment else 1
+
+    def get_shared_tickers(self) -> set[str]:
+        counts = {}
+        for weights in self.portfolios.values():
+            for ticker in weights:
+                counts[ticker] = counts.get(ticker, 0) + 1
+        return {k for k, v in counts.items() if v > 1}
+
+    def generate_trades(self) -> None:
+        shared_tickers = self.get_shared_tickers()
+        trade_days = [x for x in self.days if x >= self.start_date and x < self.end_date]
+        moments = sorted(
+            datetime.combine(self.random.choice(trade_days), time(9, 30)) + timedelta(seconds=self.random.randint(0, 6 * 3600))
+            for _ in range(self.trades_count))
+        day_index = {x: i for i, x in enumerate(self.days)}
+        holdings = {}  # shares of today of each ticker in each portfolio
+        self.trades = []
+        self.deals = []
+        for moment in moments:
+            portfolio = self.random.choice(list(self.portfolios))
+            ticker = self.random.choice(list(self.portfolios[portfolio]))
+            factor = self.get_factor(ticker, moment)
+            held = holdings.get((portfolio, ticker), 0) // factor
+            quantity = -self.random.randint(1, held) if held and self.random.random() < 0.3 else self.random.randint(1, 100)
+            holdings[(portfolio, ticker)] = holdings.get((portfolio, ticker), 0) + quantity * factor
+            price = self.prices[ticker][day_index[moment.date()]] * factor * (1 + self.random.uniform(-0.005, 0.005))
+            self.trades.append({'datetime': moment, 'ticker': ticker, 'quantity': quantity, 'price': round(price, 4), 'portfolio': portfolio})
+            if ticker in shared_tickers:
+                self.deals.append(f'{moment:%Y.%m.%d} {ticker} {quantity} {portfolio}')
+
+    def get_statement_rows(self, year: int) -> list[list[str]]:
+        first_day, last_day = date(year, 1, 1), min(date(year, 12, 31), self.end_date)
+        rows = [
+            ['Statement', 'Header', 'Field Name', 'Field Value'],
+            ['Statement', 'Data', 'Period', f'{first_day:%B %-d, %Y} - {last_day:%B %-d, %Y}'],
+            ['Deposits & Withdrawals', 'Header', 'Currency', 'Settle Date', 'Description', 'Amount'],
+        ]
+        months = [date(year, x, 3) for x in range(1, 13) if date(year, x, 3) <= last_day]
+        rows += [['Deposits & Withdrawals', 'Data', 'USD', x.isoformat(), 'Electronic Fund Transfer', str(self.DEPOSIT)] for x in months]
+        rows.append(['Deposits & Withdrawals', 'Data', 'Total', '', '', str(self.DEPOSIT * len(months))])
+
+        rows.append(['Trades', 'Header', 'DataDiscriminator', 'Asset Category', 'Currency', 'Symbol', 'Date/Time', 'Exchange', 'Quantity', 'T. Price',
+                     'C. Price', 'Proceeds', 'Comm/Fee', 'Basis', 'Realized P/L', 'MTM P/L', 'Code'])
+        for trade in self.trades:
+            if trade['datetime'].year != year:
+                continue
+            quantity, price = trade['quantity'], trade['price']
+            rows.append([
+                'Trades', 'Data', 'Trade', 'Stocks', self.currencies[trade['ticker']], trade['ticker'], f'{trade["datetime"]:%Y-%m-%d, %H:%M:%S}', 'ARCA',
+                f'{quantity:,}',
+                str(price),
+                str(price),
+                f'{-quantity * price:.2f}',
+                str(self.FEE), '', '', '', 'O' if quantity > 0 else 'C'
+            ])
+
+        rows.append(['Dividends', 'Header', 'Currency', 'Date', 'Description', 'Amount'])
+        accruals = [[
+            'Change in Dividend Accruals', 'Header', 'Asset Category', 'Currency', 'Symbol', 'Date', 'Ex Date', 'Pay Date', 'Quantity', 'Tax', 'Fee',
+            'Gross Rate', 'Gross Amount', 'Net Amount', 'Code'
+        ]]
+        total = 0.0
+        for ex_date in [date(year, x, 20) for x in (3, 6, 9, 12)]:
+            pay_date = ex_date + timedelta(days=5)
+            if pay_date > last_day:
+                continue
+            for ticker, quantity in self.get_positions(ex_date).items():
+                curr = self.currencies[ticker]
+                amount = quantity * self.DIV_PER_SHARE
+                total += amount
+                description = f'{ticker}(US0000000000) Cash Dividend {curr} {self.DIV_PER_SHARE} per Share'
+                rows.append(['Dividends', 'Data', curr, pay_date.isoformat(), description, str(amount)])
+                for code, sign in [('Po', 1), ('Re', -1)]:
+                    accruals.append([
+                        'Change in Dividend Accruals', 'Data', 'Stocks', curr, ticker, ex_date.isoformat(), ex_date.isoformat(),
+                        pay_date.isoformat(),
+                        str(quantity),
+                        str(sign * 0.1 * amount), '0',
+                        str(self.DIV_PER_SHARE),
+                        str(sign * amount),
+                        str(sign * 0.9 * amount), code
+                    ])
+        rows.append(['Dividends', 'Data', 'Total', '', '', str(total)])
+        return rows + accruals
+
+    def get_positions(self, day: date) -> dict[str, int]:
+        """Shares of each ticker held at the end of the day, as they were on that day"""
+        end = datetime.combine(day + timedelta(days=1), time())
+        positions = {}
+        for trade in self.trades:
+            if trade['datetime'] >= end:
+                break
+            ticker = trade['ticker']
+            positions[ticker] = positions.get(ticker, 0) + trade['quantity'] * self.get_factor(ticker, trade['datetime'])
+        return {k: v // self.get_factor(k, end) for k, v in positions.items() if v > 0}
+
+    def write_cbr_xml(self, path: Path, curr: str, base_rate: float) -> None:
+        records = []
+        day = self.days[0]
+        while day <= self.end_date:
+            # rates are published with decimal comma
+            rate = f'{base_rate * (1 + 0.1 * ((day - self.days[0]).days % 365) / 365):.4f}'.replace('.', ',')
+            records.append(f'<Record Date="{day:%d.%m.%Y}" Id="{self.CBR_CURRENCY_IDS[curr]}"><Nominal>1</Nominal><Value>{rate}</Value></Record>')
+            day += timedelta(days=1)
+        with open(path, 'w', encoding='windows-1251') as file:
+            file.write(f'<?xml version="1.0" encoding="windows-1251"?><ValCurs ID="{self.CBR_CURRENCY_IDS[curr]}" name="Foreign Currency Market Dynamic">')
+            file.write(''.join(records))
+            file.write('</ValCurs>')
+
+    def write(self, path: Path) -> None:
+        self.generate_trades()
+        for folder in ['data', 'portfolios', 'fixtures']:
+            (path / folder).mkdir(parents=True, exist_ok=True)
+
+        for year in range(self.start_date.year, self.end_date.year + 1):
+            with open(path / 'data' / f'U0000000_{year}.csv', 'w', newline='') as file:
+                csv.writer(file).writerows(self.get_statement_rows(year))
+
+        for name, weights in self.portfolios.items():
+            lines = ['target_value 100000'] + [f'{self.yahoo_tickers[k]} {v}' for k, v in weights.items()]
+            (path / 'portfolios' / f'{name}.portfolio').write_text('\n'.join(lines) + '\n')
+        (path / 'portfolios' / 'shared_tickers.deals').write_text('# date ticker quantity portfolio\n' + ''.join(f'{x}\n' for x in self.deals))
+
+        pl.DataFrame({
+            'date': [x.isoformat() for x in self.days for _ in self.ibkr_tickers],
+            'ticker': [self.yahoo_tickers[x] for _ in self.days for x in self.ibkr_tickers],
+            'price': [self.prices[x][i] for i in range(len(self.days)) for x in self.ibkr_tickers],
+        }).write_csv(path / 'fixtures' / 'prices.csv')
+        pl.DataFrame({
+            'date': [x.isoformat() for x in self.splits.values()],
+            'ticker': [self.yahoo_tickers[x] for x in self.splits],
+            'splits': [2.0] * len(self.splits),
+        }).write_csv(path / 'fixtures' / 'splits.csv')
+        self.write_cbr_xml(path / 'fixtures' / 'USD.xml', 'USD', 70.0)
+        self.write_cbr_xml(path / 'fixtures' / 'EUR.xml', 'EUR', 75.0)
+
+
+if __name__ == '__main__':
+    StatementGenerator(*[int(x) for x in sys.argv[2:6]]).write(Path(sys.argv[1]))
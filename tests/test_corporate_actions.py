@@ -0,0 +1,56 @@
+from datetime import date, datetime
+
+import polars as pl
+import pytest
+
+from src.ibkr_jasper.classes.corporate_actions import CorporateActions
+from src.ibkr_jasper.classes.total_portfolio import TotalPortfolio
+
+
+@pytest.fixture
+def splits() -> pl.DataFrame:
+    return pl.DataFrame({
+        'datetime': [datetime(2023, 6, 1), datetime(2024, 3, 1), datetime(2023, 1, 2)],
+        'ticker': ['SXR8.DE', 'SXR8.DE', 'VTI'],
+        'splits': [3.0, 2.0, 4.0],
+    }).with_columns(pl.col('ticker').cast(pl.Categorical))
+
+
+def test_factor_is_product_of_split_and_later_ones(splits):
+    factors = CorporateActions.get_factors(splits.with_columns(pl.col('ticker').cast(pl.Utf8)))
+    assert factors.select(['ticker', 'splits', 'factor']).rows() == [('SXR8.DE', 3.0, 6.0), ('SXR8.DE', 2.0, 2.0), ('VTI', 4.0, 4.0)]
+
+
+def test_renamed_trades_are_brought_to_today_shares(tmp_path, splits):
+    corporate_actions = CorporateActions(tmp_path)
+    corporate_actions.load(splits, {'SXR8.DE'}, {'SXR8': 'SXR8.DE'})
+    trades = pl.DataFrame({
+        'datetime': [datetime(2023, 5, 1), datetime(2023, 7, 1), datetime(2024, 4, 1), datetime(2023, 5, 1)],
+        'ticker': ['SXR8', 'SXR8', 'SXR8', 'VTI'],
+        'quantity': [1.0, 1.0, 1.0, 1.0],
+        'price': [600.0, 200.0, 100.0, 50.0],
+    })
+    trades = corporate_actions.adjust(trades.lazy(), 'datetime', ['quantity'], ['price']).collect()
+    assert trades.rows() == [(datetime(2023, 5, 1), 'SXR8.DE', 6.0, 100.0), (datetime(2023, 7, 1), 'SXR8.DE', 2.0, 100.0),
+                             (datetime(2024, 4, 1), 'SXR8.DE', 1.0, 100.0), (datetime(2023, 5, 1), 'VTI', 1.0, 50.0)]
+
+
+def test_rows_on_date_of_split_are_known_after_it(tmp_path, splits):
+    corporate_actions = CorporateActions(tmp_path)
+    corporate_actions.load(splits, {'SXR8.DE'}, {})
+    divs = pl.DataFrame({'ex-date': [date(2024, 2, 29), date(2024, 3, 1)], 'ticker': ['SXR8.DE', 'SXR8.DE'], 'quantity': [1.0, 1.0]})
+    assert corporate_actions.adjust(divs.lazy(), 'ex-date', ['quantity'], []).collect()['quantity'].to_list() == [2.0, 1.0]
+
+
+def test_saved_factors_are_recalculated_for_changed_tickers(tmp_path, splits):
+    CorporateActions(tmp_path).load(splits, {'SXR8.DE', 'VTI'}, {})
+    corporate_actions = CorporateActions(tmp_path)
+    corporate_actions.load(splits.filter(pl.col('splits') != 2.0), {'SXR8.DE', 'VTI'}, {})
+    assert corporate_actions.factors.select(['ticker', 'factor']).rows() == [('SXR8.DE', 3.0), ('VTI', 4.0)]
+    assert CorporateActions(tmp_path).cache.load().select(['ticker', 'factor']).rows() == [('SXR8.DE', 3.0), ('VTI', 4.0)]
+
+
+def test_aliases_are_unambiguous_names_without_exchange_suffix():
+    total_portfolio = TotalPortfolio()
+    total_portfolio.tickers = {'SXR8.DE', 'VTI', 'X.DE', 'X.L', 'Y.DE', 'Y'}
+    assert total_portfolio.get_ticker_aliases() == {'SXR8': 'SXR8.DE'}
@@ -0,0 +1,57 @@
+import io
+import json
+from datetime import date
+
+import polars as pl
+import pytest
+
+from src.ibkr_jasper.frame_writer import FrameWriter
+
+REPORTS = [
+    pl.DataFrame({'portfolio': ['p1'], 'date': [date(2024, 1, 1)], 'A': [10.0]}),
+    pl.DataFrame({'portfolio': ['p2', 'p2'], 'date': [date(2024, 1, 1), date(2024, 2, 1)], 'B': [1.0, 2.0]}),
+]
+WEIGHTS = pl.DataFrame({'ticker': ['A', 'B'], 'fact': [50.5, 49.5]})
+
+
+def write(output_format: str, output_path=None) -> None:
+    with FrameWriter(output_format, output_path) as writer:
+        for frame in REPORTS:
+            writer.write('report', frame)
+        writer.write('weights', WEIGHTS)
+
+
+def test_json_is_one_document_with_rows_of_each_table(capsys):
+    write('json')
+    document = json.loads(capsys.readouterr().out)
+    assert document['weights'] == WEIGHTS.to_dicts()
+    assert [(x['portfolio'], x['A'], x['B']) for x in document['report']] == [('p1', 10.0, None), ('p2', None, 1.0), ('p2', None, 2.0)]
+
+
+def test_json_without_frames_is_empty_document(capsys):
+    with FrameWriter('json'):
+        pass
+    assert json.loads(capsys.readouterr().out) == {}
+
+
+def test_ndjson_has_one_row_per_line_marked_with_table(capsys):
+    write('ndjson')
+    rows = [json.loads(x) for x in capsys.readouterr().out.splitlines()]
+    assert [x['table'] for x in rows] == ['report'] * 3 + ['weights'] * 2
+    assert rows[-1] == {'table': 'weights', 'ticker': 'B', 'fact': 49.5}
+
+
+def test_csv_repeats_header_when_columns_change(capsys):
+    write('csv')
+    blocks = capsys.readouterr().out.split('table,')[1:]
+    frames = [pl.read_csv(io.StringIO('table,' + x)) for x in blocks]
+    assert [x.columns for x in frames] == [['table', 'portfolio', 'date', 'A'], ['table', 'portfolio', 'date', 'B'], ['table', 'ticker', 'fact']]
+    assert frames[2].drop('table').frame_equal(WEIGHTS)
+
+
+@pytest.mark.parametrize('output_format, read', [('parquet', pl.read_parquet), ('arrow', pl.read_ipc)])
+def test_files_hold_frames_of_each_table_aligned_by_names(tmp_path, output_format, read):
+    write(output_format, tmp_path)
+    assert read(tmp_path / f'weights.{output_format}').frame_equal(WEIGHTS)
+    report = read(tmp_path / f'report.{output_format}')
+    assert report.frame_equal(pl.concat(REPORTS, how='diagonal'), null_equal=True)
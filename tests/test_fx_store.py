@@ -0,0 +1,35 @@
+from datetime import date
+
+import polars as pl
+import pytest
+
+from src.ibkr_jasper.classes.fx_store import FxStore
+
+
+@pytest.fixture
+def fx_store(tmp_path) -> FxStore:
+    return FxStore(tmp_path, None)
+
+
+@pytest.fixture
+def rates() -> pl.DataFrame:
+    # rates are published for Tuesdays to Saturdays
+    return pl.DataFrame({
+        'date': [date(2024, 1, 9), date(2024, 1, 10), date(2024, 1, 13), date(2024, 1, 10)],
+        'curr': ['USD', 'USD', 'USD', 'EUR'],
+        'rate': [90.0, 91.0, 92.0, 100.0],
+    }).sort('date')
+
+
+def test_dates_take_next_published_rate(fx_store, rates):
+    frame = pl.DataFrame({
+        'date': [date(2024, 1, 10), date(2024, 1, 8), date(2024, 1, 11), date(2024, 1, 14), date(2024, 1, 9), date(2024, 1, 9)],
+        'curr': ['USD', 'USD', 'USD', 'USD', 'EUR', 'RUB'],
+    }).with_columns(pl.col('curr').cast(pl.Categorical))
+    assert fx_store.add_rates(frame, rates)['rate'].to_list() == [91.0, 90.0, 92.0, 92.0, 100.0, 1.0]
+
+
+def test_base_currency_columns(fx_store, rates):
+    frame = pl.DataFrame({'day': [date(2024, 1, 12)], 'curr': ['USD'], 'price': [2.0]})
+    frame = fx_store.add_base_currency_columns(frame, rates, 'day', ['price'])
+    assert frame.row(0) == (date(2024, 1, 12), 'USD', 2.0, 92.0, 184.0)
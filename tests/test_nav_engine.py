@@ -0,0 +1,37 @@
+from datetime import date
+
+import numpy as np
+import polars as pl
+import pytest
+
+from src.ibkr_jasper.classes.nav_engine import NavEngine
+
+
+@pytest.fixture
+def engine() -> NavEngine:
+    # value grows 10% on the first day, then grows 5% on the second day, when a deposit of 100 is made
+    days = np.arange(np.datetime64('2024-01-01'), np.datetime64('2024-01-04'))
+    nav = np.array([100.0, 110.0, 215.5])
+    values = dict(zip(days.tolist(), nav))
+    flows = pl.DataFrame({'date': [date(2024, 1, 2), date(2025, 1, 1)], 'flow': [100.0, 50.0]})
+    return NavEngine.from_flows(date(2024, 1, 1), date(2024, 1, 3), lambda x: np.array([values[y] for y in x.tolist()]), flows)
+
+
+def test_flows_out_of_range_are_dropped(engine):
+    assert engine.flows.tolist() == [0.0, 100.0, 0.0]
+
+
+def test_time_weighted_return_excludes_flows(engine):
+    assert engine.daily_factors == pytest.approx([1.1, 1.05])
+    assert engine.period_return(date(2024, 1, 1), date(2024, 1, 3)) == pytest.approx(1.1 * 1.05 - 1)
+
+
+def test_periods_are_half_open(engine):
+    returns = engine.period_returns([date(2024, 1, 1), date(2024, 1, 2), date(2024, 1, 2)], [date(2024, 1, 2), date(2024, 1, 3), date(2024, 1, 2)])
+    assert returns == pytest.approx([0.1, 0.05, 0.0])
+
+
+def test_period_after_total_loss_chains_its_own_days():
+    engine = NavEngine(np.arange(np.datetime64('2024-01-01'), np.datetime64('2024-01-05')), np.array([100.0, 0.0, 50.0, 60.0]),
+                       np.array([0.0, 50.0, 0.0, 0.0]))
+    assert engine.period_return(date(2024, 1, 3), date(2024, 1, 4)) == pytest.approx(0.2)
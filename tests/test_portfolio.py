@@ -0,0 +1,37 @@
+import contextlib
+import io
+
+import pytest
+
+from src.ibkr_jasper.classes.fx_source import FileFxSource
+from src.ibkr_jasper.classes.portfolio import Portfolio
+from src.ibkr_jasper.classes.price_source import FilePriceSource
+from src.ibkr_jasper.classes.total_portfolio import TotalPortfolio
+from tests.statement_generator import StatementGenerator
+
+
+@pytest.fixture
+def get_total_portfolio(tmp_path, monkeypatch):
+    StatementGenerator(tickers=6, portfolios=2, years=2, trades=300, seed=0).write(tmp_path)
+    # paths of program are relative to its folder in repository
+    run_path = tmp_path / 'src' / 'ibkr_jasper'
+    run_path.mkdir(parents=True)
+    monkeypatch.chdir(run_path)
+    fixtures_path = tmp_path / 'fixtures'
+    return lambda: TotalPortfolio(FilePriceSource(fixtures_path), FileFxSource(fixtures_path))
+
+
+def test_portfolio_filters_are_pushed_down_to_saved_stages(get_total_portfolio):
+    with contextlib.redirect_stdout(io.StringIO()):
+        # the second load saves stages again with keys of caches written by the first one
+        get_total_portfolio().load()
+        get_total_portfolio().load()
+        total_portfolio = get_total_portfolio().load(TotalPortfolio.PORTFOLIO_OUTPUTS)
+        portfolio = Portfolio('p1', total_portfolio).load()
+
+    assert total_portfolio.frames == {}
+    plans = {k: v.describe_optimized_plan() for k, v in portfolio.get_plans().items()}
+    assert 'SELECTION: [(col("portfolio")) == (Utf8(p1))]' in plans['trades']
+    assert 'is_in' in plans['divs'] and 'is_in' in plans['prices']
+    assert all('IPC SCAN ../../data/stages/' in x for x in plans.values())
+    assert len(portfolio.trades) and len(portfolio.prices)
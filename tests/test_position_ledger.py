@@ -0,0 +1,27 @@
+from datetime import date, datetime, timedelta
+
+import numpy as np
+import polars as pl
+
+from src.ibkr_jasper.classes.position_ledger import PositionLedger
+
+
+def test_positions_at_are_before_start_of_date():
+    trades = pl.DataFrame({
+        'datetime': [datetime(2024, 1, 2, 10), datetime(2024, 1, 2, 15), datetime(2024, 1, 4, 10)],
+        'ticker': ['A', 'B', 'A'],
+        'quantity': [10.0, 5.0, -4.0],
+    })
+    ledger = PositionLedger(trades, ['A', 'B', 'C'])
+    positions = ledger.positions_at([date(2024, 1, 2), date(2024, 1, 3), date(2024, 1, 4), datetime(2024, 1, 4, 12)])
+    assert positions.tolist() == [[0, 0, 0], [10, 5, 0], [10, 5, 0], [6, 5, 0]]
+    assert ledger.position_at(date(2024, 1, 5)) == {'A': 6.0, 'B': 5.0, 'C': 0.0}
+
+
+def test_positions_at_match_generated_holdings(generator, unsplit_tickers, generated_trades):
+    ledger = PositionLedger(generated_trades, unsplit_tickers)
+    days = [date(2023, 3, 31), date(2023, 12, 29), date(2024, 6, 27)]
+    positions = ledger.positions_at([x + timedelta(days=1) for x in days])
+    for day, row in zip(days, positions):
+        expected = generator.get_positions(day)
+        assert np.array_equal(row, [expected.get(x, 0) for x in unsplit_tickers])
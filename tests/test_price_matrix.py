@@ -0,0 +1,29 @@
+from datetime import date
+
+import numpy as np
+import polars as pl
+
+from src.ibkr_jasper.classes.price_matrix import PriceMatrix
+
+
+def test_forward_fill_keeps_leading_nans():
+    matrix = np.array([[np.nan, 1.0], [2.0, np.nan], [np.nan, np.nan], [3.0, 4.0]])
+    filled = PriceMatrix.forward_fill(matrix)
+    assert np.array_equal(filled, [[np.nan, 1.0], [2.0, 1.0], [2.0, 1.0], [3.0, 4.0]], equal_nan=True)
+
+
+def test_prices_at_give_previous_close_over_holidays():
+    prices = pl.DataFrame({
+        'date': [date(2024, 1, 4), date(2024, 1, 5), date(2024, 1, 9), date(2024, 1, 5)],
+        'ticker': ['A', 'A', 'A', 'B'],
+        'price': [10.0, 11.0, 12.0, 20.0],
+    })
+    matrix = PriceMatrix.from_prices(prices)
+    # weekend and missing Monday take Friday close
+    assert matrix.price_at('A', date(2024, 1, 8)) == 11.0
+    assert matrix.price_at('A', date(2024, 1, 9)) == 11.0
+    assert matrix.price_at('A', date(2024, 1, 10)) == 12.0
+    assert matrix.price_at('B', date(2024, 1, 5)) is None
+    assert matrix.price_at('B', date(2024, 1, 10)) == 20.0
+    assert matrix.price_at('C', date(2024, 1, 10)) is None
+    assert matrix.values_at([date(2024, 1, 10)], np.array([[2.0, 1.0]])).tolist() == [44.0]
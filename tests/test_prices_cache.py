@@ -0,0 +1,77 @@
+from datetime import date, timedelta
+
+import polars as pl
+import pytest
+
+from src.ibkr_jasper.classes.price_source import FilePriceSource
+from src.ibkr_jasper.classes.total_portfolio import TotalPortfolio
+
+FIRST_DAY = date(2024, 1, 1)
+
+
+def write_fixtures(path, prices: dict[str, float], last_day: date, splits: list[tuple[date, str, float]] = ()) -> None:
+    """Close of every day up to last_day for each ticker, Yahoo closes are adjusted for splits, so they are in the scale of today"""
+    days = [FIRST_DAY + timedelta(days=x) for x in range((last_day - FIRST_DAY).days + 1)]
+    pl.DataFrame({
+        'date': [x.isoformat() for x in days for _ in prices],
+        'ticker': list(prices) * len(days),
+        'price': list(prices.values()) * len(days),
+    }).write_csv(path / 'prices.csv')
+    pl.DataFrame({
+        'date': [x[0].isoformat() for x in splits],
+        'ticker': [x[1] for x in splits],
+        'splits': [x[2] for x in splits],
+    }, columns={'date': pl.Utf8, 'ticker': pl.Utf8, 'splits': pl.Float64}).write_csv(path / 'splits.csv')
+
+
+@pytest.fixture
+def load_prices(tmp_path, monkeypatch):
+    """Loads prices of tickers from FIRST_DAY to last_day in a fresh total portfolio with caches in tmp_path"""
+    run_path = tmp_path / 'src' / 'ibkr_jasper'
+    run_path.mkdir(parents=True)
+    monkeypatch.chdir(run_path)
+
+    def load(tickers: list[str], last_day: date) -> TotalPortfolio:
+        monkeypatch.setattr(TotalPortfolio, 'get_date_range_for_load', staticmethod(lambda x: (x, last_day)))
+        total_portfolio = TotalPortfolio(FilePriceSource(tmp_path))
+        total_portfolio.tickers = set(tickers)
+        total_portfolio.inception_date = FIRST_DAY
+        total_portfolio.load_prices_and_splits()
+        return total_portfolio
+
+    return load
+
+
+def get_prices(total_portfolio: TotalPortfolio) -> dict[str, list[float]]:
+    prices = total_portfolio.prices.sort(['ticker', 'date']).with_columns(pl.col('ticker').cast(pl.Utf8))
+    return {x: prices.filter(pl.col('ticker') == x)['price'].to_list() for x in sorted(set(prices['ticker'].to_list()))}
+
+
+def test_tickers_without_prices_are_loaded_next_time(tmp_path, load_prices):
+    write_fixtures(tmp_path, {'A': 10.0}, date(2024, 1, 5))
+    total_portfolio = load_prices(['A', 'B'], date(2024, 1, 5))
+    assert total_portfolio.prices_coverage.rows() == [('A', FIRST_DAY, date(2024, 1, 5))]
+
+    write_fixtures(tmp_path, {'A': 10.0, 'B': 20.0}, date(2024, 1, 5))
+    assert get_prices(load_prices(['A', 'B'], date(2024, 1, 5))) == {'A': [10.0] * 5, 'B': [20.0] * 5}
+
+
+def test_new_split_reloads_whole_history_of_ticker(tmp_path, load_prices):
+    write_fixtures(tmp_path, {'A': 100.0, 'B': 20.0}, date(2024, 1, 5))
+    load_prices(['A', 'B'], date(2024, 1, 5))
+
+    # after 2:1 split of A all its closes are halved
+    write_fixtures(tmp_path, {'A': 50.0, 'B': 20.0}, date(2024, 1, 10), [(date(2024, 1, 8), 'A', 2.0)])
+    total_portfolio = load_prices(['A', 'B'], date(2024, 1, 10))
+    assert get_prices(total_portfolio) == {'A': [50.0] * 10, 'B': [20.0] * 10}
+    assert total_portfolio.splits.select(pl.col('ticker').cast(pl.Utf8))['ticker'].to_list() == ['A']
+    assert total_portfolio.prices_coverage.rows() == [('A', FIRST_DAY, date(2024, 1, 10)), ('B', FIRST_DAY, date(2024, 1, 10))]
+
+
+def test_cache_with_wrong_format_is_loaded_again(tmp_path, load_prices):
+    write_fixtures(tmp_path, {'A': 10.0}, date(2024, 1, 5))
+    total_portfolio = load_prices(['A'], date(2024, 1, 5))
+    # coverage has no gaps, but prices were saved in another format
+    pl.DataFrame({'date': [FIRST_DAY], 'ticker': ['A'], 'close': [1.0]}).write_ipc(total_portfolio.prices_cache.file_path)
+    assert get_prices(load_prices(['A'], date(2024, 1, 5))) == {'A': [10.0] * 5}
+    assert get_prices(load_prices(['A'], date(2024, 1, 5))) == {'A': [10.0] * 5}
@@ -0,0 +1,39 @@
+import numpy as np
+import pytest
+
+from src.ibkr_jasper.classes.risk_metrics import RiskMetrics
+
+
+@pytest.fixture
+def metrics() -> RiskMetrics:
+    days = np.arange(np.datetime64('2024-01-01'), np.datetime64('2024-01-06'))
+    return RiskMetrics(days, np.array([0.1, -0.5, 1.0, -0.1, 0.02]), np.array([0.05, -0.4, 0.9, 0.0, 0.02]))
+
+
+def test_volatility_and_tracking_error_are_annual_std_of_windows(metrics):
+    volatility = metrics.get_volatility(3)
+    assert np.isnan(volatility[:2]).all()
+    expected = [np.std(metrics.returns[x - 2:x + 1], ddof=1) * np.sqrt(252) for x in range(2, 5)]
+    assert volatility[2:] == pytest.approx(expected)
+    active = metrics.returns - metrics.benchmark_returns
+    assert metrics.get_tracking_error(5)[-1] == pytest.approx(np.std(active, ddof=1) * np.sqrt(252))
+
+
+def test_sharpe_is_annual_excess_return_per_volatility(metrics):
+    window = metrics.returns[1:]
+    expected = (window.mean() - 0.0252 / 252) / np.std(window, ddof=1) * np.sqrt(252)
+    assert metrics.get_sharpe(4, 0.0252)[-1] == pytest.approx(expected)
+
+
+def test_max_drawdown_is_largest_fall_from_peak_within_window(metrics):
+    # wealth is 1, 1.1, 0.55, 1.1, 0.99, 1.0098
+    drawdowns = metrics.get_max_drawdown(2)
+    assert np.isnan(drawdowns[0])
+    assert drawdowns[1:] == pytest.approx([-0.5, -0.5, -0.1, -0.1])
+    assert np.isnan(metrics.get_max_drawdown(6)).all()
+
+
+def test_metrics_of_incomplete_windows_are_null(metrics):
+    frame = metrics.get_metrics(4)
+    assert frame.columns == ['date', 'volatility', 'max drawdown', 'sharpe', 'tracking error']
+    assert frame['volatility'].null_count() == 3 and frame['max drawdown'].to_list()[3:] == pytest.approx([-0.5, -0.5])
@@ -0,0 +1,50 @@
+import numpy as np
+import polars as pl
+import pytest
+
+from src.ibkr_jasper.classes.price_matrix import PriceMatrix
+from src.ibkr_jasper.classes.scenario_engine import ScenarioEngine
+from src.ibkr_jasper.classes.total_portfolio import TotalPortfolio
+
+
+@pytest.fixture
+def engine() -> ScenarioEngine:
+    # p1 holds only A in USD, p2 holds A and B in EUR half by half by targets
+    return ScenarioEngine(['p1', 'p2'], ['A', 'B'], ['EUR', 'USD'], ['USD', 'EUR'], np.array([[10.0, 0.0], [5.0, 4.0]]), np.array([100.0, 50.0]),
+                          np.array([[100.0, 0.0], [50.0, 50.0]]), np.array([1000.0, 1000.0]))
+
+
+def test_price_and_fx_shocks_revalue_positions(engine):
+    results = engine.evaluate({'A': [-0.2, 0.0]}, {'EUR': [0.0, 0.1]})
+    assert results.values == pytest.approx(np.array([[800.0, 600.0], [1000.0, 720.0]]))
+    p2 = results.get_portfolio('p2').filter(pl.col('scenario') == 0)
+    assert p2['fact'].to_list() == pytest.approx([40.0, 20.0])
+    assert p2['diff'].to_list() == pytest.approx([-10.0, -30.0])
+    assert p2['lots to buy'].to_list() == pytest.approx([1.25, 6.0])
+
+
+def test_shocks_as_matrix_frame_and_none_are_the_same(engine):
+    matrix = engine.evaluate(np.array([[-0.2, 0.1]])).values
+    assert engine.evaluate(pl.DataFrame({'A': [-0.2], 'B': [0.1]})).values.tolist() == matrix.tolist()
+    assert engine.evaluate().values.tolist() == [[1000.0, 700.0]]
+    with pytest.raises(AssertionError, match='Unknown columns of shocks: C'):
+        engine.evaluate({'C': [0.1]})
+
+
+def test_engine_takes_holdings_of_total_portfolio():
+    total_portfolio = TotalPortfolio()
+    total_portfolio.all_portfolios = {'p2': {'A': 50.0, 'B': 50.0}, 'p1': {'A': 100.0}}
+    total_portfolio.all_target_values = {'p1': 1000.0, 'p2': 1000.0}
+    total_portfolio.trades = pl.DataFrame({
+        'ticker': ['A', 'A', 'B', 'A', 'C'],
+        'portfolio': ['p1', 'p1', 'p2', 'p2', 'p2'],
+        'quantity': [12.0, -2.0, 4.0, 5.0, 1.0],
+        'curr': ['USD', 'USD', 'EUR', 'USD', 'USD'],
+        'asset_type': ['Stocks'] * 5,
+    })
+    total_portfolio.price_matrix = PriceMatrix(np.array(['2024-01-02'], dtype='datetime64[us]'), ['B', 'A'], np.array([[50.0, 100.0]]))
+    engine = ScenarioEngine.from_total_portfolio(total_portfolio)
+    assert (engine.portfolios, engine.tickers, engine.currencies) == (['p1', 'p2'], ['A', 'B'], ['EUR', 'USD'])
+    assert engine.positions.tolist() == [[10.0, 0.0], [5.0, 4.0]]
+    assert engine.prices.tolist() == [100.0, 50.0]
+    assert engine.evaluate(fx_shocks={'EUR': [0.1]}).values == pytest.approx(np.array([[1000.0, 720.0]]))
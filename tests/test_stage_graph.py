@@ -0,0 +1,102 @@
+from datetime import date
+
+import polars as pl
+import pytest
+
+from src.ibkr_jasper.classes.stage_graph import Stage, StageGraph
+from src.ibkr_jasper.classes.stage_store import StageStore
+
+
+class Owner:
+    """Numbers are kept as lazy plan like frames of TotalPortfolio, total is a plain value"""
+    numbers = property(lambda self: self.numbers_plan.collect(), lambda self, frame: setattr(self, 'numbers_plan', frame.lazy()))
+
+    def __init__(self, path, source: str, label: str = 'a', rebuild: bool = False) -> None:
+        self.debug = False
+        self.rebuild = rebuild
+        self.runs = []
+        self.numbers_plan = None
+        self.total = None
+        self.labels = None
+        stages = [
+            Stage('Read numbers', self.read_numbers, ['source'], ['numbers']),
+            Stage('Sum numbers', self.sum_numbers, ['numbers'], ['total']),
+            Stage('Read labels', self.read_labels, ['label'], ['labels']),
+        ]
+        self.graph = StageGraph(self, stages, {'source': lambda: source, 'label': lambda: label}, StageStore(path))
+        self.source = source
+        self.label = label
+
+    def read_numbers(self) -> None:
+        self.runs.append('read_numbers')
+        self.numbers = pl.DataFrame({'x': [int(x) for x in self.source.split(',')]})
+
+    def sum_numbers(self) -> None:
+        self.runs.append('sum_numbers')
+        self.total = self.numbers['x'].sum()
+
+    def read_labels(self) -> None:
+        self.runs.append('read_labels')
+        self.labels = set(self.label)
+
+
+@pytest.fixture
+def run(tmp_path):
+
+    def run(outputs, *args, **kwargs) -> Owner:
+        owner = Owner(tmp_path, *args, **kwargs)
+        owner.graph.run(outputs)
+        return owner
+
+    return run
+
+
+def test_only_stages_of_asked_outputs_run(run):
+    owner = run(['total'], '1,2,3')
+    assert owner.runs == ['read_numbers', 'sum_numbers'] and owner.total == 6 and owner.labels is None
+
+
+def test_saved_outputs_are_taken_without_inputs(run):
+    run(['total', 'labels'], '1,2,3', 'ab')
+    owner = run(['total', 'labels'], '1,2,3', 'ab')
+    assert owner.runs == [] and owner.total == 6 and owner.labels == {'a', 'b'}
+    assert owner.numbers_plan is None
+
+
+def test_changed_input_runs_its_stages_again(run):
+    run(['total', 'labels'], '1,2,3', 'ab')
+    owner = run(['total', 'labels'], '1,2,3', 'abc')
+    assert owner.runs == ['read_labels'] and owner.labels == {'a', 'b', 'c'}
+    owner = run(['total', 'labels'], '1,2,4', 'abc')
+    assert owner.runs == ['read_numbers', 'sum_numbers'] and owner.total == 7
+
+
+def test_rebuild_runs_every_stage(run):
+    run(['total'], '1,2,3')
+    assert run(['total'], '1,2,3', rebuild=True).runs == ['read_numbers', 'sum_numbers']
+
+
+def test_graph_keeps_outputs_of_its_previous_run(run):
+    owner = run(['total'], '1,2,3')
+    owner.graph.run(['total'])
+    assert owner.runs == ['read_numbers', 'sum_numbers']
+
+
+def test_lazy_outputs_are_scans_of_saved_files(run):
+    owner = run(['numbers'], '1,2,3')
+    assert 'IPC SCAN' in owner.numbers_plan.describe_plan()
+    owner = run(['numbers'], '1,2,3')
+    assert owner.runs == [] and 'IPC SCAN' in owner.numbers_plan.describe_plan()
+    assert owner.numbers['x'].to_list() == [1, 2, 3]
+
+
+def test_store_gives_outputs_of_the_same_key_only(tmp_path):
+    store = StageStore(tmp_path)
+    outputs = {'frame': pl.DataFrame({'x': [1]}), 'tickers': {'B', 'A'}, 'day': date(2024, 1, 2), 'count': 3}
+    store.save('stage', 'key', outputs)
+    loaded = store.load('stage', 'key')
+    assert loaded.pop('frame').frame_equal(outputs.pop('frame'))
+    assert loaded == outputs
+    assert store.load('stage', 'other key') is None
+    store.get_cache('stage', 'frame').file_path.unlink()
+    assert store.load('stage', 'key') is None
@@ -0,0 +1,64 @@
+import os
+
+import polars as pl
+
+from src.ibkr_jasper.classes.statement_cache import StatementCache
+
+
+def write_section(cache: StatementCache, report_file, section: str) -> None:
+    cache.path.mkdir(parents=True, exist_ok=True)
+    pl.DataFrame({'amount': [1.0]}).write_ipc(cache.get_section_paths(report_file, [section])[section])
+
+
+def test_changed_statement_gets_new_key(tmp_path):
+    report_file = tmp_path / 'U1_2023.csv'
+    report_file.write_text('Statement,Data,a\n')
+    cache = StatementCache(tmp_path / 'cache')
+    key = cache.get_key(report_file)
+    write_section(cache, report_file, 'io')
+    assert cache.contains(report_file, ['io']) and not cache.contains(report_file, ['io', 'trades'])
+    assert cache.load(report_file, ['io'])['io'].collect()['amount'].to_list() == [1.0]
+
+    report_file.write_text('Statement,Data,bb\n')
+    assert cache.get_key(report_file) != key
+    assert not cache.contains(report_file, ['io'])
+    assert cache.load(report_file, ['io']) is None
+
+
+def test_unchanged_statement_is_not_hashed_again(tmp_path, monkeypatch):
+    report_file = tmp_path / 'U1_2023.csv'
+    report_file.write_text('Statement,Data,a\n')
+    cache = StatementCache(tmp_path / 'cache')
+    key = cache.get_key(report_file)
+    cache.save_index()
+
+    hashed = []
+    monkeypatch.setattr(StatementCache, 'get_file_hash', staticmethod(lambda x: hashed.append(x) or 'new'))
+    assert StatementCache(tmp_path / 'cache').get_key(report_file) == key
+    assert hashed == []
+    # same size and content with another mtime is hashed again
+    stat = report_file.stat()
+    os.utime(report_file, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+    assert StatementCache(tmp_path / 'cache').get_key(report_file) == 'new'
+
+
+def test_sections_of_gone_statements_and_old_versions_are_removed(tmp_path, monkeypatch):
+    kept_file, gone_file = tmp_path / 'U1_2023.csv', tmp_path / 'U1_2024.csv'
+    kept_file.write_text('Statement,Data,a\n')
+    gone_file.write_text('Statement,Data,b\n')
+    cache = StatementCache(tmp_path / 'cache')
+    write_section(cache, kept_file, 'io')
+    write_section(cache, gone_file, 'io')
+    cache.save_index()
+
+    cache = StatementCache(tmp_path / 'cache')
+    cache.get_key(kept_file)
+    cache.save_index()
+    assert cache.contains(kept_file, ['io']) and not cache.contains(gone_file, ['io'])
+
+    monkeypatch.setattr(StatementCache, 'VERSION', StatementCache.VERSION + 1)
+    cache = StatementCache(tmp_path / 'cache')
+    assert cache.files == {}
+    cache.get_key(kept_file)
+    cache.save_index()
+    assert list(cache.path.glob('*.ipc')) == []
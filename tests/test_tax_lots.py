@@ -0,0 +1,50 @@
+from datetime import datetime
+
+import polars as pl
+import pytest
+
+from src.ibkr_jasper.classes.tax_lots import TaxLots
+
+
+@pytest.fixture
+def trades() -> pl.DataFrame:
+    return pl.DataFrame({
+        'datetime': [datetime(2023, 1, 2), datetime(2023, 2, 1), datetime(2023, 3, 1), datetime(2023, 3, 1)],
+        'ticker': ['A', 'A', 'A', 'B'],
+        'quantity': [10.0, 5.0, -12.0, 7.0],
+        'price': [100.0, 80.0, 90.0, 50.0],
+        'rate': [90.0, 100.0, 95.0, 95.0],
+        'portfolio': ['p1', 'p2', 'p1', 'p1'],
+    })
+
+
+def test_sells_close_first_bought_shares(trades):
+    lots = TaxLots(trades).lots.sort(['ticker', 'datetime'])
+    assert lots['remaining'].to_list() == [0.0, 3.0, 7.0]
+    assert lots['cost'].to_list() == [0.0, 240.0, 350.0]
+    assert lots['cost_rub'].to_list() == [0.0, 24000.0, 33250.0]
+    assert TaxLots(trades).get_open_lots()['ticker'].to_list() == ['A', 'B']
+
+
+def test_realized_gains_are_split_between_lots(trades):
+    realized = TaxLots(trades).realized
+    assert realized.select(['buy portfolio', 'quantity', 'gain', 'gain_rub']).rows() == [('p1', 10.0, -100.0, -4500.0), ('p2', 2.0, 20.0, 1100.0)]
+    gains = TaxLots(trades).get_realized_gains()
+    assert gains.select(['ticker', 'quantity', 'gain', 'gain_rub']).rows() == [('A', 12.0, -80.0, -3400.0)]
+
+
+def test_remaining_match_fifo_walk(generated_trades, unsplit_tickers):
+    trades = generated_trades.filter(pl.col('ticker').is_in(unsplit_tickers)).with_columns(pl.lit(1.0).alias('rate'))
+    expected = []
+    for ticker in sorted(unsplit_tickers):
+        lots = []
+        for quantity in trades.filter(pl.col('ticker') == ticker)['quantity'].to_list():
+            if quantity > 0:
+                lots.append(quantity)
+                continue
+            for i, remaining in enumerate(lots):
+                closed = min(remaining, -quantity)
+                lots[i] -= closed
+                quantity += closed
+        expected += lots
+    assert TaxLots(trades).lots['remaining'].to_list() == expected
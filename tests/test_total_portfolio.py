@@ -0,0 +1,67 @@
+from datetime import date, datetime
+
+import numpy as np
+import polars as pl
+
+from src.ibkr_jasper.classes.price_matrix import PriceMatrix
+from src.ibkr_jasper.classes.tax_lots import TaxLots
+from src.ibkr_jasper.classes.total_portfolio import TotalPortfolio
+
+
+def test_allocations_split_fills_by_cumulative_quantity():
+    fills = pl.DataFrame({
+        'datetime': [datetime(2024, 1, 2, 11), datetime(2024, 1, 2, 10), datetime(2024, 1, 2, 12)],
+        'ticker': ['A', 'A', 'A'],
+        'quantity': [4.0, 6.0, -5.0],
+        'price': [10.5, 10.0, 11.0],
+        'curr': ['USD', 'USD', 'USD'],
+        'fee': [-0.8, -1.2, -1.0],
+        'asset_type': ['Stocks', 'Stocks', 'Stocks'],
+        'code': ['O', 'O', 'C'],
+    }).with_columns([
+        pl.col('datetime').cast(pl.Date).alias('date'),
+        pl.col('quantity').sign().alias('sign'),
+    ])
+    allocations = pl.DataFrame({
+        'date': [date(2024, 1, 2), date(2024, 1, 2), date(2024, 1, 2)],
+        'ticker': ['A', 'A', 'A'],
+        'quantity': [3.0, 7.0, -5.0],
+        'portfolio': ['p1', 'p2', 'p1'],
+    }).with_columns(pl.col('quantity').sign().alias('sign'))
+
+    trades = TotalPortfolio.match_allocations(fills.lazy(), allocations.lazy()).collect().sort(['datetime', 'portfolio'])
+    assert trades.select(['price', 'portfolio', 'quantity']).rows() == [(10.0, 'p1', 3.0), (10.0, 'p2', 3.0), (10.5, 'p2', 4.0), (11.0, 'p1', -5.0)]
+    assert trades['fee'][:3].to_list() == [-0.6, -0.6, -0.8]
+
+
+def test_overlapping_statements_give_every_day_once():
+    periods = [
+        ('U1', date(2023, 1, 1), date(2023, 12, 31)),
+        ('U1', date(2023, 6, 1), date(2024, 3, 31)),
+        ('U1', date(2024, 1, 1), date(2024, 3, 31)),
+        ('U2', date(2023, 1, 1), date(2023, 12, 31)),
+        ('U2', date(2023, 1, 1), date(2023, 12, 31)),
+        ('U1', None, None),
+    ]
+    ranges = TotalPortfolio.get_statements_ranges(periods)
+    assert ranges[:2] == [(date(2023, 1, 1), date(2023, 5, 31)), (date(2023, 6, 1), date(2024, 3, 31))]
+    # shorter statement and the first of equal ones are covered whole by others
+    assert ranges[2][0] > ranges[2][1] and ranges[3][0] > ranges[3][1]
+    assert ranges[4:] == [(date(2023, 1, 1), date(2023, 12, 31)), None]
+
+
+def test_tlh_loss_in_rubles_is_on_remaining_shares():
+    trades = pl.DataFrame({
+        'datetime': [datetime(2023, 1, 2), datetime(2023, 2, 1), datetime(2023, 3, 1)],
+        'ticker': ['A', 'A', 'A'],
+        'quantity': [10.0, 5.0, -12.0],
+        'price': [100.0, 80.0, 90.0],
+        'fee': [-1.0, -1.0, -1.0],
+        'rate': [90.0, 100.0, 95.0],
+        'portfolio': ['p1', 'p1', 'p1'],
+    }).with_columns((pl.col('price') * pl.col('rate')).alias('price_rub'))
+    portfolio = TotalPortfolio()
+    portfolio.tax_lots = TaxLots(trades)
+    portfolio.price_matrix = PriceMatrix(np.array(['2024-01-02'], dtype='datetime64[us]'), ['A'], np.array([[70.0]]))
+    portfolio.get_tlh_trades()
+    assert portfolio.tlh_trades.select(['quantity', 'diff', 'cur_price_rub', 'diff_rub']).rows() == [(3.0, -10.0, 7000.0, -3000.0)]